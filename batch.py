@@ -0,0 +1,152 @@
+"""Queue and run large offline campaigns from the command line.
+
+Jobs live in the same SQLite queue as the /batches endpoint (BATCH_PATH), so
+a job can be submitted over HTTP and run here, or the other way round.
+
+    python batch.py submit prospects.csv
+    python batch.py submit prospects.csv --segment --opener
+    python batch.py submit prospects.csv --local
+    python batch.py run --rpm 120
+    python batch.py status [JOB_ID]
+    python batch.py export JOB_ID -o emails.jsonl
+    python batch.py export JOB_ID --format csv --gzip -o emails.csv.gz --resume
+
+If `run` is interrupted, start it again: finished rows are kept and only the
+remaining ones are generated.
+"""
+import argparse
+import json
+import os
+import sys
+import uuid
+
+
+def submit(args):
+    from campaigns import parse_prospects
+    from cursor_prompt import BATCH_MAX_ROWS, batch_queue
+
+    with open(args.file, 'rb') as f:
+        prospects = parse_prospects(f.read(), args.file)
+    if not prospects:
+        print("No prospects found in the file.")
+        return 1
+    if len(prospects) > BATCH_MAX_ROWS:
+        print(f"Too many prospects: {len(prospects)} (limit is {BATCH_MAX_ROWS}).")
+        return 1
+    options = {'fresh': args.fresh}
+    if args.local:
+        options.update(local=True, scope=uuid.uuid4().hex if args.fresh else None)
+    elif args.segment:
+        options.update(segment=True, opener=args.opener, scope=uuid.uuid4().hex if args.fresh else None)
+    job_id = batch_queue.submit(prospects, **options)
+    print(f"Queued job {job_id} with {len(prospects)} prospects.")
+    return 0
+
+
+def run(args):
+    from batch_queue import BatchWorker
+    from cursor_prompt import BATCH_REQUESTS_PER_MINUTE, batch_queue, dispatch_prospect
+
+    if args.reclaim:
+        # Only safe when no other worker is using the queue
+        print(f"Returned {batch_queue.reclaim_all()} interrupted rows to the queue.")
+    worker = BatchWorker(batch_queue, dispatch_prospect,
+                         requests_per_minute=args.rpm or BATCH_REQUESTS_PER_MINUTE)
+    print(f"Processing {batch_queue.pending_count()} queued rows (Ctrl+C to pause)...")
+    try:
+        if not worker.run(until_empty=not args.forever):
+            print("Another worker is already draining this queue (e.g. the web server; "
+                  "set BATCH_WORKER_ENABLED=0 there to use batch.py run).")
+            return 1
+    except KeyboardInterrupt:
+        print("\nPaused; run again to continue where this stopped.")
+        return 130
+    held = batch_queue.pending_count()
+    if held:
+        print(f"{held} rows are held by other workers; use --reclaim if those workers are gone.")
+    else:
+        print("Queue is empty.")
+    return 0
+
+
+def status(args):
+    from cursor_prompt import batch_queue
+
+    jobs = [batch_queue.summary(args.job_id)] if args.job_id else batch_queue.jobs()
+    if args.job_id and jobs[0] is None:
+        print(f"Batch job {args.job_id} not found.")
+        return 1
+    for job in jobs:
+        print(json.dumps(job))
+    return 0
+
+
+def export(args):
+    from cursor_prompt import EXPORT_SENDER, batch_queue
+    from exporters import byte_slice, export_chunks
+
+    summary = batch_queue.summary(args.job_id)
+    if summary is None:
+        print(f"Batch job {args.job_id} not found.")
+        return 1
+    chunks = export_chunks(batch_queue.iter_results(args.job_id), args.format, args.gzip,
+                           sender=EXPORT_SENDER, created_at=summary['created_at'])
+    # Continue an interrupted export: skip the bytes already in the file and append the rest
+    offset = os.path.getsize(args.output) if args.resume and args.output and os.path.exists(args.output) else 0
+    if offset and summary['status'] != 'completed':
+        print("Only exports of completed jobs can be resumed.")
+        return 1
+    out = open(args.output, 'ab' if offset else 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in byte_slice(chunks, offset):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('submit', help='queue a CSV or JSONL prospect file')
+    p.add_argument('file')
+    p.add_argument('--fresh', action='store_true', help='skip the response cache')
+    p.add_argument('--segment', action='store_true',
+                   help='generate one email per segment and fill in each prospect\'s details')
+    p.add_argument('--opener', action='store_true', help='with --segment, write a personalized first line per prospect')
+    p.add_argument('--local', action='store_true',
+                   help='write every email with the local template engine, without calling a provider')
+    p.set_defaults(handler=submit)
+
+    p = commands.add_parser('run', help='generate queued rows until the queue is empty')
+    p.add_argument('--rpm', type=float, help='provider requests per minute (default BATCH_REQUESTS_PER_MINUTE)')
+    p.add_argument('--forever', action='store_true', help='keep waiting for new jobs')
+    p.add_argument('--reclaim', action='store_true',
+                   help='immediately retry rows left running by a crashed worker')
+    p.set_defaults(handler=run)
+
+    p = commands.add_parser('status', help='show job progress')
+    p.add_argument('job_id', nargs='?')
+    p.set_defaults(handler=status)
+
+    p = commands.add_parser('export', help='write finished rows as JSON lines, CSV or MBOX')
+    p.add_argument('job_id')
+    p.add_argument('-o', '--output', help='file to write (default stdout)')
+    p.add_argument('--format', choices=['jsonl', 'csv', 'mbox'], default='jsonl', help='output format (default jsonl)')
+    p.add_argument('--gzip', action='store_true', help='gzip the output')
+    p.add_argument('--resume', action='store_true', help='append to a partly written --output instead of starting over')
+    p.set_defaults(handler=export)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # A command-line run has no use for background health probes
+    os.environ.setdefault("HEALTH_CHECK_ENABLED", "0")
+    sys.exit(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
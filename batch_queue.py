@@ -0,0 +1,339 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: several workers may drain one queue, each at its own pace
+    fcntl = None
+
+
+class BatchQueue:
+    """Durable queue of offline generation jobs in a WAL-mode SQLite file.
+
+    Every prospect is a row with its own status, so progress is checkpointed
+    as each email is written and a crashed worker's rows are picked up again
+    once their lease runs out. Several processes can share one file.
+    """
+
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.local = threading.local()
+        db = self._connect()
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS batch_jobs ("
+                "id TEXT PRIMARY KEY, total INTEGER NOT NULL, options TEXT NOT NULL, "
+                "created_at REAL NOT NULL, finished_at REAL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS batch_rows ("
+                "job_id TEXT NOT NULL, idx INTEGER NOT NULL, inputs TEXT NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', result TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "claimed_by TEXT, claimed_at REAL, PRIMARY KEY (job_id, idx))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS batch_rows_status ON batch_rows (status, job_id, idx)")
+
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def submit(self, rows, **options):
+        """Store a new job and all of its rows; return the job id."""
+        job_id = uuid.uuid4().hex
+        db = self._connect()
+        with db:
+            db.execute(
+                "INSERT INTO batch_jobs (id, total, options, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, len(rows), json.dumps(options), time.time())
+            )
+            db.executemany(
+                "INSERT INTO batch_rows (job_id, idx, inputs) VALUES (?, ?, ?)",
+                ((job_id, index, json.dumps(row)) for index, row in enumerate(rows))
+            )
+        return job_id
+
+    def claim(self, worker_id, limit=10):
+        """Reserve up to ``limit`` pending rows, oldest job first.
+
+        Rows claimed by a worker that stopped renewing its lease (e.g. it
+        crashed) count as pending again.
+        """
+        now = time.time()
+        db = self._connect()
+        with db:
+            db.execute(
+                "UPDATE batch_rows SET status = 'running', claimed_by = ?, claimed_at = ? "
+                "WHERE rowid IN (SELECT batch_rows.rowid FROM batch_rows "
+                "JOIN batch_jobs ON batch_jobs.id = batch_rows.job_id "
+                "WHERE batch_rows.status = 'pending' OR (batch_rows.status = 'running' AND batch_rows.claimed_at < ?) "
+                "ORDER BY batch_jobs.created_at, batch_rows.idx LIMIT ?)",
+                (worker_id, now, now - self.lease_seconds, limit)
+            )
+            rows = db.execute(
+                "SELECT batch_rows.job_id, batch_rows.idx, batch_rows.inputs, batch_rows.attempts, batch_jobs.options "
+                "FROM batch_rows JOIN batch_jobs ON batch_jobs.id = batch_rows.job_id "
+                "WHERE batch_rows.status = 'running' AND batch_rows.claimed_by = ? AND batch_rows.claimed_at = ? "
+                "ORDER BY batch_jobs.created_at, batch_rows.idx",
+                (worker_id, now)
+            ).fetchall()
+        return [
+            {'job_id': job_id, 'index': idx, 'inputs': json.loads(inputs), 'attempts': attempts,
+             'options': json.loads(options)}
+            for job_id, idx, inputs, attempts, options in rows
+        ]
+
+    def renew(self, worker_id):
+        """Extend the lease on every row a worker holds; return them as ``(job_id, index)`` pairs.
+
+        A row missing from the result was reclaimed by another worker after
+        the lease ran out, and must not be generated again.
+        """
+        db = self._connect()
+        with db:
+            db.execute(
+                "UPDATE batch_rows SET claimed_at = ? WHERE status = 'running' AND claimed_by = ?",
+                (time.time(), worker_id)
+            )
+            return set(db.execute(
+                "SELECT job_id, idx FROM batch_rows WHERE status = 'running' AND claimed_by = ?", (worker_id,)
+            ).fetchall())
+
+    def complete(self, worker_id, job_id, index, result, status='done'):
+        """Checkpoint one finished row; False if the worker no longer held it."""
+        db = self._connect()
+        with db:
+            updated = db.execute(
+                "UPDATE batch_rows SET status = ?, result = ?, attempts = attempts + 1, claimed_by = NULL "
+                "WHERE job_id = ? AND idx = ? AND status = 'running' AND claimed_by = ?",
+                (status, json.dumps(result), job_id, index, worker_id)
+            ).rowcount
+            self._finish_if_done(db, job_id)
+        return bool(updated)
+
+    def release(self, worker_id, job_id, index):
+        """Put a claimed row back so it is retried later; False if the worker no longer held it."""
+        db = self._connect()
+        with db:
+            return bool(db.execute(
+                "UPDATE batch_rows SET status = 'pending', attempts = attempts + 1, claimed_by = NULL, claimed_at = NULL "
+                "WHERE job_id = ? AND idx = ? AND status = 'running' AND claimed_by = ?",
+                (job_id, index, worker_id)
+            ).rowcount)
+
+    def release_worker(self, worker_id):
+        """Return every row still claimed by a worker, e.g. when it shuts down."""
+        db = self._connect()
+        with db:
+            return db.execute(
+                "UPDATE batch_rows SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+                "WHERE status = 'running' AND claimed_by = ?",
+                (worker_id,)
+            ).rowcount
+
+    def reclaim_all(self):
+        """Return every running row to the queue, after a crash with no other workers alive."""
+        db = self._connect()
+        with db:
+            return db.execute(
+                "UPDATE batch_rows SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+                "WHERE status = 'running'"
+            ).rowcount
+
+    def _finish_if_done(self, db, job_id):
+        remaining = db.execute(
+            "SELECT COUNT(*) FROM batch_rows WHERE job_id = ? AND status IN ('pending', 'running')", (job_id,)
+        ).fetchone()[0]
+        if not remaining:
+            db.execute(
+                "UPDATE batch_jobs SET finished_at = ? WHERE id = ? AND finished_at IS NULL", (time.time(), job_id)
+            )
+
+    def summary(self, job_id):
+        """Progress of one job, or None if it doesn't exist."""
+        db = self._connect()
+        job = db.execute(
+            "SELECT total, created_at, finished_at FROM batch_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if job is None:
+            return None
+        total, created_at, finished_at = job
+        counts = dict(db.execute(
+            "SELECT status, COUNT(*) FROM batch_rows WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        if finished_at is not None:
+            status = 'completed'
+        elif counts.get('done') or counts.get('failed') or counts.get('running'):
+            status = 'running'
+        else:
+            status = 'queued'
+        return {
+            'job_id': job_id,
+            'status': status,
+            'total': total,
+            'completed': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'pending': counts.get('pending', 0) + counts.get('running', 0),
+            'created_at': created_at,
+            'elapsed_seconds': round((finished_at or time.time()) - created_at, 3)
+        }
+
+    def jobs(self, limit=50):
+        """Summaries of the most recent jobs."""
+        ids = self._connect().execute(
+            "SELECT id FROM batch_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self.summary(job_id) for (job_id,) in ids]
+
+    def pending_count(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM batch_rows WHERE status IN ('pending', 'running')"
+        ).fetchone()[0]
+
+    def export_jsonl(self, job_id, chunk_size=500):
+        """Yield one JSON line per finished row, in input order, reading in chunks."""
+        for record in self.iter_results(job_id, chunk_size):
+            yield json.dumps(record) + '\n'
+
+    def iter_results(self, job_id, chunk_size=500):
+        """Yield a dict per finished row, in input order, reading in chunks so memory stays flat."""
+        db = self._connect()
+        last = -1
+        while True:
+            rows = db.execute(
+                "SELECT idx, inputs, status, result FROM batch_rows "
+                "WHERE job_id = ? AND status IN ('done', 'failed') AND idx > ? ORDER BY idx LIMIT ?",
+                (job_id, last, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            for idx, inputs, status, result in rows:
+                record = {'index': idx, 'status': status, 'inputs': json.loads(inputs)}
+                record.update(json.loads(result) if result else {})
+                yield record
+                last = idx
+
+
+class BatchWorker:
+    """Background thread draining a BatchQueue one row at a time.
+
+    Requests are paced to ``requests_per_minute``. ``generate`` takes a
+    prospect dict and returns a result dict; when the result is marked
+    ``rate_limited`` the row is put back and the pace is halved for a while.
+    A result may report how many provider ``requests`` it made (default 1),
+    so rows rendered locally don't wait for the pace.
+
+    Only one worker drains a queue file at a time, across processes: the
+    others (e.g. the rest of the web server's workers) wait on a lock file
+    next to it and take over when that worker stops.
+    """
+
+    def __init__(self, queue, generate, requests_per_minute=60, max_attempts=5, idle_wait=2.0):
+        self.queue = queue
+        self.generate = generate
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.max_attempts = max_attempts
+        self.idle_wait = idle_wait
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # Claim only as many rows as can be finished well within the lease
+        self.claim_size = max(1, min(10, int(queue.lease_seconds / 2 / max(self.interval, 0.1))))
+        self.backoff = 0.0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.lock_file = None
+
+    def _acquire_queue(self):
+        """Take the queue's worker lock without waiting; True when this worker may drain it."""
+        if fcntl is None:
+            return True
+        lock_file = open(self.queue.path + '.worker.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def _release_queue(self):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def start(self):
+        """Start the worker thread once."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name='batch-worker', daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=None):
+        """Finish the current row, hand back the rest of the claim and stop."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self, until_empty=False):
+        """Process rows until stopped (or, with ``until_empty``, until none can be claimed).
+
+        Returns False without processing anything when ``until_empty`` is set
+        and another worker is draining the queue.
+        """
+        while not self._acquire_queue():
+            if until_empty:
+                return False
+            if self.stop_event.wait(self.idle_wait * 5):
+                return False
+        try:
+            while not self.stop_event.is_set():
+                rows = self.queue.claim(self.worker_id, self.claim_size)
+                if not rows:
+                    if until_empty:
+                        return True
+                    self.stop_event.wait(self.idle_wait)
+                    continue
+                for row in rows:
+                    if self.stop_event.is_set():
+                        break
+                    # Keep the rest of the claim leased while this row is generated
+                    if (row['job_id'], row['index']) not in self.queue.renew(self.worker_id):
+                        continue
+                    self.process(row)
+        finally:
+            self.queue.release_worker(self.worker_id)
+            self._release_queue()
+        return True
+
+    def process(self, row):
+        started = time.monotonic()
+        requests = 1
+        try:
+            result = self.generate(row['inputs'], **row['options'])
+        except Exception as e:
+            self.queue.complete(self.worker_id, row['job_id'], row['index'], {'error': str(e)}, status='failed')
+        else:
+            requests = result.get('requests', 1)
+            if result.get('rate_limited') and row['attempts'] + 1 < self.max_attempts:
+                # Providers are throttling us: retry this row later and slow down
+                self.backoff = min(max(self.backoff * 2, self.interval, 1.0), 300.0)
+                self.queue.release(self.worker_id, row['job_id'], row['index'])
+            else:
+                self.backoff = self.backoff / 2 if self.backoff > 0.5 else 0.0
+                result = {k: v for k, v in result.items() if k not in ('rate_limited', 'requests')}
+                self.queue.complete(self.worker_id, row['job_id'], row['index'], result)
+        # Keep to the configured pace, plus any rate-limit backoff
+        delay = self.interval * requests + self.backoff - (time.monotonic() - started)
+        if delay > 0:
+            self.stop_event.wait(delay)
@@ -0,0 +1,288 @@
+"""Load-test the app offline against local mock DeepSeek and Groq servers.
+
+Starts two mock OpenAI-compatible servers (see mock_llm.py), points the app
+at them and serves it in-process. Simulated users then walk through the chat
+flow (questions, generation, refinements) at the given concurrency, and an
+optional bulk campaign is run. Reports requests/sec, latency percentiles,
+memory per session and which provider (or the template) answered.
+
+    python benchmarks/load_test.py --sessions 200 --concurrency 20
+    python benchmarks/load_test.py --deepseek-error-rate 0.3 --campaign-rows 500
+    python benchmarks/load_test.py --deepseek-hang-rate 0.1 --read-timeout 2 --json results.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from werkzeug.serving import make_server
+
+from mock_llm import MockConfig, start_server
+
+ANSWERS = [
+    'VP of Engineering at mid-size SaaS companies',
+    'An AI code review assistant',
+    'Slow code reviews and bugs reaching production',
+    'Friendly and concise',
+    '20% off the first year for early adopters'
+]
+REFINEMENTS = ['Make it shorter', 'Make it more formal', 'Add more emphasis on saving time']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100, help='simulated chat sessions (default 100)')
+    parser.add_argument('--concurrency', type=int, default=10, help='sessions running at once (default 10)')
+    parser.add_argument('--refinements', type=int, default=2, help='refinements per session (default 2)')
+    parser.add_argument('--stream', action='store_true', help='use /chat/stream instead of /chat')
+    parser.add_argument('--repeat-inputs', action='store_true',
+                        help='give every session the same answers so the response cache is exercised')
+    parser.add_argument('--campaign-rows', type=int, default=0, help='also run a bulk campaign of this size')
+    parser.add_argument('--deepseek-latency-ms', type=float, default=300)
+    parser.add_argument('--groq-latency-ms', type=float, default=150)
+    parser.add_argument('--tokens-per-sec', type=float, default=0, help='mock streaming speed, 0 for instant')
+    parser.add_argument('--deepseek-error-rate', type=float, default=0.0)
+    parser.add_argument('--groq-error-rate', type=float, default=0.0)
+    parser.add_argument('--deepseek-hang-rate', type=float, default=0.0)
+    parser.add_argument('--groq-hang-rate', type=float, default=0.0)
+    parser.add_argument('--hang-seconds', type=float, default=30)
+    parser.add_argument('--read-timeout', type=float, default=10, help='PROVIDER_READ_TIMEOUT for the app')
+    parser.add_argument('--dispatch-policy', default='sequential')
+    parser.add_argument('--session-backend', default='memory')
+    parser.add_argument('--cache-backend', default='memory')
+    parser.add_argument('--health-checks', action='store_true', help='keep the background health monitor on')
+    parser.add_argument('--json', help='also write the results to this file')
+    return parser.parse_args()
+
+
+def configure_environment(args, deepseek_base, groq_base, workdir):
+    """Point the app at the mock servers; must run before cursor_prompt is imported."""
+    os.environ.update({
+        'OPENAI_API_KEY': 'mock-deepseek-key',
+        'OPENAI_API_BASE': deepseek_base,
+        'GROQ_API_KEY': 'mock-groq-key',
+        'GROQ_API_BASE': groq_base,
+        'PROVIDER_READ_TIMEOUT': str(args.read_timeout),
+        'DISPATCH_POLICY': args.dispatch_policy,
+        'SESSION_BACKEND': args.session_backend,
+        'SESSION_PATH': os.path.join(workdir, 'sessions.sqlite3'),
+        'CACHE_BACKEND': args.cache_backend,
+        'CACHE_PATH': os.path.join(workdir, 'response_cache.sqlite3'),
+        'HEALTH_CHECK_ENABLED': '1' if args.health_checks else '0',
+        # Never drain or write to the real batch queue with mock emails
+        'BATCH_PATH': os.path.join(workdir, 'batch_jobs.sqlite3'),
+        'BATCH_WORKER_ENABLED': '0',
+        # Keep mock traffic out of any shared metrics directory
+        'METRICS_DIR': ''
+    })
+
+
+def rss_bytes():
+    """Resident memory of this process (Linux only, else 0)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def session_bytes(interface):
+    """Average size of a stored session, for the server-side backends."""
+    store = getattr(interface, 'store', None)
+    if store is None:
+        return None
+    entries = getattr(store, 'entries', None)
+    if entries is not None:
+        sizes = [len(raw) for raw, _ in list(entries.values())]
+        return statistics.mean(sizes) if sizes else 0
+    row = store._connect().execute("SELECT AVG(LENGTH(data)) FROM sessions").fetchone()
+    return row[0] or 0
+
+
+class Recorder:
+    """Thread-safe collection of request timings and outcomes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.errors = Counter()
+        self.sources = Counter()
+
+    def add(self, step, seconds, ok=True, source=None):
+        with self.lock:
+            self.timings.setdefault(step, []).append(seconds)
+            if not ok:
+                self.errors[step] += 1
+            if source:
+                self.sources[source] += 1
+
+
+def read_stream(response):
+    """Consume a /chat/stream response and return its final event payload."""
+    if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+        return response.json()
+    event, result = None, {}
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith('event: '):
+            event = line[7:]
+        elif line.startswith('data: ') and event == 'done':
+            result = json.loads(line[6:])
+    return result
+
+
+def run_session(base_url, index, args, recorder):
+    """Walk one user through the questions, the generation and refinements."""
+    http = requests.Session()
+    http.get(f"{base_url}/")
+    endpoint = '/chat/stream' if args.stream else '/chat'
+    answers = ANSWERS if args.repeat_inputs else [f"{answer} #{index}" for answer in ANSWERS]
+
+    messages = [('question', '')] + [('question', a) for a in answers[:-1]] + [('generate', answers[-1])]
+    messages += [('refine', REFINEMENTS[i % len(REFINEMENTS)]) for i in range(args.refinements)]
+    for step, message in messages:
+        started = time.perf_counter()
+        try:
+            response = http.post(f"{base_url}{endpoint}", json={'message': message}, stream=args.stream)
+            data = read_stream(response) if args.stream else response.json()
+            ok = response.status_code == 200 and bool(data.get('message'))
+        except (requests.RequestException, ValueError):
+            data, ok = {}, False
+        source = None
+        if step != 'question':
+            source = 'cache' if data.get('cached') else data.get('provider')
+            # Streamed replies don't report the provider; spot the template by its notice
+            if source is None and data.get('email'):
+                source = 'template' if data['email'].startswith('⚠️') else 'provider (streamed)'
+        recorder.add(step, time.perf_counter() - started, ok, source)
+
+
+def run_campaign(base_url, rows, recorder):
+    """Submit a bulk campaign and wait until every row is done."""
+    prospects = [dict(zip(['audience', 'offering', 'pain_points', 'tone', 'special_notes'],
+                          [f"{answer} (campaign #{i})" for answer in ANSWERS])) for i in range(rows)]
+    started = time.perf_counter()
+    response = requests.post(f"{base_url}/campaigns", json={'prospects': prospects})
+    job_id = response.json()['job_id']
+    while True:
+        summary = requests.get(f"{base_url}/campaigns/{job_id}").json()
+        if summary['completed'] + summary['failed'] >= rows:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    results = requests.get(f"{base_url}/campaigns/{job_id}/results").json()['results']
+    for result in results:
+        recorder.sources['campaign: ' + ('cache' if result.get('cached') else str(result.get('provider')))] += 1
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_sec': rows / elapsed, 'failed': summary['failed']}
+
+
+def percentile(samples, fraction):
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def summarize(recorder, wall_seconds):
+    summary = {}
+    for step, samples in recorder.timings.items():
+        samples = sorted(samples)
+        summary[step] = {
+            'requests': len(samples),
+            'errors': recorder.errors[step],
+            'rps': len(samples) / wall_seconds,
+            'mean_ms': statistics.mean(samples) * 1000,
+            'p50_ms': percentile(samples, 0.5) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000
+        }
+    return summary
+
+
+def main():
+    args = parse_args()
+    deepseek_mock, deepseek_base = start_server(MockConfig(
+        args.deepseek_latency_ms, args.tokens_per_sec, args.deepseek_error_rate,
+        args.deepseek_hang_rate, args.hang_seconds, seed=1))
+    groq_mock, groq_base = start_server(MockConfig(
+        args.groq_latency_ms, args.tokens_per_sec, args.groq_error_rate,
+        args.groq_hang_rate, args.hang_seconds, seed=2))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, deepseek_base, groq_base, workdir)
+        import cursor_prompt
+
+        server = make_server('127.0.0.1', 0, cursor_prompt.create_app(), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        recorder = Recorder()
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda i: run_session(base_url, i, args, recorder), range(args.sessions)))
+        wall_seconds = time.perf_counter() - started
+        rss_after = rss_bytes()
+
+        results = {
+            'settings': vars(args),
+            'wall_seconds': wall_seconds,
+            'sessions_per_sec': args.sessions / wall_seconds,
+            'steps': summarize(recorder, wall_seconds),
+            'memory': {
+                'rss_growth_per_session_bytes': (rss_after - rss_before) / args.sessions if args.sessions else 0,
+                'stored_session_bytes': session_bytes(cursor_prompt.app.session_interface)
+            }
+        }
+        if args.campaign_rows:
+            results['campaign'] = run_campaign(base_url, args.campaign_rows, recorder)
+        results['sources'] = dict(recorder.sources)
+        results['mock_providers'] = {'deepseek': deepseek_mock.config.stats, 'groq': groq_mock.config.stats}
+        results['cache'] = cursor_prompt.response_cache.stats()
+        server.shutdown()
+        cursor_prompt.shutdown_services(timeout=5)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def print_report(results):
+    print(f"{results['settings']['sessions']} sessions in {results['wall_seconds']:.2f}s "
+          f"({results['sessions_per_sec']:.1f} sessions/s)\n")
+    print(f"{'step':<10}{'requests':>10}{'errors':>8}{'req/s':>9}{'mean ms':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, s in results['steps'].items():
+        print(f"{step:<10}{s['requests']:>10}{s['errors']:>8}{s['rps']:>9.1f}{s['mean_ms']:>10.1f}"
+              f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+
+    memory = results['memory']
+    print(f"\nRSS growth per session: {memory['rss_growth_per_session_bytes'] / 1024:.1f} KiB")
+    if memory['stored_session_bytes'] is not None:
+        print(f"Stored session size:    {memory['stored_session_bytes'] / 1024:.1f} KiB")
+
+    if 'campaign' in results:
+        c = results['campaign']
+        print(f"\nCampaign: {c['rows']} rows in {c['seconds']:.2f}s ({c['rows_per_sec']:.1f} rows/s, {c['failed']} failed)")
+
+    print("\nAnswered by:")
+    for source, count in sorted(results['sources'].items()):
+        print(f"  {source:<28}{count:>8}")
+    print("\nMock provider traffic:")
+    for name, stats in results['mock_providers'].items():
+        print(f"  {name:<10}" + '  '.join(f"{key}={value}" for key, value in stats.items()))
+    print(f"\nResponse cache hit rate: {results['cache']['hit_rate']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
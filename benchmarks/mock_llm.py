@@ -0,0 +1,188 @@
+"""Local OpenAI-compatible mock server standing in for DeepSeek and Groq.
+
+Answers /chat/completions (plain and streamed) and /models with canned
+emails, after a configurable delay and at a configurable token rate. It can
+also fail or hang a share of requests to exercise timeouts and fallbacks.
+
+    python benchmarks/mock_llm.py --port 8900 --latency-ms 400 --tokens-per-sec 80
+
+Then point the app at it with OPENAI_API_BASE / GROQ_API_BASE, e.g.
+http://127.0.0.1:8900/v1.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMAIL = (
+    "Subject: A faster way to hit your goals\n\n"
+    "Hi there,\n\n"
+    "I noticed teams like yours spend hours on work that could be automated. "
+    "Our platform removes that busywork so your people can focus on what matters. "
+    "Customers typically save a day per week within the first month.\n\n"
+    "Would you be open to a 15-minute call next week?\n\n"
+    "Best regards,\n[Your Name]"
+)
+
+
+class MockConfig:
+    """Behaviour of one mock provider; fields can be changed while it runs."""
+
+    def __init__(self, latency_ms=200, tokens_per_sec=0, error_rate=0.0, hang_rate=0.0,
+                 hang_seconds=120, reply=EMAIL, seed=None):
+        # Delay before the first byte of every completion
+        self.latency_ms = latency_ms
+        # Streaming speed; 0 sends every token at once
+        self.tokens_per_sec = tokens_per_sec
+        # Share of completions answered with HTTP 500
+        self.error_rate = error_rate
+        # Share of completions that stall for hang_seconds before answering
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'streamed': 0, 'errors': 0, 'hangs': 0, 'auth_failures': 0}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def roll(self):
+        """Decide whether the next request fails, hangs or succeeds."""
+        with self.lock:
+            value = self.random.random()
+        if value < self.error_rate:
+            return 'error'
+        if value < self.error_rate + self.hang_rate:
+            return 'hang'
+        return 'ok'
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/models'):
+                self.send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+            else:
+                self.send_json(404, {'error': {'message': 'Not found'}})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self.send_json(400, {'error': {'message': 'Invalid JSON'}})
+                return
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self.send_json(404, {'error': {'message': 'Not found'}})
+                return
+
+            config.count('requests')
+            # Keys containing "invalid" are rejected like a revoked key would be
+            if 'invalid' in self.headers.get('Authorization', ''):
+                config.count('auth_failures')
+                self.send_json(401, {'error': {'message': 'Invalid API key'}})
+                return
+
+            outcome = config.roll()
+            if outcome == 'hang':
+                config.count('hangs')
+                time.sleep(config.hang_seconds)
+            time.sleep(config.latency_ms / 1000)
+            if outcome == 'error':
+                config.count('errors')
+                self.send_json(500, {'error': {'message': 'Mock provider error'}})
+                return
+
+            # Tag each reply so refinements of different emails don't share cache entries
+            reply = f"{config.reply}\nRef: {config.stats['requests']}"
+            tokens = [word + ' ' for word in reply.split(' ')]
+            prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in payload.get('messages', []))
+            if payload.get('stream'):
+                config.count('streamed')
+                self.stream(tokens)
+            else:
+                if config.tokens_per_sec:
+                    time.sleep(len(tokens) / config.tokens_per_sec)
+                content = ''.join(tokens).rstrip(' ')
+                self.send_json(200, {
+                    'id': 'mock-completion',
+                    'object': 'chat.completion',
+                    'model': payload.get('model', 'mock'),
+                    'choices': [
+                        {'index': i, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}
+                        for i in range(payload.get('n') or 1)
+                    ],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens)}
+                })
+
+        def stream(self, tokens):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for token in tokens:
+                    chunk = {'choices': [{'index': 0, 'delta': {'content': token}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    if config.tokens_per_sec:
+                        time.sleep(1 / config.tokens_per_sec)
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up on the stream, e.g. a cancelled hedge
+                pass
+
+    return Handler
+
+
+def start_server(config=None, host='127.0.0.1', port=0):
+    """Start a mock server in a daemon thread; return ``(server, base_url)``."""
+    config = config or MockConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=200, help='delay before each reply (default 200)')
+    parser.add_argument('--tokens-per-sec', type=float, default=0, help='streaming speed, 0 for instant (default 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with HTTP 500')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='share of requests that stall')
+    parser.add_argument('--hang-seconds', type=float, default=120, help='how long a stalled request waits')
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency_ms, args.tokens_per_sec, args.error_rate, args.hang_rate, args.hang_seconds)
+    server, base_url = start_server(config, args.host, args.port)
+    print(f"Mock LLM server listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
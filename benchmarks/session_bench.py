@@ -0,0 +1,113 @@
+"""Measure per-request session overhead for each session backend.
+
+Replays the /chat access pattern (five answers, one generated email, a few
+refinements) against a small Flask app and times only the session
+interface's open_session/save_session calls.
+
+    python benchmarks/session_bench.py --sessions 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify, request, session
+
+from session_store import BACKENDS, configure_sessions
+
+KEYS = ['audience', 'offering', 'pain_points', 'tone', 'special_notes']
+EMAIL = ("Subject: A faster way to ship\n\n" + "We help teams like yours ship faster. " * 40).strip()
+
+
+def build_app(backend, workdir):
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "benchmark"
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_FILE_DIR"] = os.path.join(workdir, "flask_session")
+    configure_sessions(app, backend, path=os.path.join(workdir, "sessions.sqlite3"))
+
+    timings = []
+    interface = app.session_interface
+    open_session = interface.open_session
+    save_session = interface.save_session
+
+    def timed_open(app_, request_):
+        started = time.perf_counter()
+        try:
+            return open_session(app_, request_)
+        finally:
+            timings.append(time.perf_counter() - started)
+
+    def timed_save(app_, session_, response):
+        started = time.perf_counter()
+        try:
+            return save_session(app_, session_, response)
+        finally:
+            timings[-1] += time.perf_counter() - started
+
+    interface.open_session = timed_open
+    interface.save_session = timed_save
+
+    @app.route('/')
+    def index():
+        session.clear()
+        session['step'] = 0
+        session['user_inputs'] = {}
+        return 'ok'
+
+    @app.route('/chat', methods=['POST'])
+    def chat():
+        message = request.get_json()['message']
+        step = session.get('step', 0)
+        if step < len(KEYS):
+            session['user_inputs'][KEYS[step]] = message
+            session.modified = True
+        elif step == len(KEYS):
+            session['email'] = EMAIL
+        else:
+            session['email'] = EMAIL + message
+        session['step'] = step + 1
+        return jsonify({'ok': True})
+
+    return app, timings
+
+
+def run(backend, sessions, refinements):
+    with tempfile.TemporaryDirectory() as workdir:
+        app, timings = build_app(backend, workdir)
+        for _ in range(sessions):
+            client = app.test_client()
+            client.get('/')
+            for i in range(len(KEYS) + 1 + refinements):
+                client.post('/chat', json={'message': f'answer {i}'})
+        # Drop the first session's requests so imports and table creation don't skew results
+        samples = sorted(timings[len(KEYS) + 2 + refinements:])
+    return {
+        'requests': len(samples),
+        'mean_us': statistics.mean(samples) * 1e6,
+        'p50_us': samples[len(samples) // 2] * 1e6,
+        'p95_us': samples[int(len(samples) * 0.95)] * 1e6,
+        'p99_us': samples[int(len(samples) * 0.99)] * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=200, help='chat sessions per backend')
+    parser.add_argument('--refinements', type=int, default=3, help='refinement requests per session')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='comma-separated backends to test')
+    args = parser.parse_args()
+
+    print(f"{'backend':<12}{'requests':>10}{'mean us':>12}{'p50 us':>12}{'p95 us':>12}{'p99 us':>12}")
+    for backend in args.backends.split(','):
+        result = run(backend, args.sessions, args.refinements)
+        print(f"{backend:<12}{result['requests']:>10}{result['mean_us']:>12.1f}{result['p50_us']:>12.1f}"
+              f"{result['p95_us']:>12.1f}{result['p99_us']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
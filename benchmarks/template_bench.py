@@ -0,0 +1,71 @@
+"""Measure local template engine throughput on one core.
+
+Composes emails for synthetic prospects with varied audiences, tones and
+names, first with compose_email alone and then with the parsing into parts
+that campaign results include. No network or provider is involved.
+
+    python benchmarks/template_bench.py --emails 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_parts import parse_email
+from local_templates import compose_email
+
+AUDIENCES = ['CTOs at fintech startups', 'Marketing managers at e-commerce brands', 'CFOs of mid-size manufacturers',
+             'Heads of People at remote-first companies', 'Founders of seed-stage SaaS companies', 'Dental practices']
+OFFERINGS = ['An AI code review assistant', 'Automated ad reporting', 'Spend management software',
+             'An onboarding platform', 'Fractional bookkeeping']
+PAIN_POINTS = ['Slow code reviews and bugs reaching production', 'Hours lost to manual reports, missed deadlines',
+               'Unpredictable cloud costs', 'Messy onboarding; new hires waiting for access']
+TONES = ['Professional', 'Friendly and concise', 'Direct', 'Warm', 'Formal']
+NOTES = ['none', '20% off the first year for early adopters', 'We met at SaaStr last spring', '']
+NAMES = ['Sam', 'Priya', 'Jordan', '', 'Alex', 'Wei']
+COMPANIES = ['Acme', 'Globex', '', 'Initech', 'Umbrella']
+
+
+def prospects(count):
+    """Synthetic prospect rows cycling through the answer lists at different strides."""
+    return [{
+        'audience': AUDIENCES[i % len(AUDIENCES)],
+        'offering': OFFERINGS[i // 3 % len(OFFERINGS)],
+        'pain_points': PAIN_POINTS[i // 7 % len(PAIN_POINTS)],
+        'tone': TONES[i // 2 % len(TONES)],
+        'special_notes': NOTES[i // 5 % len(NOTES)],
+        'first_name': NAMES[i % len(NAMES)],
+        'company': COMPANIES[i // 11 % len(COMPANIES)]
+    } for i in range(count)]
+
+
+def run(rows, parse):
+    started = time.perf_counter()
+    for row in rows:
+        email = compose_email(row)
+        if parse:
+            parse_email(email)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--emails', type=int, default=20000, help='emails to compose per run (default 20000)')
+    args = parser.parse_args()
+
+    rows = prospects(args.emails)
+    # Warm up so imports and regex compilation don't count
+    run(rows[:200], parse=True)
+    distinct = len({compose_email(row) for row in rows[:1000]})
+
+    print(f"{'run':<20}{'emails':>10}{'seconds':>10}{'emails/s':>12}{'us/email':>10}")
+    for name, parse in (('compose', False), ('compose + parse', True)):
+        elapsed = run(rows, parse)
+        print(f"{name:<20}{len(rows):>10}{elapsed:>10.3f}{len(rows) / elapsed:>12.0f}{elapsed / len(rows) * 1e6:>10.1f}")
+    print(f"distinct emails in the first 1000 prospects: {distinct}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures.
+
+    ``closed``: calls go through and consecutive failures are counted.
+    ``open``: after ``failure_threshold`` failures in a row, calls are refused
+    at once for ``cooldown`` seconds. ``half_open``: after the cool-down one
+    trial call is let through; success closes the breaker, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self.times_opened = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may be made now (claiming the trial slot when half-open)."""
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < self.cooldown:
+                    return False
+                self.state = HALF_OPEN
+                self.trial_started_at = None
+            # Half-open: one trial at a time; a trial that never reported back expires
+            if self.trial_started_at is None or now - self.trial_started_at > self.cooldown:
+                self.trial_started_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trial_started_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trial_started_at = None
+
+    def reset(self):
+        """Close the breaker, e.g. after the provider's API key changed."""
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+
+    def snapshot(self):
+        with self.lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'retry_in_seconds': retry_in,
+                'times_opened': self.times_opened
+            }
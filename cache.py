@@ -0,0 +1,203 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(value):
+    """Lower-case a value and collapse runs of whitespace."""
+    return ' '.join(str(value).split()).lower()
+
+
+def make_cache_key(kind, payload):
+    """Hash a request description into a stable cache key."""
+    def normalize(value):
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in value.items() if v not in (None, '')}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        if isinstance(value, str):
+            return normalize_text(value)
+        return value
+
+    encoded = json.dumps([kind, normalize(payload)], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU cache with a time-to-live and an entry limit."""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteCache:
+    """On-disk cache stored in a SQLite database, shared between processes."""
+
+    def __init__(self, path, max_entries=100000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local = threading.local()
+        self.writes = 0
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value, expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        db = self._connect()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.ttl)
+            )
+        self.writes += 1
+        # Sweep expired and excess rows every so often rather than on every write
+        if self.writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+            db.execute(
+                "DELETE FROM cache WHERE key NOT IN "
+                "(SELECT key FROM cache ORDER BY expires DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class TieredCache:
+    """Check a fast cache first, then a slower shared one, promoting hits."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def get(self, key):
+        value = self.first.get(key)
+        if value is None:
+            value = self.second.get(key)
+            if value is not None:
+                self.first.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.first.set(key, value)
+        self.second.set(key, value)
+
+    def __len__(self):
+        return len(self.second)
+
+
+class ResponseCache:
+    """Cache of provider responses with hit and miss counters."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            value = None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception:
+            # A broken cache must never break generation
+            pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'backend': type(self.backend).__name__ if self.backend is not None else None,
+                'entries': len(self.backend) if self.backend is not None else 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def create_cache(backend, max_entries=1000, ttl=3600, path='response_cache.sqlite3', disk_max_entries=100000):
+    """Build a response cache for the named backend: memory, sqlite, tiered or none."""
+    backend = (backend or 'none').lower()
+    if backend == 'memory':
+        return ResponseCache(MemoryCache(max_entries, ttl))
+    if backend == 'sqlite':
+        return ResponseCache(SQLiteCache(path, disk_max_entries, ttl))
+    if backend == 'tiered':
+        return ResponseCache(TieredCache(MemoryCache(max_entries, ttl), SQLiteCache(path, disk_max_entries, ttl)))
+    if backend == 'none':
+        return ResponseCache(None)
+    raise ValueError(f"Unknown cache backend: {backend}")
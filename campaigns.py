@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Columns accepted for each prospect row (same keys used by generate_email)
+PROSPECT_KEYS = ['audience', 'offering', 'pain_points', 'tone', 'special_notes']
+# Per-prospect columns filled into segment emails and used for personalized openers
+MERGE_KEYS = ['first_name', 'last_name', 'company', 'title', 'detail']
+# Contact columns kept with each row for exports; never sent to a provider
+CONTACT_KEYS = ['email']
+
+
+def parse_prospects(raw, filename=''):
+    """Parse a CSV or JSONL payload into a list of prospect dicts."""
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8-sig')
+    text = raw.strip()
+    if not text:
+        return []
+
+    # Pick the format from the file extension, or sniff the first character
+    is_jsonl = filename.lower().endswith(('.jsonl', '.ndjson', '.json')) or text[0] in '{['
+
+    rows = []
+    if is_jsonl:
+        if text[0] == '[':
+            records = json.loads(text)
+        else:
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        records = csv.DictReader(io.StringIO(text))
+
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("Each prospect must be an object with audience/offering/... fields")
+        row = {}
+        for key in PROSPECT_KEYS + MERGE_KEYS + CONTACT_KEYS:
+            value = record.get(key)
+            if value is not None and str(value).strip():
+                row[key] = str(value).strip()
+        if row:
+            rows.append(row)
+    return rows
+
+
+class Campaign:
+    """Progress and results of one bulk generation job."""
+
+    def __init__(self, rows):
+        self.id = uuid.uuid4().hex
+        self.rows = rows
+        self.results = [None] * len(rows)
+        self.completed = 0
+        self.failed = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self.futures = []
+        self.lock = threading.Lock()
+
+    @property
+    def status(self):
+        if self.finished_at is not None:
+            return 'completed'
+        return 'running' if self.completed or self.failed else 'queued'
+
+    def record(self, index, result, error=None):
+        with self.lock:
+            if error is None:
+                self.results[index] = result
+                self.completed += 1
+            else:
+                self.results[index] = {'error': error}
+                self.failed += 1
+            if self.completed + self.failed == len(self.rows):
+                self.finished_at = time.time()
+
+    def summary(self):
+        with self.lock:
+            elapsed = (self.finished_at or time.time()) - self.created_at
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'total': len(self.rows),
+                'completed': self.completed,
+                'failed': self.failed,
+                'elapsed_seconds': round(elapsed, 3)
+            }
+
+
+class CampaignManager:
+    """Run campaign rows through a bounded pool of generation workers.
+
+    ``generate`` takes a prospect dict (plus any options given to ``submit``)
+    and returns a result dict holding at least the generated ``email``.
+    """
+
+    def __init__(self, generate, max_workers=8, max_jobs=100):
+        self.generate = generate
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='campaign')
+        self.jobs = {}
+        self.queued = 0
+        self.lock = threading.Lock()
+
+    def submit(self, rows, **options):
+        """Queue every row of a new campaign and return it."""
+        campaign = Campaign(rows)
+        with self.lock:
+            self._prune()
+            self.jobs[campaign.id] = campaign
+            self.queued += len(rows)
+        campaign.futures = [
+            self.executor.submit(self._run_row, campaign, index, row, options)
+            for index, row in enumerate(rows)
+        ]
+        if not rows:
+            campaign.finished_at = time.time()
+        return campaign
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def queue_depth(self):
+        """Number of rows waiting for a free worker."""
+        with self.lock:
+            return self.queued
+
+    def _run_row(self, campaign, index, row, options):
+        with self.lock:
+            self.queued -= 1
+        try:
+            result = self.generate(row, **options)
+            campaign.record(index, dict(result, inputs=row))
+        except Exception as e:
+            campaign.record(index, None, error=str(e))
+
+    def _prune(self):
+        # Drop the oldest finished jobs so the registry stays bounded
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        finished.sort(key=lambda job: job.finished_at)
+        while len(self.jobs) >= self.max_jobs and finished:
+            del self.jobs[finished.pop(0).id]
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """Stop the worker pool, optionally dropping rows that haven't started."""
+        if cancel_pending:
+            with self.lock:
+                jobs = list(self.jobs.values())
+            for campaign in jobs:
+                for index, future in enumerate(campaign.futures):
+                    if future.cancel():
+                        with self.lock:
+                            self.queued -= 1
+                        campaign.record(index, None, error='Cancelled: server shutting down')
+        self.executor.shutdown(wait=wait)
@@ -1,26 +1,255 @@
 import os
-import openai
-import requests
 import json
-from flask import Flask, request, jsonify, session, render_template, redirect, url_for
-from flask_session import Session
-from dotenv import load_dotenv
+import re
+import threading
+import time
+import uuid
+from flask import Flask, Response, request, jsonify, session, render_template, redirect, url_for, stream_with_context
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dotenv import dotenv_values, load_dotenv
+from batch_queue import BatchQueue, BatchWorker
+from breaker import OPEN, CircuitBreaker
+from cache import create_cache, make_cache_key
+from campaigns import MERGE_KEYS, CampaignManager, parse_prospects
+from dispatch import POLICIES, DispatchError, dispatch
+from envfile import update_env_file
+from exporters import FORMATS as EXPORT_FORMATS, byte_slice, export_chunks
+from email_parts import NOTICE_PREFIXES, TEMPLATE_MARKER, empty_parts, parse_email, render_email
+from health import HealthMonitor
+from local_templates import compose_email
+from metrics import CONTENT_TYPE, Registry
+from prompts import GENERATE, OPENER, REFINE, SEGMENT, VARIANTS, all_prompts, estimate_tokens, get_prompt, truncate_tokens
+from providers import ProviderCancelled, ProviderClient, add_observer
+from ratelimit import AdaptiveRateLimiter, RetryPolicy
+from refine_history import conversation, new_history, record
+from segments import SegmentTemplates
+from semantic_cache import SemanticCache
+from speculation import Speculator
+from session_store import configure_sessions
+from singleflight import SingleFlight
+from variants import parse_variants
 
 # Load environment variables from .env file
-load_dotenv()
+ENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+load_dotenv(ENV_PATH)
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "default_secret_key")
-app.config["SESSION_TYPE"] = "filesystem"
 app.config["SESSION_PERMANENT"] = False
-Session(app)
 
-# Set your OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
-# Set your OpenAI API base URL if using DeepSeek API
-openai.api_base = os.getenv("OPENAI_API_BASE", "https://api.deepseek.com/v1")
-# Groq API key
+# Session storage: memory (default), sqlite, cookie or filesystem
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+configure_sessions(
+    app,
+    SESSION_BACKEND,
+    ttl=int(os.getenv("SESSION_TTL", "86400")),
+    path=os.getenv("SESSION_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.sqlite3")),
+    max_entries=int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+)
+
+# DeepSeek API key and base URL (DeepSeek exposes an OpenAI-compatible API)
+DEEPSEEK_API_KEY = os.getenv("OPENAI_API_KEY")
+DEEPSEEK_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.deepseek.com/v1")
+DEEPSEEK_MODEL = "deepseek-chat"
+# Groq API key and base URL
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_API_BASE = os.getenv("GROQ_API_BASE", "https://api.groq.com/openai/v1")
+GROQ_MODEL = "llama3-8b-8192"
+
+# Maximum number of simultaneous in-flight requests per provider
+PROVIDER_LIMITS = {
+    'deepseek': threading.BoundedSemaphore(int(os.getenv("DEEPSEEK_CONCURRENCY", "8"))),
+    'groq': threading.BoundedSemaphore(int(os.getenv("GROQ_CONCURRENCY", "8")))
+}
+
+# Requests per second each provider may receive; lowered automatically when it returns 429
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+PROVIDER_RATE_LIMITERS = {
+    'deepseek': AdaptiveRateLimiter(float(os.getenv("DEEPSEEK_RATE_LIMIT", "20")), max_wait=RATE_LIMIT_MAX_WAIT),
+    'groq': AdaptiveRateLimiter(float(os.getenv("GROQ_RATE_LIMIT", "10")), max_wait=RATE_LIMIT_MAX_WAIT)
+}
+# Retries of 429, 5xx and connection errors, with jittered exponential backoff
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "2"))
+PROVIDER_RETRY_POLICIES = {
+    'deepseek': RetryPolicy(PROVIDER_MAX_RETRIES),
+    'groq': RetryPolicy(PROVIDER_MAX_RETRIES)
+}
+
+# Skip a provider for CIRCUIT_COOLDOWN seconds after this many failures in a row
+PROVIDER_BREAKERS = {
+    name: CircuitBreaker(
+        failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+        cooldown=float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+    )
+    for name in ('deepseek', 'groq')
+}
+
+def make_deepseek_client(api_key, api_base=DEEPSEEK_API_BASE, timeout=None, throwaway=False):
+    """Create a DeepSeek client sharing the pooled HTTP session.
+    
+    A ``throwaway`` client, used to check new keys, doesn't retry, touch the
+    circuit breaker or wait behind live traffic for a concurrency or rate slot,
+    and its outcomes never reach the health monitor or the provider metrics.
+    """
+    return ProviderClient('deepseek', 'DeepSeek', api_key, api_base, DEEPSEEK_MODEL,
+                          limit=None if throwaway else PROVIDER_LIMITS['deepseek'], timeout=timeout,
+                          rate_limiter=None if throwaway else PROVIDER_RATE_LIMITERS['deepseek'],
+                          retry_policy=None if throwaway else PROVIDER_RETRY_POLICIES['deepseek'],
+                          breaker=None if throwaway else PROVIDER_BREAKERS['deepseek'], observed=not throwaway)
+
+def make_groq_client(api_key, timeout=None, throwaway=False):
+    """Create a Groq client sharing the pooled HTTP session."""
+    return ProviderClient('groq', 'Groq', api_key, GROQ_API_BASE, GROQ_MODEL,
+                          limit=None if throwaway else PROVIDER_LIMITS['groq'], timeout=timeout,
+                          rate_limiter=None if throwaway else PROVIDER_RATE_LIMITERS['groq'],
+                          retry_policy=None if throwaway else PROVIDER_RETRY_POLICIES['groq'],
+                          breaker=None if throwaway else PROVIDER_BREAKERS['groq'], observed=not throwaway)
+
+# Provider clients used by every generation, refinement and health check. They are
+# never changed in place: new keys swap in a new client, so in-flight requests keep theirs
+deepseek_client = make_deepseek_client(DEEPSEEK_API_KEY)
+groq_client = make_groq_client(GROQ_API_KEY)
+# Serializes key changes from /update-api-keys and from .env reloads
+clients_lock = threading.Lock()
+
+def swap_client(name, client):
+    """Make ``client`` the live client for a provider, forgetting the old key's health and failures."""
+    global deepseek_client, groq_client
+    if name == 'deepseek':
+        deepseek_client = client
+    else:
+        groq_client = client
+    health_monitor.reset(name)
+    PROVIDER_BREAKERS[name].reset()
+
+# How a request is spread over providers: sequential, hedged or race
+DISPATCH_POLICY = os.getenv("DISPATCH_POLICY", "sequential").lower()
+if DISPATCH_POLICY not in POLICIES:
+    app.logger.warning(f"Unknown DISPATCH_POLICY '{DISPATCH_POLICY}', using sequential")
+    DISPATCH_POLICY = 'sequential'
+# With the hedged policy, wait this long for DeepSeek before also asking Groq
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "1500"))
+
+# Sampling temperature used for generation and refinement
+TEMPERATURE = 0.7
+
+# Response cache: none, memory, sqlite or tiered (memory in front of sqlite)
+response_cache = create_cache(
+    os.getenv("CACHE_BACKEND", "memory"),
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1000")),
+    ttl=int(os.getenv("CACHE_TTL", "3600")),
+    path=os.getenv("CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.sqlite3")),
+    disk_max_entries=int(os.getenv("CACHE_DISK_MAX_ENTRIES", "100000"))
+)
+
+# Identical requests in flight together share one provider call; waiters give up after this many seconds
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", "60"))
+inflight = SingleFlight()
+# The same refinement sent again within this many seconds is answered with the current email
+REFINE_DEBOUNCE_SECONDS = float(os.getenv("REFINE_DEBOUNCE_SECONDS", "5"))
+
+# Optional near-duplicate cache for chat generations, matched on similar answers
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+semantic_cache = SemanticCache(
+    max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500")),
+    ttl=int(os.getenv("CACHE_TTL", "3600")),
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+) if SEMANTIC_CACHE_ENABLED else None
+
+# Draft the chat email in the background once the first answers are in (0 = off)
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "0").lower() in ("1", "true", "yes")
+# Seconds from a draft's start after which the last answer stops waiting for it and generates
+# from scratch; about what a normal generation takes, so a slow draft never makes things slower
+SPECULATION_MAX_WAIT = float(os.getenv("SPECULATION_MAX_WAIT", "8"))
+
+# Background provider health checks (seconds between probes of a healthy provider)
+HEALTH_CHECK_ENABLED = os.getenv("HEALTH_CHECK_ENABLED", "1").lower() not in ("0", "false", "no")
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "30"))
+
+health_monitor = HealthMonitor(
+    lambda: {'deepseek': deepseek_client, 'groq': groq_client},
+    interval=HEALTH_CHECK_INTERVAL,
+    max_backoff=float(os.getenv("HEALTH_CHECK_MAX_BACKOFF", "300"))
+)
+
+# Prometheus metrics, served at /metrics. With METRICS_DIR set (serve.py does so for
+# several workers) each worker publishes its values there and every scrape sums them
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_SYNC_SECONDS = float(os.getenv("METRICS_SYNC_SECONDS", "5"))
+metrics_registry = Registry()
+HTTP_LATENCY = metrics_registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests', ('endpoint', 'method', 'status'))
+PROVIDER_LATENCY = metrics_registry.histogram(
+    'llm_provider_request_duration_seconds', 'Latency of provider API calls', ('provider', 'outcome'))
+PROVIDER_TOKENS = metrics_registry.counter(
+    'llm_provider_tokens_total',
+    'Tokens reported by provider APIs, next to our local prompt estimate and the max_tokens budget',
+    ('provider', 'direction'))
+TRUNCATED_REPLIES = metrics_registry.counter(
+    'llm_truncated_replies_total', 'Replies cut off because they reached max_tokens', ('provider',))
+INPUT_TRUNCATIONS = metrics_registry.counter(
+    'input_fields_truncated_total', 'Answers cut to INPUT_MAX_TOKENS before prompting', ('field',))
+STAGE_LATENCY = metrics_registry.histogram(
+    'generation_stage_duration_seconds', 'Time spent in each generation stage', ('kind', 'stage'))
+GENERATIONS = metrics_registry.counter(
+    'generations_total', 'Generated and refined emails by where they came from', ('kind', 'source'))
+FALLBACKS = metrics_registry.counter(
+    'llm_fallbacks_total', 'Requests handed to the next provider or the template after a failure',
+    ('from_provider', 'to_provider'))
+SEMANTIC_SIMILARITY = metrics_registry.histogram(
+    'semantic_cache_similarity', 'Best similarity found by each semantic cache lookup',
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0))
+EMAILS_REFINED = metrics_registry.counter(
+    'emails_refined_total', 'Generated emails the user went on to refine, by where the email came from', ('source',))
+SPECULATIONS = metrics_registry.counter(
+    'speculative_drafts_used_total', 'Final chat answers served from a background draft, or missing one', ('outcome',))
+SESSION_LATENCY = metrics_registry.histogram(
+    'session_store_duration_seconds', 'Time spent loading and saving sessions', ('operation',))
+
+def observe_provider_call(provider, success, latency_ms, error=None, usage=None):
+    """Feed the outcome of real provider traffic into the health monitor and metrics."""
+    health_monitor.record(provider, success, latency_ms, error=error)
+    PROVIDER_LATENCY.observe(latency_ms / 1000, provider=provider, outcome='success' if success else 'error')
+    if usage:
+        # Estimates and budgets are only counted next to real counts, so the totals compare
+        if usage.get('prompt_tokens') is not None:
+            PROVIDER_TOKENS.inc(usage['prompt_tokens'], provider=provider, direction='prompt')
+            PROVIDER_TOKENS.inc(usage.get('estimated_prompt_tokens') or 0, provider=provider, direction='prompt_estimated')
+        if usage.get('completion_tokens') is not None:
+            PROVIDER_TOKENS.inc(usage['completion_tokens'], provider=provider, direction='completion')
+            PROVIDER_TOKENS.inc(usage.get('max_tokens') or 0, provider=provider, direction='completion_budget')
+        if usage.get('truncated'):
+            TRUNCATED_REPLIES.inc(provider=provider)
+
+add_observer(observe_provider_call)
+
+# Short timeouts for key checks so a bad endpoint can't hang the page
+VERIFY_TIMEOUT = (3, float(os.getenv("VERIFY_TIMEOUT", "8")))
+# Key checks of both providers run side by side
+verify_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='verify')
+
+# Number of worker threads used for bulk campaign generation
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "16"))
+# Largest number of prospects accepted in a single campaign upload
+CAMPAIGN_MAX_ROWS = int(os.getenv("CAMPAIGN_MAX_ROWS", "10000"))
+
+# Segment campaigns: base emails kept in memory, and the budget of a personalized opener line
+SEGMENT_CACHE_ENTRIES = int(os.getenv("SEGMENT_CACHE_ENTRIES", "1000"))
+OPENER_MAX_TOKENS = 60
+
+# Offline batch jobs: SQLite queue file, request pace and largest accepted upload
+BATCH_PATH = os.getenv("BATCH_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_jobs.sqlite3"))
+BATCH_REQUESTS_PER_MINUTE = float(os.getenv("BATCH_REQUESTS_PER_MINUTE", "60"))
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "100000"))
+# From address written into MBOX exports (left out when empty, for mail-merge tools that set their own)
+EXPORT_SENDER = os.getenv("EXPORT_SENDER", "")
+# Sizes of finished exports, so resumed range requests don't render the export twice
+EXPORT_SIZE_ENTRIES = 256
+
+# Whether web workers also drain the batch queue (otherwise run `python batch.py run`)
+BATCH_WORKER_ENABLED = os.getenv("BATCH_WORKER_ENABLED", "1").lower() not in ("0", "false", "no")
 
 # Questions to ask the user
 QUESTIONS = [
@@ -34,218 +263,771 @@ QUESTIONS = [
 # Keys for storing user responses
 KEYS = ['audience', 'offering', 'pain_points', 'tone', 'special_notes']
 
+# Answers needed before a background draft is started (the rest rarely change much)
+SPECULATE_AFTER = 3
+# Last answers that mean there's nothing special to mention
+NO_NOTES = {'', 'none', 'no', 'nope', 'nothing', 'n/a', 'na', 'no thanks'}
+
+# Replies that mean the user is happy with the email
+SATISFIED_REPLIES = ['no', 'no thanks', 'it looks good', 'looks good', 'perfect']
+
+# Completion token budgets: a new email, and the most a refinement may ask for
+GENERATE_MAX_TOKENS = int(os.getenv("GENERATE_MAX_TOKENS", "700"))
+REFINE_MAX_TOKENS = int(os.getenv("REFINE_MAX_TOKENS", "1000"))
+# Smallest budget ever requested, and the headroom added to a refinement's expected length
+MIN_COMPLETION_TOKENS = 200
+COMPLETION_SLACK_TOKENS = 100
+# Words in a refinement request that say which way the email's length should go
+SHORTER_HINTS = {'shorter', 'shorten', 'concise', 'brief', 'briefer', 'trim', 'cut', 'tighten'}
+LONGER_HINTS = {'longer', 'expand', 'elaborate', 'add', 'detail', 'details', 'detailed'}
+# Longest answer accepted for a question; longer ones are asked again in the chat and cut elsewhere
+INPUT_MAX_TOKENS = int(os.getenv("INPUT_MAX_TOKENS", "300"))
+
+# Earlier refinement requests replayed as chat turns; older ones are folded into a summary
+REFINE_HISTORY_TURNS = int(os.getenv("REFINE_HISTORY_TURNS", "6"))
+REFINE_HISTORY_TOKENS = int(os.getenv("REFINE_HISTORY_TOKENS", "400"))
+
+# Variants per /variants request: default and upper bound
+VARIANTS_DEFAULT = int(os.getenv("VARIANTS_DEFAULT", "3"))
+VARIANTS_MAX = int(os.getenv("VARIANTS_MAX", "5"))
+# Completion tokens budgeted for each variant in the combined reply
+VARIANT_MAX_TOKENS = 600
+
+# Text wrapped around generated and refined emails in chat replies
+GENERATED_PREFIX = "Here's your generated email:\n\n"
+GENERATED_SUFFIX = "\n\nWould you like to refine it? For example, you can ask for:\n1. A more casual/formal tone\n2. A shorter/longer email\n3. More emphasis on specific benefits\n4. Any other changes"
+REFINED_PREFIX = "I've refined your email:\n\n"
+REFINED_SUFFIX = "\n\nWould you like to refine it further?"
+# Shown when a provider stops sending partway through an email
+INTERRUPTED_MESSAGE = "The connection to {provider} dropped before the email was finished. Please send your message again."
+
 def generate_email_template(user_inputs):
     """Generate a basic email template based on user inputs without using an API."""
-    audience = user_inputs.get('audience', 'N/A')
-    offering = user_inputs.get('offering', 'N/A')
-    pain_points = user_inputs.get('pain_points', 'N/A')
-    tone = user_inputs.get('tone', 'Professional')
-    special_notes = user_inputs.get('special_notes', 'N/A')
+    return compose_email(user_inputs)
+
+def prompt_inputs(user_inputs):
+    """The answers as prompt fields, with defaults and each cut to INPUT_MAX_TOKENS."""
+    fields = {
+        'audience': user_inputs.get('audience', 'N/A'),
+        'offering': user_inputs.get('offering', 'N/A'),
+        'pain_points': user_inputs.get('pain_points', 'N/A'),
+        'tone': user_inputs.get('tone', 'Professional'),
+        'special_notes': user_inputs.get('special_notes', 'N/A')
+    }
+    for field, value in fields.items():
+        value = str(value)
+        shortened = truncate_tokens(value, INPUT_MAX_TOKENS)
+        if shortened != value:
+            INPUT_TRUNCATIONS.inc(field=field)
+        fields[field] = shortened
+    return fields
+
+def answer_too_long(answer):
+    """Explain why an answer is over INPUT_MAX_TOKENS, or return None if it fits."""
+    tokens = estimate_tokens(answer)
+    if tokens > INPUT_MAX_TOKENS:
+        return f"That answer is too long (about {tokens} tokens; the limit is {INPUT_MAX_TOKENS}). Please shorten it.\n\n"
+    return None
+
+def refinement_budget(email, refinement_request):
+    """Size max_tokens for a refinement from the current draft and what was asked."""
+    draft_tokens = estimate_tokens(email)
+    if not draft_tokens:
+        return GENERATE_MAX_TOKENS
+    words = set(re.findall(r"[a-z]+", refinement_request.lower()))
+    if words & SHORTER_HINTS:
+        scale = 1.0
+    elif words & LONGER_HINTS:
+        scale = 2.0
+    else:
+        scale = 1.3
+    return max(MIN_COMPLETION_TOKENS, min(REFINE_MAX_TOKENS, int(draft_tokens * scale) + COMPLETION_SLACK_TOKENS))
+
+def generation_messages(user_inputs):
+    """Build the chat messages used to generate a new email."""
+    return GENERATE.messages(**prompt_inputs(user_inputs))
+
+def refinement_messages(email, refinement_request, user_inputs=None, history=None):
+    """Build the multi-turn chat messages used to refine an existing email."""
+    history = history or new_history()
+    earlier = f"\nEarlier requests, already applied:\n{history['summary']}" if history['summary'] else ''
+    messages = REFINE.messages(earlier_requests=earlier, **prompt_inputs(user_inputs or {}))
+    return messages + conversation(history, email, refinement_request)
+
+def refinement_key(email, refinement_request, user_inputs, history):
+    """Cache key for a refinement, covering the brief and the earlier requests."""
+    return cache_key('refine', {
+        'email': email,
+        'refinement_request': refinement_request,
+        'inputs': user_inputs or {},
+        'history': history or new_history()
+    })
+
+def count_first_refinement():
+    """Count an email's first refinement by where the email came from, which shows poor cache reuse."""
+    source = session.pop('email_source', None)
+    if source:
+        EMAILS_REFINED.inc(source=source)
+
+def record_refinement(refinement_request):
+    """Remember an applied refinement request in the session history."""
+    history = session.get('refinements') or new_history()
+    session['refinements'] = record(history, refinement_request,
+                                    max_turns=REFINE_HISTORY_TURNS, token_budget=REFINE_HISTORY_TOKENS)
+    session['last_refinement'] = {'request': refinement_request, 'at': time.time()}
+    session.modified = True
+
+def repeated_refinement(refinement_request):
+    """True if this exact refinement was just applied, e.g. the same message submitted twice."""
+    last = session.get('last_refinement')
+    return bool(last) and last['request'] == refinement_request and time.time() - last['at'] < REFINE_DEBOUNCE_SECONDS
+
+def with_parts(result):
+    """Add the parsed parts to an email result, unless they were kept from an earlier parse."""
+    if 'parts' not in result:
+        result['parts'] = parse_email(result['email'])
+    return result
+
+def store_email(email, parts):
+    """Keep the current email in the session along with its parsed parts."""
+    session['email'] = email
+    session['email_parts'] = parts
+
+def current_parts():
+    """Parsed parts of the session's email (parsed here only for sessions saved before parts were kept)."""
+    parts = session.get('email_parts')
+    if parts is None:
+        parts = parse_email(session['email']) if session.get('email') else empty_parts()
+    return parts
+
+def strip_error_prefix(email):
+    """Remove a leading API error notice, keeping only the fallback template."""
+    if email.startswith(NOTICE_PREFIXES):
+        template_start = email.find(TEMPLATE_MARKER)
+        if template_start != -1:
+            email = email[template_start + len(TEMPLATE_MARKER):].strip()
+    return email
+
+def generation_fallback(user_inputs, error):
+    """Build the template email returned when every API fails."""
+    error_str = str(error).lower()
+    if "authentication" in error_str or "api key" in error_str or "auth" in error_str:
+        return (
+            "⚠️ Authentication Error: API authentication failed.\n\n"
+            f"{TEMPLATE_MARKER}\n\n"
+            f"{generate_email_template(user_inputs)}"
+        )
+    return (
+        f"⚠️ Error: {str(error)}\n\n"
+        f"{TEMPLATE_MARKER}\n\n"
+        f"{generate_email_template(user_inputs)}"
+    )
+
+def refinement_fallback(refinement_request):
+    """Build the message returned when no API could refine the email."""
+    if "shorter" in refinement_request.lower():
+        return "I've attempted to make the email shorter, but couldn't connect to any available APIs. Please try again later or edit the email manually."
+    elif "casual" in refinement_request.lower():
+        return "I've attempted to make the email more casual, but couldn't connect to any available APIs. Please try again later or edit the email manually."
+    elif "formal" in refinement_request.lower():
+        return "I've attempted to make the email more formal, but couldn't connect to any available APIs. Please try again later or edit the email manually."
+    else:
+        return "I couldn't refine the email due to API errors. Please try again later or edit the email manually."
+
+def provider_clients():
+    """Return the configured provider clients in priority order."""
+    # DeepSeek is always tried first so a missing key is reported like before
+    clients = [deepseek_client]
+    if groq_client.configured:
+        clients.append(groq_client)
     
-    # Create a simple template
-    subject = f"Introducing {offering} for {audience}"
+    # Skip providers the health monitor knows are down
+    if HEALTH_CHECK_ENABLED:
+        clients = [client for client in clients if not health_monitor.is_down(client.name)]
+    return clients
+
+def provider_attempts(messages, **params):
+    """Build one dispatch attempt per provider for the given messages."""
+    return [
+        (client.label, lambda cancel, client=client: client.chat(messages, temperature=TEMPERATURE, cancel=cancel, **params))
+        for client in provider_clients()
+    ]
+
+def run_with_providers(messages, kind='generate', **params):
+    """Send messages through the configured dispatch policy and return the result."""
+    attempts = provider_attempts(messages, **params)
+    primary = attempts[0][0] if attempts else 'none'
+    try:
+        with STAGE_LATENCY.time(kind=kind, stage='provider'):
+            result = dispatch(attempts, DISPATCH_POLICY, HEDGE_DELAY_MS / 1000)
+    except DispatchError as e:
+        for name, error in e.errors:
+            app.logger.error(f"{name} API Error: {str(error)}")
+        FALLBACKS.inc(from_provider=primary, to_provider='template')
+        raise
     
-    intro = f"Dear {audience.split()[0] if ' ' in audience else audience},\n\n"
-    intro += f"I hope this email finds you well. I'm reaching out because I understand that {pain_points} can be challenging in your industry.\n\n"
+    # Count a fallback only when the first provider actually failed, not when it lost a race
+    if any(name == primary for name, _ in result.errors):
+        FALLBACKS.inc(from_provider=primary, to_provider=result.provider)
+    return result
+
+def stream_with_fallback(messages, outcome=None, **params):
+    """Stream tokens from DeepSeek, then Groq, switching only if nothing was sent yet.
     
-    value_prop = f"Our {offering} is specifically designed to address these challenges by providing a solution that helps you overcome {pain_points}.\n\n"
+    If an ``outcome`` dict is given it records the provider that finished the reply,
+    or sets ``outcome['interrupted']`` to the provider that failed after sending tokens.
+    """
+    last_error = None
+    for client in provider_clients():
+        sent_tokens = False
+        try:
+            for token in client.stream(messages, temperature=TEMPERATURE, **params):
+                sent_tokens = True
+                yield token
+            if outcome is not None:
+                outcome['provider'] = client.label
+            return
+        except Exception as e:
+            app.logger.error(f"{client.label} API Error while streaming: {str(e)}")
+            last_error = e
+            # Tokens already reached the client, so we can't switch providers
+            if sent_tokens:
+                if outcome is not None:
+                    outcome['interrupted'] = client.label
+                return
     
-    if special_notes != 'N/A':
-        value_prop += f"Additionally, {special_notes}\n\n"
+    raise RuntimeError(str(last_error))
+
+def stream_with_cache(key, messages, fallback, fresh=False, kind='generate', outcome=None, similar_inputs=None,
+                      **params):
+    """Stream a provider reply, serving it from and saving it to the response cache.
     
-    cta = "Would you be available for a quick 15-minute call next week to discuss how we can help?\n\n"
+    ``outcome['source']`` is set to the provider, 'cache', 'semantic' or 'template' that answered,
+    and ``outcome['parts']`` to the parsed email when one was cached or parsed here.
+    With ``similar_inputs`` the semantic cache is also consulted and updated.
+    """
+    outcome = {} if outcome is None else outcome
+    if not fresh:
+        with STAGE_LATENCY.time(kind=kind, stage='cache_lookup'):
+            cached = response_cache.get(key)
+        if cached:
+            GENERATIONS.inc(kind=kind, source='cache')
+            outcome['source'] = 'cache'
+            outcome['parts'] = cached.get('parts')
+            yield cached['email']
+            return
+        if similar_inputs is not None and semantic_cache is not None:
+            match = semantic_lookup(similar_inputs)
+            if match:
+                GENERATIONS.inc(kind=kind, source='semantic')
+                outcome['source'] = 'semantic'
+                outcome['parts'] = match.get('parts')
+                yield match['email']
+                return
     
-    sign_off = "Best regards,\n[Your Name]\n[Your Position]\n[Your Company]"
+    # An identical request already streaming: wait for it and send its email in one piece
+    leader, call = inflight.join((key, fresh))
+    if not leader:
+        with STAGE_LATENCY.time(kind=kind, stage='coalesced_wait'):
+            shared = inflight.wait(call, COALESCE_MAX_WAIT)
+        if shared is not None:
+            GENERATIONS.inc(kind=kind, source='coalesced')
+            outcome['source'] = shared['provider']
+            outcome['parts'] = shared.get('parts')
+            yield shared['email']
+            return
     
-    email_body = intro + value_prop + cta + sign_off
+    clients = provider_clients()
+    primary = clients[0].label if clients else 'none'
+    parts = []
+    shared = None
+    try:
+        try:
+            with track_generation(), STAGE_LATENCY.time(kind=kind, stage='provider'):
+                for token in stream_with_fallback(messages, outcome, **params):
+                    parts.append(token)
+                    yield token
+        except Exception as e:
+            FALLBACKS.inc(from_provider=primary, to_provider='template')
+            GENERATIONS.inc(kind=kind, source='template')
+            outcome['source'] = 'template'
+            email = fallback(e)
+            shared = {'email': email, 'provider': 'template'}
+            yield email
+            return
+        
+        # Only complete replies are cached, never ones cut off mid-stream
+        if 'provider' in outcome:
+            outcome['source'] = outcome['provider']
+            GENERATIONS.inc(kind=kind, source=outcome['provider'])
+            if outcome['provider'] != primary:
+                FALLBACKS.inc(from_provider=primary, to_provider=outcome['provider'])
+            value = with_parts({'email': ''.join(parts), 'provider': outcome['provider']})
+            outcome['parts'] = value['parts']
+            response_cache.set(key, value)
+            shared = value
+            if similar_inputs is not None and semantic_cache is not None:
+                semantic_store(similar_inputs, value)
+    finally:
+        # A stream the client abandoned shares nothing; its waiters generate on their own
+        if leader:
+            inflight.finish((key, fresh), call, shared)
+
+def semantic_lookup(user_inputs):
+    """Return an email generated earlier for near-identical answers, or None."""
+    with STAGE_LATENCY.time(kind='generate', stage='semantic_lookup'):
+        value, score = semantic_cache.lookup(user_inputs, cache_key('generate', {}))
+    SEMANTIC_SIMILARITY.observe(score)
+    return dict(value, similarity=round(score, 4)) if value else None
+
+def semantic_store(user_inputs, value):
+    """Index a new email so later near-identical answers can reuse it."""
+    semantic_cache.add(user_inputs, cache_key('generate', {}), value)
+
+def cache_key(kind, payload):
+    """Build a response cache key that also covers models, temperature and prompt version."""
+    return make_cache_key(kind, {
+        'request': payload,
+        'models': [DEEPSEEK_MODEL, GROQ_MODEL],
+        'temperature': TEMPERATURE,
+        'prompt': get_prompt(kind).key
+    })
+
+def coalesce(kind, key, produce, started):
+    """Call ``produce()`` once for identical requests in flight together; the others share its result.
     
-    return f"Subject: {subject}\n\n{email_body}"
+    Waiters give up after COALESCE_MAX_WAIT seconds, or when the first caller
+    fails outright, and then call ``produce()`` themselves.
+    """
+    leader, call = inflight.join(key)
+    if not leader:
+        with STAGE_LATENCY.time(kind=kind, stage='coalesced_wait'):
+            shared = inflight.wait(call, COALESCE_MAX_WAIT)
+        if shared is not None:
+            GENERATIONS.inc(kind=kind, source='coalesced')
+            return with_parts(dict(shared, cached=False, coalesced=True,
+                                   latency_ms=round((time.perf_counter() - started) * 1000, 1)))
+        return produce()
+    result = None
+    try:
+        result = produce()
+        return result
+    finally:
+        inflight.finish(key, call, result)
 
-def generate_email_with_groq(user_inputs):
-    """Generate an email using Groq API based on user inputs."""
-    if not GROQ_API_KEY:
-        return None
-        
-    prompt = f"""
-    Create a cold outreach email based on the following information:
+def dispatch_local(user_inputs, seed=0):
+    """Write an email with the local template engine: no provider, cache or network involved.
     
-    Target Audience: {user_inputs.get('audience', 'N/A')}
-    Key Offering: {user_inputs.get('offering', 'N/A')}
-    Pain Points: {user_inputs.get('pain_points', 'N/A')}
-    Tone/Style: {user_inputs.get('tone', 'Professional')}
-    Special Notes: {user_inputs.get('special_notes', 'N/A')}
+    The same inputs and ``seed`` always give the same email.
+    """
+    started = time.perf_counter()
+    with STAGE_LATENCY.time(kind='generate', stage='local'):
+        email = compose_email(user_inputs, seed)
+    GENERATIONS.inc(kind='generate', source='local')
+    return {
+        'email': email,
+        'parts': parse_email(email),
+        'provider': 'local',
+        'cached': False,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+        'requests': 0
+    }
+
+def dispatch_generation(user_inputs, fresh=False, similar=False):
+    """Generate an email and report which provider produced it and how fast.
     
-    Format the response as follows:
+    Set ``fresh`` to skip the response cache and always ask a provider. With
+    ``similar`` an email generated for near-identical answers may be reused;
+    bulk jobs leave it off, since every prospect should get its own email.
+    """
+    started = time.perf_counter()
+    key = cache_key('generate', {k: user_inputs.get(k) for k in KEYS})
+    if not fresh:
+        with STAGE_LATENCY.time(kind='generate', stage='cache_lookup'):
+            cached = response_cache.get(key)
+        if cached:
+            GENERATIONS.inc(kind='generate', source='cache')
+            return with_parts(dict(cached, cached=True, latency_ms=round((time.perf_counter() - started) * 1000, 3)))
+        if similar and semantic_cache is not None:
+            match = semantic_lookup(user_inputs)
+            if match:
+                GENERATIONS.inc(kind='generate', source='semantic')
+                return with_parts(dict(match, cached=True, semantic=True,
+                                       latency_ms=round((time.perf_counter() - started) * 1000, 3)))
     
-    Subject: [Subject Line]
+    def produce():
+        try:
+            with track_generation():
+                result = run_with_providers(generation_messages(user_inputs), 'generate', max_tokens=GENERATE_MAX_TOKENS)
+        except DispatchError as e:
+            # If every API fails, use the template generator
+            GENERATIONS.inc(kind='generate', source='template')
+            with STAGE_LATENCY.time(kind='generate', stage='template'):
+                email = generation_fallback(user_inputs, e.first_error)
+            return with_parts({
+                'email': email,
+                'provider': 'template',
+                'cached': False,
+                'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+                # Lets batch jobs retry later instead of keeping the template
+                'rate_limited': any(getattr(error, 'status_code', None) == 429 for _, error in e.errors)
+            })
+        
+        GENERATIONS.inc(kind='generate', source=result.provider)
+        # Parsed once here; cache hits and the session reuse the parts
+        value = with_parts({'email': result.value, 'provider': result.provider})
+        response_cache.set(key, value)
+        if similar and semantic_cache is not None:
+            semantic_store(user_inputs, value)
+        return dict(value, cached=False, latency_ms=round(result.latency_ms, 1))
     
-    [Email Body with clear Introduction, Value Proposition, Call-to-Action, and Sign-off]
-    """
+    return coalesce('generate', (key, fresh), produce, started)
+
+def dispatch_variants(user_inputs, count, fresh=False):
+    """Generate several alternative emails with a single provider request."""
+    started = time.perf_counter()
+    inputs = {k: user_inputs.get(k) for k in KEYS}
+    key = cache_key('variants', {'inputs': inputs, 'count': count})
+    if not fresh:
+        with STAGE_LATENCY.time(kind='variants', stage='cache_lookup'):
+            cached = response_cache.get(key)
+        if cached:
+            GENERATIONS.inc(kind='variants', source='cache')
+            return dict(cached, cached=True, latency_ms=round((time.perf_counter() - started) * 1000, 3))
     
+    messages = VARIANTS.messages(count=count, **prompt_inputs(user_inputs))
     try:
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "messages": [
-                {"role": "system", "content": "You are a professional email copywriter expert in creating effective cold outreach emails."},
-                {"role": "user", "content": prompt}
-            ],
-            "model": "llama3-8b-8192",
-            "temperature": 0.7,
-            "max_tokens": 1000
+        with track_generation():
+            result = run_with_providers(messages, 'variants', max_tokens=VARIANT_MAX_TOKENS * count)
+    except DispatchError as e:
+        # If every API fails, offer the single template email
+        GENERATIONS.inc(kind='variants', source='template')
+        return {
+            'variants': parse_variants(strip_error_prefix(generation_fallback(user_inputs, e.first_error))),
+            'provider': 'template',
+            'cached': False,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1)
         }
-        
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload)
-        )
-        
-        if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"]
-        else:
-            app.logger.error(f"Groq API Error: {response.text}")
-            return None
-    except Exception as e:
-        app.logger.error(f"Groq API Error: {str(e)}")
-        return None
+    
+    GENERATIONS.inc(kind='variants', source=result.provider)
+    variants = parse_variants(result.value, count)
+    # Only cache complete sets, so a short reply is retried next time
+    if len(variants) == count:
+        response_cache.set(key, {'variants': variants, 'provider': result.provider})
+    return {'variants': variants, 'provider': result.provider, 'cached': False, 'latency_ms': round(result.latency_ms, 1)}
 
 def generate_email(user_inputs):
     """Generate an email using available APIs based on user inputs."""
-    # First try DeepSeek
-    try:
-        response = openai.ChatCompletion.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "You are a professional email copywriter expert in creating effective cold outreach emails."},
-                {"role": "user", "content": f"""
-                Create a cold outreach email based on the following information:
-                
-                Target Audience: {user_inputs.get('audience', 'N/A')}
-                Key Offering: {user_inputs.get('offering', 'N/A')}
-                Pain Points: {user_inputs.get('pain_points', 'N/A')}
-                Tone/Style: {user_inputs.get('tone', 'Professional')}
-                Special Notes: {user_inputs.get('special_notes', 'N/A')}
-                
-                Format the response as follows:
-                
-                Subject: [Subject Line]
-                
-                [Email Body with clear Introduction, Value Proposition, Call-to-Action, and Sign-off]
-                """}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
-    except Exception as deepseek_error:
-        app.logger.error(f"DeepSeek API Error: {str(deepseek_error)}")
-        
-        # Try Groq as fallback
-        groq_response = generate_email_with_groq(user_inputs)
-        if groq_response:
-            return groq_response
-        
-        # If both APIs fail, use the template generator
-        error_str = str(deepseek_error).lower()
-        if "authentication" in error_str or "api key" in error_str or "auth" in error_str:
-            error_message = (
-                "⚠️ Authentication Error: API authentication failed.\n\n"
-                "Here's a basic email template instead:\n\n"
-                f"{generate_email_template(user_inputs)}"
-            )
-        else:
-            error_message = (
-                f"⚠️ Error: {str(deepseek_error)}\n\n"
-                "Here's a basic email template instead:\n\n"
-                f"{generate_email_template(user_inputs)}"
-            )
-        
-        return error_message
+    return dispatch_generation(user_inputs)['email']
+
+def generate_email_stream(user_inputs, fresh=False, similar=False, outcome=None):
+    """Generate an email, yielding tokens as the provider produces them."""
+    key = cache_key('generate', {k: user_inputs.get(k) for k in KEYS})
+    return stream_with_cache(
+        key,
+        generation_messages(user_inputs),
+        lambda error: generation_fallback(user_inputs, error),
+        fresh,
+        outcome=outcome,
+        similar_inputs=user_inputs if similar else None,
+        max_tokens=GENERATE_MAX_TOKENS
+    )
+
+def speculation_changes(draft_inputs, user_inputs):
+    """The refinement that brings a draft in line with answers it was started without ('' if none)."""
+    changes = []
+    drafted_tone = (draft_inputs.get('tone') or 'Professional').strip()
+    tone = (user_inputs.get('tone') or 'Professional').strip()
+    if tone.lower() != drafted_tone.lower():
+        changes.append(f"Use a {tone} tone.")
+    notes = (user_inputs.get('special_notes') or '').strip()
+    if notes.lower().rstrip('.!') not in NO_NOTES and notes != (draft_inputs.get('special_notes') or '').strip():
+        changes.append(f"Work in these details: {notes}")
+    return ' '.join(changes)
+
+def speculative_draft(inputs, cancel):
+    """Generate a draft from the answers so far, giving up as soon as ``cancel`` is set.
+    
+    Runs on the speculator's threads. Returns None instead of a template, so the
+    last answer falls back to a normal generation.
+    """
+    key = cache_key('generate', {k: inputs.get(k) for k in KEYS})
+    cached = response_cache.get(key)
+    if cached:
+        return with_parts(dict(cached))
+    messages = generation_messages(inputs)
+    with track_generation():
+        for client in provider_clients():
+            if cancel.is_set():
+                return None
+            try:
+                email = client.chat(messages, temperature=TEMPERATURE, max_tokens=GENERATE_MAX_TOKENS, cancel=cancel)
+            except ProviderCancelled:
+                return None
+            except Exception as e:
+                app.logger.error(f"{client.label} API Error while drafting: {str(e)}")
+                continue
+            value = with_parts({'email': email, 'provider': client.label})
+            response_cache.set(key, value)
+            return value
+    return None
 
-def refine_email_with_groq(email, refinement_request):
-    """Refine the email using Groq API."""
-    if not GROQ_API_KEY:
+speculator = Speculator(speculative_draft)
+
+def speculate(user_inputs):
+    """Start a background draft, or restart it if the latest answer changes what it should say."""
+    if not SPECULATIVE_GENERATION or sum(1 for k in KEYS if k in user_inputs) < SPECULATE_AFTER:
+        return
+    if 'speculation' not in session:
+        session['speculation'] = uuid.uuid4().hex
+    drafted = speculator.inputs(session['speculation'])
+    if drafted is None or speculation_changes(drafted, user_inputs):
+        speculator.start(session['speculation'], user_inputs)
+
+def take_speculation(user_inputs, fresh=False):
+    """Claim the session's background draft as ``(draft, changes)``, or None if there is none to use."""
+    token = session.pop('speculation', None)
+    if token is None:
         return None
-        
-    try:
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "messages": [
-                {"role": "system", "content": "You are a professional email copywriter expert in refining cold outreach emails."},
-                {"role": "user", "content": f"Original email:\n\n{email}\n\nPlease refine this email based on the following request: {refinement_request}"}
-            ],
-            "model": "llama3-8b-8192",
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
-        
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers=headers,
-            data=json.dumps(payload)
-        )
-        
-        if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"]
-        else:
-            app.logger.error(f"Groq API Error: {response.text}")
-            return None
-    except Exception as e:
-        app.logger.error(f"Groq API Error: {str(e)}")
+    if fresh:
+        speculator.cancel(token)
         return None
+    with STAGE_LATENCY.time(kind='generate', stage='speculation_wait'):
+        taken = speculator.take(token, SPECULATION_MAX_WAIT)
+    if taken is None:
+        SPECULATIONS.inc(outcome='missed')
+        return None
+    inputs, draft = taken
+    return draft, speculation_changes(inputs, user_inputs)
+
+def dispatch_speculative(user_inputs, draft, changes):
+    """Finish the email from a background draft, refining it if the last answers ask for more.
+    
+    Returns None if the refinement failed, so the caller generates from scratch.
+    """
+    started = time.perf_counter()
+    key = cache_key('generate', {k: user_inputs.get(k) for k in KEYS})
+    if not changes:
+        value = draft
+    else:
+        try:
+            with track_generation():
+                result = run_with_providers(refinement_messages(draft['email'], changes, user_inputs), 'refine',
+                                            max_tokens=refinement_budget(draft['email'], changes))
+        except DispatchError:
+            SPECULATIONS.inc(outcome='missed')
+            return None
+        value = with_parts({'email': result.value, 'provider': result.provider})
+    SPECULATIONS.inc(outcome='refined' if changes else 'reused')
+    GENERATIONS.inc(kind='generate', source=value['provider'])
+    response_cache.set(key, value)
+    return dict(value, cached=False, speculative=True, latency_ms=round((time.perf_counter() - started) * 1000, 1))
+
+def speculative_email_stream(user_inputs, draft, changes, outcome):
+    """Yield the email finished from a background draft; the draft is kept if the refinement fails."""
+    if not changes:
+        SPECULATIONS.inc(outcome='reused')
+        GENERATIONS.inc(kind='generate', source=draft['provider'])
+        response_cache.set(cache_key('generate', {k: user_inputs.get(k) for k in KEYS}), draft)
+        outcome.update(source=draft['provider'], parts=draft['parts'])
+        yield draft['email']
+        return
+    SPECULATIONS.inc(outcome='refined')
+    yield from stream_with_cache(
+        cache_key('generate', {k: user_inputs.get(k) for k in KEYS}),
+        refinement_messages(draft['email'], changes, user_inputs),
+        lambda error: draft['email'],
+        fresh=True,
+        outcome=outcome,
+        max_tokens=refinement_budget(draft['email'], changes)
+    )
+    if outcome.get('source') == 'template':
+        outcome.update(source=draft['provider'], parts=draft['parts'])
+
+def dispatch_refinement(email, refinement_request, fresh=False, user_inputs=None, history=None):
+    """Refine an email and report which provider produced it and how fast."""
+    # Drop any error message so only the template part is refined
+    email = strip_error_prefix(email)
+    
+    started = time.perf_counter()
+    key = refinement_key(email, refinement_request, user_inputs, history)
+    if not fresh:
+        with STAGE_LATENCY.time(kind='refine', stage='cache_lookup'):
+            cached = response_cache.get(key)
+        if cached:
+            GENERATIONS.inc(kind='refine', source='cache')
+            return with_parts(dict(cached, cached=True, latency_ms=round((time.perf_counter() - started) * 1000, 3)))
+    
+    def produce():
+        try:
+            with track_generation():
+                result = run_with_providers(
+                    refinement_messages(email, refinement_request, user_inputs, history),
+                    'refine',
+                    max_tokens=refinement_budget(email, refinement_request)
+                )
+        except DispatchError:
+            # If every API fails, provide a simple response
+            GENERATIONS.inc(kind='refine', source='template')
+            return with_parts({
+                'email': refinement_fallback(refinement_request),
+                'provider': 'template',
+                'cached': False,
+                'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+            })
+        
+        GENERATIONS.inc(kind='refine', source=result.provider)
+        value = with_parts({'email': result.value, 'provider': result.provider})
+        response_cache.set(key, value)
+        return dict(value, cached=False, latency_ms=round(result.latency_ms, 1))
+    
+    return coalesce('refine', (key, fresh), produce, started)
 
 def refine_email(email, refinement_request):
     """Refine the generated email based on user feedback."""
-    # Check if the email starts with an error message
-    if email.startswith("⚠️ Error:") or email.startswith("⚠️ Authentication Error:"):
-        # Extract the template part
-        template_start = email.find("Here's a basic email template instead:")
-        if template_start != -1:
-            template_part = email[template_start + len("Here's a basic email template instead:"):]
-            email = template_part.strip()
+    return dispatch_refinement(email, refinement_request)['email']
+
+def refine_email_stream(email, refinement_request, fresh=False, user_inputs=None, history=None, outcome=None):
+    """Refine the email, yielding tokens as the provider produces them."""
+    email = strip_error_prefix(email)
+    return stream_with_cache(
+        refinement_key(email, refinement_request, user_inputs, history),
+        refinement_messages(email, refinement_request, user_inputs, history),
+        lambda error: refinement_fallback(refinement_request),
+        fresh,
+        kind='refine',
+        outcome=outcome,
+        max_tokens=refinement_budget(email, refinement_request)
+    )
+
+def dispatch_segment_template(user_inputs, fresh=False):
+    """Generate the shared email of a campaign segment, with {{first_name}}-style placeholders."""
+    started = time.perf_counter()
+    key = cache_key('segment', {k: user_inputs.get(k) for k in KEYS})
+    if not fresh:
+        with STAGE_LATENCY.time(kind='segment', stage='cache_lookup'):
+            cached = response_cache.get(key)
+        if cached:
+            GENERATIONS.inc(kind='segment', source='cache')
+            return dict(cached, cached=True, latency_ms=round((time.perf_counter() - started) * 1000, 3))
     
-    # First try DeepSeek
     try:
-        response = openai.ChatCompletion.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "You are a professional email copywriter expert in refining cold outreach emails."},
-                {"role": "user", "content": f"Original email:\n\n{email}\n\nPlease refine this email based on the following request: {refinement_request}"}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
-    except Exception as deepseek_error:
-        app.logger.error(f"DeepSeek API Error in refine_email: {str(deepseek_error)}")
-        
-        # Try Groq as fallback
-        groq_response = refine_email_with_groq(email, refinement_request)
-        if groq_response:
-            return groq_response
-        
-        # If both APIs fail, provide a simple response
-        if "shorter" in refinement_request.lower():
-            return "I've attempted to make the email shorter, but couldn't connect to any available APIs. Please try again later or edit the email manually."
-        elif "casual" in refinement_request.lower():
-            return "I've attempted to make the email more casual, but couldn't connect to any available APIs. Please try again later or edit the email manually."
-        elif "formal" in refinement_request.lower():
-            return "I've attempted to make the email more formal, but couldn't connect to any available APIs. Please try again later or edit the email manually."
-        else:
-            return f"I couldn't refine the email due to API errors. Please try again later or edit the email manually."
+        with track_generation():
+            result = run_with_providers(
+                SEGMENT.messages(**prompt_inputs(user_inputs)), 'segment', max_tokens=GENERATE_MAX_TOKENS)
+    except DispatchError as e:
+        # The basic template has no placeholders, so every prospect gets it as is
+        GENERATIONS.inc(kind='segment', source='template')
+        return {
+            'email': generate_email_template(user_inputs),
+            'provider': 'template',
+            'cached': False,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+            'rate_limited': any(getattr(error, 'status_code', None) == 429 for _, error in e.errors)
+        }
+    
+    GENERATIONS.inc(kind='segment', source=result.provider)
+    response_cache.set(key, {'email': result.value, 'provider': result.provider})
+    return {'email': result.value, 'provider': result.provider, 'cached': False, 'latency_ms': round(result.latency_ms, 1)}
+
+def prospect_opener(row, fresh=False):
+    """Write a personalized opening line; return ``(opener, requested)``.
+    
+    ``requested`` says whether a provider was called. The opener is empty
+    when the row has nothing to personalize on or every provider failed.
+    """
+    if not any(row.get(k) for k in ('title', 'company', 'detail')):
+        return '', False
+    key = cache_key('opener', {k: row.get(k) for k in MERGE_KEYS + ['offering']})
+    if not fresh:
+        cached = response_cache.get(key)
+        if cached:
+            GENERATIONS.inc(kind='opener', source='cache')
+            return cached['opener'], False
+    
+    name = ' '.join(row[k] for k in ('first_name', 'last_name') if row.get(k))
+    messages = OPENER.messages(
+        name=name or 'N/A',
+        title=row.get('title', 'N/A'),
+        company=row.get('company', 'N/A'),
+        detail=row.get('detail', 'N/A'),
+        offering=row.get('offering', 'N/A')
+    )
+    try:
+        result = run_with_providers(messages, 'opener', max_tokens=OPENER_MAX_TOKENS)
+    except DispatchError:
+        GENERATIONS.inc(kind='opener', source='template')
+        return '', True
+    
+    lines = result.value.strip().splitlines()
+    opener = lines[0].strip().strip('"') if lines else ''
+    GENERATIONS.inc(kind='opener', source=result.provider)
+    response_cache.set(key, {'opener': opener, 'provider': result.provider})
+    return opener, True
+
+def dispatch_prospect(row, fresh=False, segment=False, opener=False, scope=None, local=False):
+    """Write one campaign email: generated for the row, or its segment's email merged with the row's details.
+    
+    With ``local`` the local template engine writes every row instead. ``requests``
+    in the result counts the provider calls made, so batch jobs only wait for
+    the request pace when a provider was actually used.
+    """
+    if local:
+        # A fresh job gets its own scope, which varies the wording of every row
+        return dispatch_local(row, seed=scope or 0)
+    if not segment:
+        return dispatch_generation(row, fresh=fresh)
+    
+    started = time.perf_counter()
+    base, generated = segment_templates.get(row, fresh=fresh, scope=scope)
+    values = dict(row)
+    requested = False
+    if opener:
+        values['opener'], requested = prospect_opener(row, fresh)
+    with STAGE_LATENCY.time(kind='segment', stage='merge'):
+        email = base['template'].render(values)
+    result = {
+        'email': email,
+        'parts': parse_email(email),
+        'provider': base['provider'],
+        'cached': base['cached'],
+        'segment': base['segment'],
+        'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+        'requests': int(generated and not base['cached']) + int(requested)
+    }
+    if base.get('rate_limited'):
+        result['rate_limited'] = True
+    return result
+
+def campaign_options():
+    """Read the generation options of a /campaigns or /batches upload from the query string."""
+    def flag(name):
+        return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+    
+    options = {'fresh': flag('fresh')}
+    if request.args.get('engine', '').lower() == 'local':
+        options.update(local=True, scope=uuid.uuid4().hex if options['fresh'] else None)
+    elif request.args.get('mode', '').lower() == 'segment':
+        # A fresh segment job regenerates each segment's email once, not once per prospect
+        options.update(segment=True, opener=flag('opener'), scope=uuid.uuid4().hex if options['fresh'] else None)
+    return options
+
+# Base email of each campaign segment, shared by all of its prospects
+segment_templates = SegmentTemplates(dispatch_segment_template, max_entries=SEGMENT_CACHE_ENTRIES)
+
+# Shared worker pool for bulk campaign generation
+campaign_manager = CampaignManager(dispatch_prospect, max_workers=CAMPAIGN_CONCURRENCY)
+
+# Durable queue for large offline campaigns, drained at a steady pace
+batch_queue = BatchQueue(BATCH_PATH)
+batch_worker = BatchWorker(batch_queue, dispatch_prospect, requests_per_minute=BATCH_REQUESTS_PER_MINUTE)
 
 @app.route('/')
 def index():
     """Render the home page."""
     # Reset session data when starting fresh
+    if 'speculation' in session:
+        speculator.cancel(session['speculation'])
     session.clear()
     session['step'] = 0
     session['user_inputs'] = {}
@@ -271,7 +1053,12 @@ def chat():
     if session['step'] < len(QUESTIONS):
         # Still collecting initial information
         if session['step'] > 0:  # Store the answer to the previous question
+            problem = answer_too_long(user_message)
+            if problem:
+                return jsonify({'message': problem + QUESTIONS[session['step'] - 1], 'is_question': True})
             session['user_inputs'][KEYS[session['step'] - 1]] = user_message
+            session.modified = True
+            speculate(session['user_inputs'])
         
         # Get the next question
         question = QUESTIONS[session['step']]
@@ -283,119 +1070,640 @@ def chat():
         })
     
     elif session['step'] == len(QUESTIONS):
+        problem = answer_too_long(user_message)
+        if problem:
+            return jsonify({'message': problem + QUESTIONS[-1], 'is_question': True})
         # Store the answer to the last question
         session['user_inputs'][KEYS[session['step'] - 1]] = user_message
+        session.modified = True
         
-        # Generate the email
-        email = generate_email(session['user_inputs'])
-        session['email'] = email
+        # Generate the email, finishing the background draft if one was started
+        if data.get('engine') == 'local':
+            # Written locally in well under a millisecond, so a background draft isn't needed
+            if 'speculation' in session:
+                speculator.cancel(session.pop('speculation'))
+            result = dispatch_local(session['user_inputs'], seed=uuid.uuid4().hex if data.get('fresh') else 0)
+        else:
+            taken = take_speculation(session['user_inputs'], fresh=bool(data.get('fresh')))
+            result = dispatch_speculative(session['user_inputs'], *taken) if taken else None
+            if result is None:
+                result = dispatch_generation(session['user_inputs'], fresh=bool(data.get('fresh')), similar=True)
+        email = result['email']
+        store_email(email, result['parts'])
+        session['email_source'] = 'semantic' if result.get('semantic') else 'cache' if result['cached'] else result['provider']
+        session['refinements'] = new_history()
         session['step'] += 1
         
         return jsonify({
-            'message': f"Here's your generated email:\n\n{email}\n\nWould you like to refine it? For example, you can ask for:\n1. A more casual/formal tone\n2. A shorter/longer email\n3. More emphasis on specific benefits\n4. Any other changes",
+            'message': f"{GENERATED_PREFIX}{email}{GENERATED_SUFFIX}",
             'is_question': True,
-            'email': email
+            'email': email,
+            'parts': result['parts'],
+            'provider': result['provider'],
+            'cached': result['cached'],
+            'latency_ms': result['latency_ms']
         })
     
     else:
         # Handle refinement requests
-        if user_message.lower() in ['no', 'no thanks', 'it looks good', 'looks good', 'perfect']:
+        if user_message.lower() in SATISFIED_REPLIES:
             # User is satisfied with the email
             return jsonify({
                 'message': "Great! Feel free to use this email for your outreach. If you want to create a new email, just refresh the page.",
                 'is_question': False
             })
+        elif repeated_refinement(user_message):
+            # A double submit: the change was already made, so show the email again instead of refining twice
+            GENERATIONS.inc(kind='refine', source='deduplicated')
+            return jsonify({
+                'message': f"{REFINED_PREFIX}{session['email']}{REFINED_SUFFIX}",
+                'is_question': True,
+                'email': session['email'],
+                'parts': current_parts(),
+                'provider': 'deduplicated',
+                'cached': True,
+                'latency_ms': 0.0
+            })
         else:
             # User wants refinements
-            refined_email = refine_email(session['email'], user_message)
-            session['email'] = refined_email
+            count_first_refinement()
+            result = dispatch_refinement(
+                render_email(current_parts()),
+                user_message,
+                fresh=bool(data.get('fresh')),
+                user_inputs=session['user_inputs'],
+                history=session.get('refinements')
+            )
+            refined_email = result['email']
+            store_email(refined_email, result['parts'])
+            # Only requests that were actually applied are replayed next time
+            if result['provider'] != 'template':
+                record_refinement(user_message)
             
             return jsonify({
-                'message': f"I've refined your email:\n\n{refined_email}\n\nWould you like to refine it further?",
+                'message': f"{REFINED_PREFIX}{refined_email}{REFINED_SUFFIX}",
                 'is_question': True,
-                'email': refined_email
+                'email': refined_email,
+                'parts': result['parts'],
+                'provider': result['provider'],
+                'cached': result['cached'],
+                'latency_ms': result['latency_ms']
             })
 
+def sse_event(event, data):
+    """Format a server-sent event carrying a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def save_session_now():
+    """Persist the session after the response headers were already sent."""
+    app.session_interface.save_session(app, session, Response())
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Handle chat interactions, streaming generated emails as server-sent events."""
+    data = request.get_json()
+    user_message = data.get('message', '').strip()
+    step = session.get('step', 0)
+    
+    # Questions and the final "looks good" reply are not worth streaming, and
+    # cookie sessions can't record the email once the response has started
+    if step < len(QUESTIONS) or (step > len(QUESTIONS) and user_message.lower() in SATISFIED_REPLIES):
+        return chat()
+    if step == len(QUESTIONS) and (answer_too_long(user_message) or data.get('engine') == 'local'):
+        return chat()
+    if step > len(QUESTIONS) and repeated_refinement(user_message):
+        return chat()
+    if not getattr(app.session_interface, 'supports_deferred_save', False):
+        return chat()
+    
+    if step == len(QUESTIONS):
+        # Store the answer to the last question and generate the email
+        session['user_inputs'][KEYS[step - 1]] = user_message
+        session['step'] += 1
+        session['refinements'] = new_history()
+        session.modified = True
+        refining = False
+        outcome = {}
+        taken = take_speculation(session['user_inputs'], fresh=bool(data.get('fresh')))
+        if taken:
+            tokens = speculative_email_stream(session['user_inputs'], *taken, outcome)
+        else:
+            tokens = generate_email_stream(session['user_inputs'], fresh=bool(data.get('fresh')), similar=True,
+                                           outcome=outcome)
+        prefix, suffix = GENERATED_PREFIX, GENERATED_SUFFIX
+    else:
+        # Refine the existing email
+        count_first_refinement()
+        refining = True
+        outcome = {}
+        tokens = refine_email_stream(
+            render_email(current_parts()),
+            user_message,
+            fresh=bool(data.get('fresh')),
+            user_inputs=session.get('user_inputs'),
+            history=session.get('refinements'),
+            outcome=outcome
+        )
+        prefix, suffix = REFINED_PREFIX, REFINED_SUFFIX
+    
+    def events():
+        yield sse_event('start', {'message': prefix})
+        parts = []
+        for token in tokens:
+            parts.append(token)
+            yield sse_event('token', {'token': token})
+        
+        if outcome.get('interrupted'):
+            # Keep the earlier email and let the same message be sent again
+            if not refining:
+                session['step'] = len(QUESTIONS)
+                save_session_now()
+            yield sse_event('error', {'message': INTERRUPTED_MESSAGE.format(provider=outcome['interrupted'])})
+            return
+        
+        email = ''.join(parts)
+        email_parts = outcome.get('parts') or parse_email(email)
+        store_email(email, email_parts)
+        if not refining:
+            session['email_source'] = outcome.get('source', 'template')
+        elif outcome.get('source') not in (None, 'template'):
+            record_refinement(user_message)
+        save_session_now()
+        
+        yield sse_event('done', {
+            'message': f"{prefix}{email}{suffix}",
+            'is_question': True,
+            'email': email,
+            'parts': email_parts
+        })
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/variants', methods=['POST'])
+def variants():
+    """Generate several alternative emails for A/B testing in one provider request."""
+    data = request.get_json(silent=True) or {}
+    # Use the answers given in the chat unless inputs are passed explicitly
+    user_inputs = data.get('inputs') or session.get('user_inputs') or {}
+    if not isinstance(user_inputs, dict) or not any(user_inputs.get(k) for k in KEYS):
+        return jsonify({
+            'status': 'error',
+            'message': 'Answer the questions in the chat first, or pass "inputs".'
+        }), 400
+    
+    try:
+        count = int(data.get('count', VARIANTS_DEFAULT))
+    except (TypeError, ValueError):
+        count = 0
+    if not 1 <= count <= VARIANTS_MAX:
+        return jsonify({
+            'status': 'error',
+            'message': f'count must be between 1 and {VARIANTS_MAX}.'
+        }), 400
+    
+    result = dispatch_variants(user_inputs, count, fresh=bool(data.get('fresh')))
+    return jsonify(dict(result, status='success'))
+
 @app.route('/download', methods=['GET'])
 def download():
     """Download the generated email as text."""
     if 'email' in session and session['email']:
-        # Remove error messages if present
-        email = session['email']
-        if email.startswith("⚠️ Error:") or email.startswith("⚠️ Authentication Error:"):
-            template_start = email.find("Here's a basic email template instead:")
-            if template_start != -1:
-                email = email[template_start + len("Here's a basic email template instead:"):].strip()
+        # Written from the parts, which leave out any error notice
+        parts = current_parts()
         
         return jsonify({
-            'email': email
+            'email': render_email(parts),
+            'parts': parts
         })
     else:
         return jsonify({
             'error': 'No email has been generated yet.'
         }), 400
 
+def read_uploaded_prospects(max_rows):
+    """Parse prospects from a file upload, a JSON body or a raw CSV/JSONL body.
+    
+    Returns ``(prospects, None)``, or ``(None, error_response)`` if the upload is unusable.
+    """
+    upload = request.files.get('file')
+    try:
+        if upload:
+            prospects = parse_prospects(upload.read(), upload.filename or '')
+        elif request.is_json:
+            data = request.get_json()
+            prospects = data.get('prospects', []) if isinstance(data, dict) else data
+            prospects = parse_prospects(json.dumps(prospects))
+        else:
+            prospects = parse_prospects(request.get_data(), request.args.get('filename', ''))
+    except (ValueError, UnicodeDecodeError) as e:
+        return None, (jsonify({
+            'status': 'error',
+            'message': f'Could not parse prospects: {str(e)}'
+        }), 400)
+    
+    if not prospects:
+        return None, (jsonify({
+            'status': 'error',
+            'message': 'No prospects found in the upload.'
+        }), 400)
+    
+    if len(prospects) > max_rows:
+        return None, (jsonify({
+            'status': 'error',
+            'message': f'Too many prospects: {len(prospects)} (limit is {max_rows}).'
+        }), 413)
+    
+    return prospects, None
+
+@app.route('/campaigns', methods=['POST'])
+def create_campaign():
+    """Start a bulk generation job from an uploaded CSV/JSONL prospect file."""
+    prospects, error = read_uploaded_prospects(CAMPAIGN_MAX_ROWS)
+    if error:
+        return error
+    
+    campaign = campaign_manager.submit(prospects, **campaign_options())
+    
+    return jsonify({
+        'status': 'success',
+        'job_id': campaign.id,
+        'total': len(prospects)
+    }), 202
+
+@app.route('/campaigns/<job_id>', methods=['GET'])
+def campaign_status(job_id):
+    """Report the progress of a bulk generation job."""
+    campaign = campaign_manager.get(job_id)
+    if not campaign:
+        return jsonify({'error': 'Campaign not found.'}), 404
+    
+    return jsonify(campaign.summary())
+
+@app.route('/campaigns/<job_id>/results', methods=['GET'])
+def campaign_results(job_id):
+    """Return the generated emails of a bulk generation job."""
+    campaign = campaign_manager.get(job_id)
+    if not campaign:
+        return jsonify({'error': 'Campaign not found.'}), 404
+    
+    summary = campaign.summary()
+    summary['results'] = [result for result in campaign.results if result is not None]
+    return jsonify(summary)
+
+@app.route('/campaigns/<job_id>/export', methods=['GET'])
+def campaign_export(job_id):
+    """Stream a bulk generation job's emails as CSV, JSONL or MBOX, optionally gzipped."""
+    campaign = campaign_manager.get(job_id)
+    if not campaign:
+        return jsonify({'error': 'Campaign not found.'}), 404
+    return export_response(
+        f'campaign-{job_id}',
+        lambda: campaign_records(campaign),
+        campaign.finished_at is not None,
+        f"{campaign.completed}.{campaign.failed}",
+        campaign.created_at
+    )
+
+def campaign_records(campaign):
+    """Finished rows of an in-memory campaign as export records, in input order."""
+    for index, result in enumerate(campaign.results):
+        if result is None:
+            continue
+        status = 'failed' if 'error' in result else 'done'
+        yield dict(result, index=index, status=status, inputs=result.get('inputs', campaign.rows[index]))
+
+export_sizes = OrderedDict()
+export_sizes_lock = threading.Lock()
+
+def export_response(name, records, complete, version, created_at):
+    """Stream an export in the format asked for, serving byte ranges once the job is finished.
+    
+    ``records`` is called for a fresh iterator each time the export is rendered.
+    Ranges need the total size, which costs one extra pass the first time.
+    """
+    fmt = request.args.get('format', 'jsonl').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({
+            'status': 'error',
+            'message': f"format must be one of: {', '.join(EXPORT_FORMATS)}."
+        }), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"{name}.{extension}" + ('.gz' if compress else '')
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    if compress:
+        mimetype = 'application/gzip'
+    
+    def render():
+        return export_chunks(records(), fmt, compress, sender=EXPORT_SENDER, created_at=created_at)
+    
+    # Rows still being written would change the bytes under a resumed download
+    if not complete:
+        return Response(render(), mimetype=mimetype, headers=headers)
+    
+    etag = f"{name}-{fmt}-{int(compress)}-{version}"
+    with export_sizes_lock:
+        length = export_sizes.get(etag)
+    if length is None:
+        # Measured outside the lock, so one large export doesn't hold up the others
+        length = sum(len(chunk) for chunk in render())
+        with export_sizes_lock:
+            export_sizes[etag] = length
+            while len(export_sizes) > EXPORT_SIZE_ENTRIES:
+                export_sizes.popitem(last=False)
+    headers.update({'ETag': f'"{etag}"', 'Accept-Ranges': 'bytes'})
+    
+    byte_range = request.range
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and (if_range is None or if_range.strip('"') == etag):
+        span = byte_range.range_for_length(length)
+        if span is None:
+            headers['Content-Range'] = f'bytes */{length}'
+            return Response(status=416, headers=headers)
+        start, stop = span
+        headers.update({'Content-Range': f'bytes {start}-{stop - 1}/{length}', 'Content-Length': str(stop - start)})
+        return Response(byte_slice(render(), start, stop), status=206, mimetype=mimetype, headers=headers)
+    headers['Content-Length'] = str(length)
+    return Response(render(), mimetype=mimetype, headers=headers)
+
+def check_provider(client):
+    """Send a tiny completion to a provider and describe the outcome."""
+    try:
+        client.chat([{"role": "user", "content": "Hello"}], temperature=None, max_tokens=5)
+        return {'status': 'success', 'message': 'API connection successful'}
+    except Exception as e:
+        error_str = str(e)
+        if "authentication" in error_str.lower() or "api key" in error_str.lower() or "auth" in error_str.lower():
+            return {'status': 'error', 'message': f'Authentication failed: {error_str}'}
+        return {'status': 'error', 'message': f'API connection failed: {error_str}'}
+
+def check_providers(clients):
+    """Check several providers at once, returning each one's outcome by name."""
+    futures = {name: verify_executor.submit(check_provider, client) for name, client in clients.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose metrics in the Prometheus text format, summed over every worker when METRICS_DIR is set."""
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/batches', methods=['POST'])
+def create_batch():
+    """Queue a large prospect file for durable offline generation."""
+    prospects, error = read_uploaded_prospects(BATCH_MAX_ROWS)
+    if error:
+        return error
+    
+    job_id = batch_queue.submit(prospects, **campaign_options())
+    
+    return jsonify({
+        'status': 'success',
+        'job_id': job_id,
+        'total': len(prospects)
+    }), 202
+
+@app.route('/batches', methods=['GET'])
+def list_batches():
+    """List the most recent batch jobs."""
+    return jsonify({'jobs': batch_queue.jobs()})
+
+@app.route('/batches/<job_id>', methods=['GET'])
+def batch_status(job_id):
+    """Report the progress of a batch job."""
+    summary = batch_queue.summary(job_id)
+    if not summary:
+        return jsonify({'error': 'Batch job not found.'}), 404
+    return jsonify(summary)
+
+@app.route('/batches/<job_id>/results', methods=['GET'])
+def batch_results(job_id):
+    """Stream the finished rows of a batch job as JSON lines."""
+    if not batch_queue.summary(job_id):
+        return jsonify({'error': 'Batch job not found.'}), 404
+    return Response(
+        batch_queue.export_jsonl(job_id),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename=batch-{job_id}.jsonl'}
+    )
+
+@app.route('/batches/<job_id>/export', methods=['GET'])
+def batch_export(job_id):
+    """Stream a batch job's emails as CSV, JSONL or MBOX, optionally gzipped."""
+    summary = batch_queue.summary(job_id)
+    if not summary:
+        return jsonify({'error': 'Batch job not found.'}), 404
+    return export_response(
+        f'batch-{job_id}',
+        lambda: batch_queue.iter_results(job_id),
+        summary['status'] == 'completed',
+        f"{summary['completed']}.{summary['failed']}",
+        summary['created_at']
+    )
+
+@app.route('/prompts', methods=['GET'])
+def prompts():
+    """List the registered prompt templates with their versions and token counts."""
+    return jsonify({'prompts': [template.describe() for template in all_prompts()]})
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Report response cache size and hit rate."""
+    stats = response_cache.stats()
+    stats['semantic'] = semantic_cache.stats() if semantic_cache is not None else {'enabled': False}
+    stats['coalescing'] = inflight.stats()
+    return jsonify(stats)
+
+# Generations currently being produced, so shutdown can wait for them
+in_flight = {'count': 0}
+in_flight_done = threading.Condition()
+
+@contextmanager
+def track_generation():
+    """Count a generation as in flight for the duration of the block."""
+    with in_flight_done:
+        in_flight['count'] += 1
+    try:
+        yield
+    finally:
+        with in_flight_done:
+            in_flight['count'] -= 1
+            in_flight_done.notify_all()
+
+# Gauges read at scrape time from the objects that already track these values
+metrics_registry.gauge('generations_in_flight', 'Generations currently waiting on a provider',
+                       callback=lambda: in_flight['count'])
+metrics_registry.gauge('campaign_queue_depth', 'Campaign rows waiting for a free worker',
+                       callback=lambda: campaign_manager.queue_depth())
+metrics_registry.counter('llm_provider_retries_total', 'Provider requests retried after a transient failure',
+                         ('provider',),
+                         callback=lambda: {(name,): policy.retries for name, policy in PROVIDER_RETRY_POLICIES.items()})
+metrics_registry.gauge('llm_provider_rate_limit', 'Current client-side request rate limit per provider (req/s)',
+                       ('provider',),
+                       callback=lambda: {(name,): limiter.rate for name, limiter in PROVIDER_RATE_LIMITERS.items()})
+metrics_registry.gauge('llm_provider_circuit_open', 'Whether a provider is being skipped by its circuit breaker',
+                       ('provider',),
+                       callback=lambda: {(name,): int(breaker.state == OPEN) for name, breaker in PROVIDER_BREAKERS.items()},
+                       aggregate='max')
+# Every worker reads the same queue file, so their counts aren't added up
+metrics_registry.gauge('batch_queue_pending', 'Batch job rows not yet generated',
+                       callback=lambda: batch_queue.pending_count(), aggregate='max')
+metrics_registry.counter('response_cache_lookups_total', 'Response cache lookups', ('result',),
+                         callback=lambda: {('hit',): response_cache.hits, ('miss',): response_cache.misses})
+metrics_registry.counter('semantic_cache_lookups_total', 'Semantic cache lookups', ('result',),
+                         callback=lambda: {('hit',): semantic_cache.hits, ('miss',): semantic_cache.misses}
+                         if semantic_cache is not None else {})
+metrics_registry.counter('segment_templates_total', 'Segment emails generated and reused for campaign rows',
+                         ('result',), callback=lambda: {('generated',): segment_templates.generated,
+                                                        ('reused',): segment_templates.reused})
+metrics_registry.counter('speculative_drafts_total', 'Background chat drafts started, cancelled as stale and used',
+                         ('state',), callback=lambda: {(state,): count for state, count in speculator.stats().items()
+                                                       if state != 'pending'})
+metrics_registry.gauge('response_cache_entries', 'Entries held by the response cache',
+                       callback=lambda: response_cache.stats()['entries'],
+                       aggregate='sum' if os.getenv("CACHE_BACKEND", "memory") == 'memory' else 'max')
+
+def instrument_sessions(interface):
+    """Time every session load and save made through a session interface."""
+    open_session = interface.open_session
+    save_session = interface.save_session
+    
+    def timed_open(app_, request_):
+        with SESSION_LATENCY.time(operation='open'):
+            return open_session(app_, request_)
+    
+    def timed_save(app_, session_, response):
+        with SESSION_LATENCY.time(operation='save'):
+            return save_session(app_, session_, response)
+    
+    interface.open_session = timed_open
+    interface.save_session = timed_save
+
+instrument_sessions(app.session_interface)
+
+# How often (seconds) each worker checks .env for keys saved by another worker
+ENV_RELOAD_INTERVAL = 1.0
+env_state = {'mtime': os.path.getmtime(ENV_PATH) if os.path.exists(ENV_PATH) else None, 'checked_at': 0.0}
+
+def reload_api_keys_if_changed():
+    """Rebuild provider clients when another worker process rewrote .env."""
+    now = time.time()
+    if now - env_state['checked_at'] < ENV_RELOAD_INTERVAL:
+        return
+    env_state['checked_at'] = now
+    
+    try:
+        mtime = os.path.getmtime(ENV_PATH)
+    except OSError:
+        return
+    if mtime == env_state['mtime']:
+        return
+    
+    with clients_lock:
+        if mtime == env_state['mtime']:
+            return
+        env_state['mtime'] = mtime
+        
+        values = dotenv_values(ENV_PATH)
+        deepseek_api_key = values.get('OPENAI_API_KEY') or deepseek_client.api_key
+        deepseek_api_base = values.get('OPENAI_API_BASE') or deepseek_client.api_base
+        groq_api_key = values.get('GROQ_API_KEY') or groq_client.api_key
+        
+        if (deepseek_api_key, deepseek_api_base) != (deepseek_client.api_key, deepseek_client.api_base):
+            swap_client('deepseek', make_deepseek_client(deepseek_api_key, deepseek_api_base))
+        if groq_api_key != groq_client.api_key:
+            swap_client('groq', make_groq_client(groq_api_key))
+
+@app.before_request
+def prepare_request():
+    """Start background workers and pick up new API keys before each request."""
+    request.environ['app.started'] = time.perf_counter()
+    if HEALTH_CHECK_ENABLED:
+        health_monitor.start()
+    if BATCH_WORKER_ENABLED:
+        batch_worker.start()
+    if METRICS_DIR:
+        metrics_registry.share(METRICS_DIR, METRICS_SYNC_SECONDS)
+    reload_api_keys_if_changed()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record how long the request took, by endpoint rather than raw path."""
+    started = request.environ.get('app.started')
+    if started is not None:
+        HTTP_LATENCY.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+def create_app(config=None):
+    """Return the application configured for serving by a WSGI server."""
+    if config:
+        app.config.update(config)
+    if HEALTH_CHECK_ENABLED:
+        health_monitor.start()
+    if BATCH_WORKER_ENABLED:
+        batch_worker.start()
+    if METRICS_DIR:
+        metrics_registry.share(METRICS_DIR, METRICS_SYNC_SECONDS)
+    return app
+
+def shutdown_services(timeout=30):
+    """Stop background work and wait for in-flight generations to finish."""
+    deadline = time.time() + timeout
+    health_monitor.stop()
+    # Rows already being generated finish; queued rows are dropped
+    campaign_manager.shutdown(wait=True, cancel_pending=True)
+    # The batch row in progress is checkpointed; the rest stay queued on disk
+    batch_worker.stop(timeout)
+    with in_flight_done:
+        while in_flight['count'] and time.time() < deadline:
+            in_flight_done.wait(deadline - time.time())
+    # Counts from this worker stay in the shared totals after it exits
+    metrics_registry.stop()
+
 @app.route('/check-api', methods=['GET'])
 def check_api():
-    """Check if the APIs are configured correctly."""
-    api_status = {
-        'deepseek': {'status': 'error', 'message': 'Not configured'},
-        'groq': {'status': 'error', 'message': 'Not configured'}
-    }
+    """Report provider status from the background health monitor."""
+    if HEALTH_CHECK_ENABLED:
+        api_status = health_monitor.snapshot()
+    else:
+        # Without the monitor, fall back to probing each provider live
+        api_status = {
+            'deepseek': {'status': 'error', 'message': 'Not configured'},
+            'groq': {'status': 'error', 'message': 'Not configured'}
+        }
+        clients = {'deepseek': deepseek_client, 'groq': groq_client}
+        api_status.update(check_providers({name: client for name, client in clients.items() if client.configured}))
     
-    # Check DeepSeek
-    if openai.api_key:
-        try:
-            response = openai.ChatCompletion.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "user", "content": "Hello"}
-                ],
-                max_tokens=5
-            )
-            api_status['deepseek'] = {'status': 'success', 'message': 'API connection successful'}
-        except Exception as e:
-            error_str = str(e)
-            if "authentication" in error_str.lower() or "api key" in error_str.lower() or "auth" in error_str.lower():
-                api_status['deepseek'] = {'status': 'error', 'message': f'Authentication failed: {error_str}'}
-            else:
-                api_status['deepseek'] = {'status': 'error', 'message': f'API connection failed: {error_str}'}
-    
-    # Check Groq
-    if GROQ_API_KEY:
-        try:
-            headers = {
-                "Authorization": f"Bearer {GROQ_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "messages": [
-                    {"role": "user", "content": "Hello"}
-                ],
-                "model": "llama3-8b-8192",
-                "max_tokens": 5
-            }
-            
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(payload)
-            )
-            
-            if response.status_code == 200:
-                api_status['groq'] = {'status': 'success', 'message': 'API connection successful'}
-            else:
-                api_status['groq'] = {'status': 'error', 'message': f'API connection failed: {response.text}'}
-        except Exception as e:
-            api_status['groq'] = {'status': 'error', 'message': f'API connection failed: {str(e)}'}
+    # Show whether requests are currently skipping each provider
+    for name, api in api_status.items():
+        api['circuit'] = PROVIDER_BREAKERS[name].snapshot()
     
     # Determine overall status
-    overall_status = 'success' if (api_status['deepseek']['status'] == 'success' or api_status['groq']['status'] == 'success') else 'error'
+    statuses = [api['status'] for api in api_status.values()]
+    if 'success' in statuses:
+        overall_status = 'success'
+    elif 'pending' in statuses:
+        overall_status = 'pending'
+    else:
+        overall_status = 'error'
+    
+    messages = {
+        'success': 'At least one API is working',
+        'pending': 'API health checks are still running',
+        'error': 'All APIs failed'
+    }
     
     return jsonify({
         'status': overall_status,
-        'message': 'At least one API is working' if overall_status == 'success' else 'All APIs failed',
+        'message': messages[overall_status],
         'apis': api_status
     })
 
@@ -407,72 +1715,7 @@ def verify_api():
     deepseek_api_base = data.get('deepseek_api_base', 'https://api.deepseek.com/v1')
     groq_api_key = data.get('groq_api_key', '')
     
-    results = {
-        'deepseek': {'status': 'not_tested', 'message': 'API key not provided'},
-        'groq': {'status': 'not_tested', 'message': 'API key not provided'},
-        'overall': {'status': 'error', 'message': 'No API keys provided'}
-    }
-    
-    # Verify DeepSeek API
-    if deepseek_api_key:
-        try:
-            # Create a temporary OpenAI client to avoid modifying the global one
-            import openai as temp_openai
-            temp_openai.api_key = deepseek_api_key
-            temp_openai.api_base = deepseek_api_base
-            
-            response = temp_openai.ChatCompletion.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "user", "content": "Hello"}
-                ],
-                max_tokens=5
-            )
-            results['deepseek'] = {'status': 'success', 'message': 'API connection successful'}
-        except Exception as e:
-            error_str = str(e)
-            if "authentication" in error_str.lower() or "api key" in error_str.lower() or "auth" in error_str.lower():
-                results['deepseek'] = {'status': 'error', 'message': f'Authentication failed: {error_str}'}
-            else:
-                results['deepseek'] = {'status': 'error', 'message': f'API connection failed: {error_str}'}
-    
-    # Verify Groq API
-    if groq_api_key:
-        try:
-            headers = {
-                "Authorization": f"Bearer {groq_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "messages": [
-                    {"role": "user", "content": "Hello"}
-                ],
-                "model": "llama3-8b-8192",
-                "max_tokens": 5
-            }
-            
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(payload)
-            )
-            
-            if response.status_code == 200:
-                results['groq'] = {'status': 'success', 'message': 'API connection successful'}
-            else:
-                results['groq'] = {'status': 'error', 'message': f'API connection failed: {response.text}'}
-        except Exception as e:
-            results['groq'] = {'status': 'error', 'message': f'API connection failed: {str(e)}'}
-    
-    # Determine overall status
-    if results['deepseek']['status'] == 'success' or results['groq']['status'] == 'success':
-        results['overall'] = {'status': 'success', 'message': 'At least one API is working'}
-    else:
-        if deepseek_api_key or groq_api_key:
-            results['overall'] = {'status': 'error', 'message': 'All APIs failed to connect'}
-    
-    return jsonify(results)
+    return jsonify(verify_api_keys(deepseek_api_key, deepseek_api_base, groq_api_key))
 
 @app.route('/update-api-keys', methods=['POST'])
 def update_api_keys():
@@ -488,52 +1731,19 @@ def update_api_keys():
     # Only update if at least one key is valid
     if verification_result['overall']['status'] == 'success':
         try:
-            # Read current .env file
-            env_path = os.path.join(os.path.dirname(__file__), '.env')
-            env_exists = os.path.exists(env_path)
-            
-            if env_exists:
-                with open(env_path, 'r') as f:
-                    env_lines = f.readlines()
-            else:
-                env_lines = []
-            
-            # Process lines to update or add keys
-            updated_openai_key = False
-            updated_openai_base = False
-            updated_groq_key = False
-            
-            for i, line in enumerate(env_lines):
-                if line.startswith('OPENAI_API_KEY=') and deepseek_api_key:
-                    env_lines[i] = f'OPENAI_API_KEY={deepseek_api_key}\n'
-                    updated_openai_key = True
-                elif line.startswith('OPENAI_API_BASE=') and deepseek_api_base:
-                    env_lines[i] = f'OPENAI_API_BASE={deepseek_api_base}\n'
-                    updated_openai_base = True
-                elif line.startswith('GROQ_API_KEY=') and groq_api_key:
-                    env_lines[i] = f'GROQ_API_KEY={groq_api_key}\n'
-                    updated_groq_key = True
-            
-            # Add keys that weren't updated
-            if not updated_openai_key and deepseek_api_key:
-                env_lines.append(f'OPENAI_API_KEY={deepseek_api_key}\n')
-            if not updated_openai_base and deepseek_api_base:
-                env_lines.append(f'OPENAI_API_BASE={deepseek_api_base}\n')
-            if not updated_groq_key and groq_api_key:
-                env_lines.append(f'GROQ_API_KEY={groq_api_key}\n')
-            
-            # Write back to .env file
-            with open(env_path, 'w') as f:
-                f.writelines(env_lines)
-            
-            # Update current session
-            if deepseek_api_key:
-                openai.api_key = deepseek_api_key
-            if deepseek_api_base:
-                openai.api_base = deepseek_api_base
-            if groq_api_key:
-                global GROQ_API_KEY
-                GROQ_API_KEY = groq_api_key
+            with clients_lock:
+                # Written to a temp file and renamed, so other workers never read half a file
+                env_state['mtime'] = update_env_file(ENV_PATH, {
+                    'OPENAI_API_KEY': deepseek_api_key,
+                    'OPENAI_API_BASE': deepseek_api_base,
+                    'GROQ_API_KEY': groq_api_key
+                })
+                
+                # Swap in clients using the new keys
+                if deepseek_api_key:
+                    swap_client('deepseek', make_deepseek_client(deepseek_api_key, deepseek_api_base or DEEPSEEK_API_BASE))
+                if groq_api_key:
+                    swap_client('groq', make_groq_client(groq_api_key))
             
             return jsonify({
                 'status': 'success',
@@ -554,64 +1764,21 @@ def update_api_keys():
         })
 
 def verify_api_keys(deepseek_api_key, deepseek_api_base, groq_api_key):
-    """Verify API keys without modifying the request object."""
+    """Verify API keys using throwaway clients, leaving the live ones untouched."""
     results = {
         'deepseek': {'status': 'not_tested', 'message': 'API key not provided'},
         'groq': {'status': 'not_tested', 'message': 'API key not provided'},
         'overall': {'status': 'error', 'message': 'No API keys provided'}
     }
     
-    # Verify DeepSeek API
+    # Verify both providers at once, so the wait is the slower check rather than the sum
+    clients = {}
     if deepseek_api_key:
-        try:
-            # Create a temporary OpenAI client to avoid modifying the global one
-            import openai as temp_openai
-            temp_openai.api_key = deepseek_api_key
-            temp_openai.api_base = deepseek_api_base
-            
-            response = temp_openai.ChatCompletion.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "user", "content": "Hello"}
-                ],
-                max_tokens=5
-            )
-            results['deepseek'] = {'status': 'success', 'message': 'API connection successful'}
-        except Exception as e:
-            error_str = str(e)
-            if "authentication" in error_str.lower() or "api key" in error_str.lower() or "auth" in error_str.lower():
-                results['deepseek'] = {'status': 'error', 'message': f'Authentication failed: {error_str}'}
-            else:
-                results['deepseek'] = {'status': 'error', 'message': f'API connection failed: {error_str}'}
-    
-    # Verify Groq API
+        clients['deepseek'] = make_deepseek_client(deepseek_api_key, deepseek_api_base or DEEPSEEK_API_BASE,
+                                                   timeout=VERIFY_TIMEOUT, throwaway=True)
     if groq_api_key:
-        try:
-            headers = {
-                "Authorization": f"Bearer {groq_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "messages": [
-                    {"role": "user", "content": "Hello"}
-                ],
-                "model": "llama3-8b-8192",
-                "max_tokens": 5
-            }
-            
-            response = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(payload)
-            )
-            
-            if response.status_code == 200:
-                results['groq'] = {'status': 'success', 'message': 'API connection successful'}
-            else:
-                results['groq'] = {'status': 'error', 'message': f'API connection failed: {response.text}'}
-        except Exception as e:
-            results['groq'] = {'status': 'error', 'message': f'API connection failed: {str(e)}'}
+        clients['groq'] = make_groq_client(groq_api_key, timeout=VERIFY_TIMEOUT, throwaway=True)
+    results.update(check_providers(clients))
     
     # Determine overall status
     if results['deepseek']['status'] == 'success' or results['groq']['status'] == 'success':
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Supported ways of spreading one request over several providers
+POLICIES = ('sequential', 'hedged', 'race')
+
+# Threads per provider. Each provider has its own pool, so attempts stuck on a
+# hung provider can't keep the next provider's hedge from starting
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "32"))
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class DispatchError(Exception):
+    """Raised when every provider attempt failed."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        message = '; '.join(f"{name}: {error}" for name, error in errors) or 'All providers are currently unavailable'
+        super().__init__(message)
+
+    @property
+    def first_error(self):
+        """The error from the highest-priority provider."""
+        return self.errors[0][1] if self.errors else self
+
+
+class DispatchResult:
+    """The winning provider's reply and how long it took."""
+
+    def __init__(self, provider, value, latency_ms, elapsed_ms, errors=None):
+        self.provider = provider
+        self.value = value
+        # Time spent by the winning provider itself
+        self.latency_ms = latency_ms
+        # Time from dispatch start until the winner answered
+        self.elapsed_ms = elapsed_ms
+        # (name, error) pairs for providers that failed before the winner answered
+        self.errors = errors or []
+
+
+def _executor(name):
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(
+                max_workers=DISPATCH_WORKERS, thread_name_prefix=f'dispatch-{name.lower()}')
+        return executor
+
+
+def _timed(fn, cancel):
+    started = time.perf_counter()
+    value = fn(cancel)
+    return value, (time.perf_counter() - started) * 1000
+
+
+def dispatch(attempts, policy='sequential', hedge_delay=0.5):
+    """Run provider attempts under a dispatch policy and return the first success.
+
+    ``attempts`` is an ordered list of ``(name, fn)`` pairs where ``fn`` takes a
+    ``threading.Event`` that is set once the attempt is no longer needed (or
+    ``None`` when it runs alone and can never lose).
+
+    - ``sequential`` tries each provider only after the previous one failed.
+    - ``hedged`` starts the next provider if the current one hasn't answered
+      within ``hedge_delay`` seconds (or as soon as it fails).
+    - ``race`` starts every provider at once.
+
+    Losing attempts are cancelled through their event.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown dispatch policy: {policy}")
+
+    started = time.perf_counter()
+    errors = []
+
+    if policy == 'sequential' or len(attempts) < 2:
+        for name, fn in attempts:
+            try:
+                value, latency_ms = _timed(fn, None)
+                return DispatchResult(name, value, latency_ms, (time.perf_counter() - started) * 1000, errors)
+            except Exception as e:
+                errors.append((name, e))
+        raise DispatchError(errors)
+
+    pending = {}
+    cancels = []
+    queue = list(attempts)
+
+    def launch():
+        name, fn = queue.pop(0)
+        cancel = threading.Event()
+        cancels.append(cancel)
+        pending[_executor(name).submit(_timed, fn, cancel)] = name
+
+    launch()
+    if policy == 'race':
+        while queue:
+            launch()
+
+    try:
+        while pending:
+            timeout = hedge_delay if queue else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Hedge: the current providers are slow, so start the next one
+                launch()
+                continue
+
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    value, latency_ms = future.result()
+                except Exception as e:
+                    errors.append((name, e))
+                    continue
+                return DispatchResult(name, value, latency_ms, (time.perf_counter() - started) * 1000, errors)
+
+            # Every finished attempt failed; bring in the next provider right away
+            if queue:
+                launch()
+    finally:
+        for cancel in cancels:
+            cancel.set()
+        for future in pending:
+            future.cancel()
+
+    # Keep errors in priority order so callers report the primary provider's failure
+    order = [name for name, _ in attempts]
+    errors.sort(key=lambda item: order.index(item[0]))
+    raise DispatchError(errors)
@@ -0,0 +1,88 @@
+import re
+
+# Parts every parsed email has, in the order they are written
+FIELDS = ('subject', 'preheader', 'greeting', 'body', 'cta', 'signoff', 'notice')
+
+# The API error notice put in front of the fallback template, and the line that ends it
+NOTICE_PREFIXES = ("⚠️ Error:", "⚠️ Authentication Error:")
+TEMPLATE_MARKER = "Here's a basic email template instead:"
+
+_HEADER = re.compile(r"^[*#\s]*(subject|preheader|preview text|preview)[*\s]*:[*\s]*(.*?)[*\s]*$", re.IGNORECASE)
+_GREETING = re.compile(r"^(hi|hello|hey|dear|greetings|good (morning|afternoon|evening))\b", re.IGNORECASE)
+_SIGNOFF = re.compile(
+    r"^(best|best regards|kind regards|warm regards|regards|many thanks|thanks|thank you|cheers|sincerely|"
+    r"all the best|talk soon|warmly|respectfully)[,.!]?$",
+    re.IGNORECASE
+)
+_CTA = re.compile(r"\?|\b(call|chat|meeting|demo|schedule|book|calendar|reply|let me know|available)\b", re.IGNORECASE)
+_PARAGRAPHS = re.compile(r"\n[ \t]*\n\s*")
+
+
+def empty_parts():
+    return {'subject': '', 'preheader': '', 'greeting': '', 'body': [], 'cta': '', 'signoff': '', 'notice': ''}
+
+
+def parse_email(text):
+    """Split an email into its parts in one pass over its paragraphs.
+
+    Returns a dict with ``subject``, ``preheader``, ``greeting``, ``body`` (a
+    list of paragraphs), ``cta``, ``signoff`` and ``notice`` (an API error
+    shown in front of the fallback template). Parts the email lacks are
+    empty, so drifting model output degrades to a plain body instead of failing.
+    """
+    parts = empty_parts()
+    text = (text or '').strip()
+    if text.startswith(NOTICE_PREFIXES):
+        marker = text.find(TEMPLATE_MARKER)
+        if marker != -1:
+            parts['notice'] = text[:marker].strip()
+            text = text[marker + len(TEMPLATE_MARKER):].strip()
+
+    paragraphs = []
+    for index, paragraph in enumerate(_PARAGRAPHS.split(text) if text else []):
+        lines = paragraph.strip().splitlines()
+        # Subject and preheader lines may only open the email
+        while index == 0 and lines:
+            header = _HEADER.match(lines[0])
+            if not header:
+                break
+            name = 'subject' if header.group(1).lower() == 'subject' else 'preheader'
+            parts[name] = header.group(2)
+            lines.pop(0)
+        if not lines:
+            continue
+        # A greeting is a short line of its own, like "Hi Sam," - not a sentence that starts with "Hello"
+        if not paragraphs and not parts['greeting'] and _GREETING.match(lines[0]) \
+                and (lines[0].rstrip().endswith((',', '!', ':')) or len(lines[0]) <= 25):
+            parts['greeting'] = lines.pop(0).strip()
+            if not lines:
+                continue
+        paragraphs.append(lines)
+
+    # The sign-off starts at the last "Best regards," line, wherever it sits in the final paragraph
+    if paragraphs:
+        last = paragraphs[-1]
+        for i in range(len(last) - 1, -1, -1):
+            if _SIGNOFF.match(last[i].strip()):
+                parts['signoff'] = '\n'.join(line.strip() for line in last[i:])
+                del last[i:]
+                if not last:
+                    paragraphs.pop()
+                break
+    body = ['\n'.join(lines).strip() for lines in paragraphs]
+    if len(body) > 1 and _CTA.search(body[-1]):
+        parts['cta'] = body.pop()
+    parts['body'] = body
+    return parts
+
+
+def render_email(parts, notice=False):
+    """Write parsed parts back out as "Subject: ..." text, without the API notice unless asked."""
+    header = []
+    if parts.get('subject'):
+        header.append(f"Subject: {parts['subject']}")
+    if parts.get('preheader'):
+        header.append(f"Preheader: {parts['preheader']}")
+    blocks = [parts.get('notice') if notice else '', '\n'.join(header), parts.get('greeting', '')]
+    blocks += list(parts.get('body') or []) + [parts.get('cta', ''), parts.get('signoff', '')]
+    return '\n\n'.join(block for block in blocks if block)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+_lock = threading.Lock()
+
+
+@contextmanager
+def _locked(path):
+    """Hold the in-process lock and, where supported, a lock file shared by worker processes."""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def update_env_file(path, updates):
+    """Set ``KEY=value`` lines in a dotenv file, keeping every other line as it was.
+
+    Keys with empty values are left alone. The new content is written to a
+    temporary file next to ``path`` and renamed over it, so other workers
+    reading the file never see it half written, and concurrent updates are
+    applied one after the other instead of overwriting each other.
+    """
+    updates = {key: value for key, value in updates.items() if value}
+    with _locked(path):
+        try:
+            with open(path, 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+
+        remaining = dict(updates)
+        for i, line in enumerate(lines):
+            key = line.split('=', 1)[0].strip()
+            if '=' in line and key in remaining:
+                lines[i] = f'{key}={remaining.pop(key)}\n'
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        lines.extend(f'{key}={value}\n' for key, value in remaining.items())
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.env.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return os.path.getmtime(path)
@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+import time
+import zlib
+from email import policy
+from email.message import EmailMessage
+from email.utils import formataddr, formatdate
+
+from email_parts import parse_email, render_email
+
+# Export formats: media type and file extension
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'mbox': ('application/mbox', 'mbox')
+}
+CSV_COLUMNS = ['index', 'status', 'to', 'first_name', 'last_name', 'company', 'subject', 'preheader', 'body',
+               'provider', 'error']
+# Bytes gathered before a chunk is sent, so a large export isn't written a few bytes at a time
+CHUNK_BYTES = 64 * 1024
+
+
+def clean_record(record):
+    """A finished row ready to send: the email rebuilt from its parts, without any API error notice."""
+    record = dict(record)
+    if record.get('email'):
+        parts = record.get('parts') or parse_email(record['email'])
+        record['parts'] = dict(parts, notice='')
+        record['email'] = render_email(parts)
+    return record
+
+
+def _body(parts):
+    """The email text below the Subject and Preheader lines."""
+    return render_email(dict(parts, subject='', preheader=''))
+
+
+def _recipient(inputs):
+    name = ' '.join(inputs[key] for key in ('first_name', 'last_name') if inputs.get(key))
+    return formataddr((name, inputs['email'])) if inputs.get('email') else ''
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(clean_record(record)) + '\n'
+
+
+def csv_lines(records):
+    """One row per prospect, with the subject, preheader and body in their own columns for mail merge."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for record in records:
+        record = clean_record(record)
+        inputs = record.get('inputs') or {}
+        parts = record.get('parts') or {}
+        writer.writerow([
+            record.get('index'), record.get('status'), _recipient(inputs),
+            inputs.get('first_name', ''), inputs.get('last_name', ''), inputs.get('company', ''),
+            parts.get('subject', ''), parts.get('preheader', ''), _body(parts) if parts else '',
+            record.get('provider', ''), record.get('error', '')
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def mbox_messages(records, sender='', created_at=None):
+    """One RFC 5322 message per generated email, in mboxrd format.
+
+    Failed rows are left out. Every message is dated ``created_at`` (the
+    job's start), so exporting the same job twice gives identical bytes.
+    """
+    created_at = time.time() if created_at is None else created_at
+    separator = f"From MAILER-DAEMON {time.asctime(time.gmtime(created_at))}\n"
+    for record in records:
+        if not record.get('email'):
+            continue
+        record = clean_record(record)
+        inputs = record.get('inputs') or {}
+        parts = record['parts']
+        message = EmailMessage(policy=policy.default)
+        if sender:
+            message['From'] = sender
+        if inputs.get('email'):
+            message['To'] = _recipient(inputs)
+        message['Subject'] = parts.get('subject') or ''
+        message['Date'] = formatdate(created_at)
+        if parts.get('preheader'):
+            message['X-Preheader'] = parts['preheader']
+        message['X-Export-Index'] = str(record.get('index'))
+        message.set_content(_body(parts))
+        lines = message.as_string().splitlines()
+        # mboxrd: quote body lines that would read as a message separator
+        lines = ['>' + line if line.lstrip('>').startswith('From ') else line for line in lines]
+        yield separator + '\n'.join(lines) + '\n\n'
+
+
+def export_chunks(records, fmt, compress=False, sender='', created_at=None):
+    """Encode records in an export format as byte chunks, gzipped if asked, reading records one at a time."""
+    if fmt == 'csv':
+        lines = csv_lines(records)
+    elif fmt == 'mbox':
+        lines = mbox_messages(records, sender, created_at)
+    else:
+        lines = jsonl_lines(records)
+    # Level 6 with a zero timestamp, so the same export always compresses to the same bytes
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        if compressor is not None:
+            data = compressor.compress(data)
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_BYTES:
+            yield b''.join(pending)
+            pending = []
+            size = 0
+    if compressor is not None:
+        pending.append(compressor.flush())
+    if pending:
+        yield b''.join(pending)
+
+
+def byte_slice(chunks, start, stop=None):
+    """The bytes of ``chunks`` from ``start`` up to (not including) ``stop``, without holding more than a chunk."""
+    offset = 0
+    for chunk in chunks:
+        end = offset + len(chunk)
+        if end > start and (stop is None or offset < stop):
+            yield chunk[max(0, start - offset):len(chunk) if stop is None else min(len(chunk), stop - offset)]
+        offset = end
+        if stop is not None and offset >= stop:
+            return
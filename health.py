@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import deque
+
+from providers import is_provider_fault
+
+
+class ProviderHealth:
+    """Rolling health record for one provider."""
+
+    def __init__(self, window):
+        self.status = 'pending'
+        self.message = 'Waiting for first health check'
+        self.last_latency_ms = None
+        self.checked_at = None
+        self.consecutive_failures = 0
+        self.next_probe_at = 0.0
+        self.outcomes = deque(maxlen=window)
+
+    def as_dict(self):
+        return {
+            'status': self.status,
+            'message': self.message,
+            'latency_ms': round(self.last_latency_ms, 1) if self.last_latency_ms is not None else None,
+            'error_rate': round(self.outcomes.count(False) / len(self.outcomes), 3) if self.outcomes else None,
+            'checked_at': self.checked_at
+        }
+
+
+class HealthMonitor:
+    """Probe providers in the background and keep a snapshot of their health.
+
+    ``get_clients`` returns the current ``{name: ProviderClient}`` mapping, so
+    clients swapped in after a key update are probed from then on. Real
+    traffic can be fed in through ``record`` to keep the snapshot fresh
+    between probes.
+    """
+
+    def __init__(self, get_clients, interval=30, max_backoff=300, failure_threshold=2,
+                 window=20, probe_timeout=(3, 5)):
+        self.get_clients = get_clients
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.probe_timeout = probe_timeout
+        self.providers = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _health(self, name):
+        health = self.providers.get(name)
+        if health is None:
+            health = self.providers[name] = ProviderHealth(self.window)
+        return health
+
+    def start(self):
+        """Start the background probe thread once."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='health-monitor', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def record(self, name, success, latency_ms, error=None, probe=False):
+        """Record the outcome of a probe or a real request.
+
+        Throttled (429) and rejected (4xx other than 401/403) requests are
+        ignored, like the circuit breaker does: they are retried or queued,
+        and say nothing about whether the provider is up. Until the first
+        probe has finished, failed real requests are counted but don't mark
+        the provider down, so one early timeout can't sideline it for minutes.
+        """
+        if not success and not is_provider_fault(error):
+            return
+        with self.lock:
+            health = self._health(name)
+            health.outcomes.append(success)
+            health.last_latency_ms = latency_ms
+            health.checked_at = time.time()
+            if success:
+                health.consecutive_failures = 0
+                health.status = 'success'
+                health.message = 'API connection successful'
+                health.next_probe_at = time.time() + self.interval
+            else:
+                health.consecutive_failures += 1
+                error_str = str(error)
+                if "authentication" in error_str.lower() or "api key" in error_str.lower() or "auth" in error_str.lower():
+                    health.message = f'Authentication failed: {error_str}'
+                else:
+                    health.message = f'API connection failed: {error_str}'
+                if health.status == 'pending' and not probe:
+                    return
+                if health.consecutive_failures >= self.failure_threshold or health.status != 'success':
+                    health.status = 'error'
+                # Back off exponentially while the provider keeps failing
+                backoff = min(self.interval * 2 ** (health.consecutive_failures - 1), self.max_backoff)
+                health.next_probe_at = time.time() + backoff
+
+    def reset(self, name):
+        """Forget a provider's history, e.g. after its API key changed."""
+        with self.lock:
+            self.providers[name] = ProviderHealth(self.window)
+
+    def probe(self, name, client):
+        """Run one health probe against a provider."""
+        started = time.perf_counter()
+        try:
+            client.ping(timeout=self.probe_timeout)
+        except Exception as e:
+            self.record(name, False, (time.perf_counter() - started) * 1000, error=e, probe=True)
+        else:
+            self.record(name, True, (time.perf_counter() - started) * 1000, probe=True)
+
+    def is_down(self, name):
+        """True when the provider is known to be failing and should be skipped."""
+        with self.lock:
+            health = self.providers.get(name)
+            return health is not None and health.status == 'error'
+
+    def snapshot(self):
+        """Return the current health of every configured provider."""
+        clients = self.get_clients()
+        with self.lock:
+            result = {}
+            for name, client in clients.items():
+                if not client.configured:
+                    result[name] = {'status': 'error', 'message': 'Not configured'}
+                else:
+                    result[name] = self._health(name).as_dict()
+            return result
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            now = time.time()
+            for name, client in self.get_clients().items():
+                if not client.configured:
+                    continue
+                with self.lock:
+                    due = self._health(name).next_probe_at <= now
+                if due:
+                    self.probe(name, client)
+            self.stop_event.wait(1)
@@ -0,0 +1,228 @@
+import re
+import zlib
+
+# Words in the tone answer that pick a family of fragments; anything else reads as professional
+TONE_WORDS = {
+    'friendly': {'friendly', 'warm', 'casual', 'conversational', 'relaxed', 'informal', 'fun', 'playful', 'personal'},
+    'direct': {'direct', 'bold', 'confident', 'urgent', 'concise', 'punchy', 'short', 'blunt', 'assertive'}
+}
+# Words in the audience answer that say which results the reader cares about
+FOCUS_WORDS = {
+    'technical': {'cto', 'ctos', 'engineer', 'engineers', 'engineering', 'developer', 'developers', 'devops', 'it',
+                  'architect', 'architects', 'technical', 'data', 'security', 'software', 'platform'},
+    'revenue': {'sales', 'marketing', 'growth', 'revenue', 'cmo', 'cmos', 'sdr', 'sdrs', 'account', 'ecommerce',
+                'demand', 'brand', 'agencies', 'agency'},
+    'finance': {'cfo', 'cfos', 'finance', 'financial', 'accounting', 'accountants', 'controller', 'controllers',
+                'procurement', 'treasury'},
+    'operations': {'coo', 'coos', 'operations', 'ops', 'hr', 'people', 'support', 'logistics', 'supply',
+                   'recruiting', 'recruiters', 'facilities'},
+    'leadership': {'ceo', 'ceos', 'founder', 'founders', 'owner', 'owners', 'president', 'executives', 'vp',
+                   'vps', 'director', 'directors', 'head', 'leaders', 'partners'}
+}
+# Answers that mean "nothing to add"
+EMPTY_ANSWERS = {'', 'none', 'no', 'nope', 'nothing', 'n/a', 'na', 'no thanks'}
+# Used when no pain points were given; plural, like the verbs the fragments put after it
+DEFAULT_PAINS = ['repetitive manual tasks']
+
+SUBJECTS = {
+    'professional': ("{Offering} for {audience}", "Addressing {pain}", "A better way to handle {pain}",
+                     "Helping {audience} with {pain}"),
+    'friendly': ("Quick idea about {pain}", "{Offering}, worth a look?", "Less {pain}, more of the good stuff",
+                 "Thought of {company_or_team} and {pain}"),
+    'direct': ("Fix {pain}", "{Pain}, solved", "15 minutes on {pain}?", "{Offering} for {company_or_team}")
+}
+PREHEADERS = {
+    'professional': ("How {audience} are reducing {pain}", "A short note on {offering}",
+                     "What {offering} changes for {company_or_team}"),
+    'friendly': ("A quick thought on {pain}", "No pitch deck, just one idea", "Two minutes, one idea for you"),
+    'direct': ("One fix for {pain}", "Short version inside", "Straight to the point")
+}
+GREETINGS = {
+    'professional': ("Dear {first_name},", "Hello {first_name},"),
+    'friendly': ("Hi {first_name},", "Hey {first_name},", "Hi {first_name}!"),
+    'direct': ("Hi {first_name},", "Hello {first_name},")
+}
+# Used when the prospect's name is unknown
+ANONYMOUS_GREETINGS = {'professional': "Hello,", 'friendly': "Hi there,", 'direct': "Hi,"}
+INTROS = {
+    'professional': (
+        "I'm reaching out because many {audience} tell us that {pains} take up more time than they should.",
+        "I work with {audience}, and {pains} come up in almost every conversation.",
+        "Teams like {company_or_yours} often find that {pains} slow everything else down."
+    ),
+    'friendly': (
+        "I've been talking with a lot of {audience} lately, and {pains} keep coming up.",
+        "If {pains} sound familiar, you're in good company.",
+        "I had a hunch {pains} might be on your plate at {company_or_the_moment}."
+    ),
+    'direct': (
+        "{Pains} cost {audience} time and money.",
+        "Most {audience} I speak with are stuck on {pains}.",
+        "You probably deal with {pains} every week."
+    )
+}
+VALUE_PROPS = {
+    'professional': (
+        "{Offering} is built to remove exactly that, so {outcome}.",
+        "With {offering}, {outcome}, without adding another process to manage.",
+        "{Offering} takes that work off your plate, and {outcome}."
+    ),
+    'friendly': (
+        "That's why we built {offering}: {outcome}.",
+        "{Offering} takes care of the tedious part, so {outcome}.",
+        "Our customers use {offering} so that {outcome}, and it's pretty painless to set up."
+    ),
+    'direct': (
+        "{Offering} fixes that. {Outcome}.",
+        "{Offering} removes the problem, so {outcome}.",
+        "With {offering}, {outcome}."
+    )
+}
+OUTCOMES = {
+    'technical': ("your engineers get hours back every week", "your team ships with fewer surprises",
+                  "releases stop waiting on manual work"),
+    'revenue': ("your pipeline keeps moving", "your team spends more time with buyers",
+                "campaigns go out faster and convert better"),
+    'finance': ("costs become predictable", "the books close faster", "reporting stops eating your week"),
+    'operations': ("work moves with fewer handoffs", "your team stops chasing updates",
+                   "day-to-day operations run smoother"),
+    'leadership': ("your team hits its goals with less effort", "you see results you can report on",
+                   "growth doesn't mean more overhead"),
+    'general': ("your team gets hours back every week", "the busywork takes care of itself",
+                "you can focus on the work that matters")
+}
+NOTES = {
+    'professional': ("I'd also like to mention: {notes}", "It may also be relevant that {notes_clause}"),
+    'friendly': ("One more thing: {notes}", "Also, a little bonus: {notes}"),
+    'direct': ("{notes}", "Note: {notes}")
+}
+CTAS = {
+    'professional': ("Would you be available for a brief 15-minute call next week to discuss whether this fits?",
+                     "Would it be worth a short conversation to see how this could work for {company_or_your_team}?",
+                     "May I send over a short overview, or would a quick call suit you better?"),
+    'friendly': ("Up for a quick chat next week? Happy to work around your calendar.",
+                 "Would it be crazy to grab 15 minutes and see if this helps?",
+                 "Want me to send a short demo video instead? Just reply and let me know."),
+    'direct': ("Worth 15 minutes this week?", "Can we talk Tuesday or Wednesday?",
+               "Reply \"yes\" and I'll send two time slots.")
+}
+SIGNOFFS = {
+    'professional': ("Best regards,", "Kind regards,", "Sincerely,"),
+    'friendly': ("Cheers,", "Thanks,", "Talk soon,"),
+    'direct': ("Best,", "Thanks,", "Regards,")
+}
+SIGNATURE = "[Your Name]\n[Your Position]\n[Your Company]"
+
+_WORDS = re.compile(r"[a-z0-9]+")
+_LIST_SEPARATORS = re.compile(r"\s*(?:[,;\n]|\band\b|&)\s*", re.IGNORECASE)
+
+
+def tone_family(tone):
+    """Map a free-text tone answer to 'professional', 'friendly' or 'direct'."""
+    words = set(_WORDS.findall((tone or '').lower()))
+    for family, family_words in TONE_WORDS.items():
+        if words & family_words:
+            return family
+    return 'professional'
+
+
+def audience_focus(audience):
+    """Which results an audience cares about: technical, revenue, finance, operations, leadership or general."""
+    words = set(_WORDS.findall((audience or '').lower()))
+    for focus, focus_words in FOCUS_WORDS.items():
+        if words & focus_words:
+            return focus
+    return 'general'
+
+
+def _clause(text, lower=True):
+    """Text to go mid-sentence: trailing punctuation dropped, first letter lowered unless it's an acronym.
+
+    Names (offerings, companies) keep their case with ``lower=False``.
+    """
+    text = ' '.join(str(text).split()).rstrip('.!?;:')
+    if lower and len(text) > 1 and text[0].isupper() and not text[1].isupper():
+        return text[0].lower() + text[1:]
+    return text
+
+
+def _capitalized(text):
+    return text[:1].upper() + text[1:]
+
+
+def _sentence(text):
+    text = ' '.join(str(text).split())
+    return _capitalized(text) if text[-1:] in '.!?' else _capitalized(text) + '.'
+
+
+def _join_list(items):
+    if len(items) < 2:
+        return ''.join(items)
+    return f"{', '.join(items[:-1])} and {items[-1]}"
+
+
+def pain_list(pain_points):
+    """The pain points answer split into short clauses, so they can be worded instead of pasted."""
+    items = [_clause(item) for item in _LIST_SEPARATORS.split(pain_points or '')]
+    items = [item[4:] if item.lower().startswith('the ') else item for item in items]
+    return [item for item in items if item.lower() not in EMPTY_ANSWERS][:3]
+
+
+def _pick(options, seed, slot):
+    """Choose from ``options`` with the bits of ``seed`` set aside for ``slot``."""
+    return options[((seed >> (slot * 4)) & 0xF) % len(options)]
+
+
+def compose_email(inputs, seed=0):
+    """Write an email locally from the answers (and prospect columns, when present).
+
+    Fragments are chosen by tone and audience, and varied by a hash of the
+    answers mixed with ``seed``, so the same inputs and seed always give the
+    same email and different prospects read differently. No network calls.
+    """
+    tone = tone_family(inputs.get('tone'))
+    audience = _clause(inputs.get('audience') or '') or 'teams like yours'
+    offering = _clause(inputs.get('offering') or '', lower=False) or 'our service'
+    pains = pain_list(inputs.get('pain_points')) or DEFAULT_PAINS
+    company = _clause(inputs.get('company') or '', lower=False)
+    first_name = ' '.join(str(inputs.get('first_name') or '').split())
+    notes = ' '.join(str(inputs.get('special_notes') or '').split())
+
+    key = '\x1f'.join(str(inputs.get(field) or '') for field in
+                      ('audience', 'offering', 'pain_points', 'tone', 'special_notes', 'first_name', 'company'))
+    seed = zlib.crc32(f"{seed}\x1e{key}".encode('utf-8'))
+
+    outcome = _pick(OUTCOMES[audience_focus(audience)], seed, 0)
+    values = {
+        'audience': audience,
+        'offering': offering,
+        'Offering': _capitalized(offering),
+        'pain': pains[0],
+        'Pain': _capitalized(pains[0]),
+        'pains': _join_list(pains),
+        'Pains': _capitalized(_join_list(pains)),
+        'outcome': outcome,
+        'Outcome': _capitalized(outcome),
+        'first_name': first_name,
+        'company_or_team': company or 'your team',
+        'company_or_yours': company or 'yours',
+        'company_or_your_team': company or 'your team',
+        'company_or_the_moment': company or 'the moment',
+        'notes': _sentence(notes) if notes else '',
+        'notes_clause': _clause(notes)
+    }
+
+    greeting = _pick(GREETINGS[tone], seed, 1) if first_name else ANONYMOUS_GREETINGS[tone]
+    paragraphs = [_pick(INTROS[tone], seed, 2), _pick(VALUE_PROPS[tone], seed, 3)]
+    if notes.lower().rstrip('.!') not in EMPTY_ANSWERS:
+        paragraphs.append(_pick(NOTES[tone], seed, 4))
+    paragraphs.append(_pick(CTAS[tone], seed, 5))
+
+    blocks = [
+        f"Subject: {_pick(SUBJECTS[tone], seed, 6).format_map(values)}\n"
+        f"Preheader: {_pick(PREHEADERS[tone], seed, 7).format_map(values)}",
+        greeting.format_map(values)
+    ]
+    blocks += [_sentence(paragraph.format_map(values)) for paragraph in paragraphs]
+    blocks.append(f"{_pick(SIGNOFFS[tone], seed, 1)}\n{SIGNATURE}")
+    return '\n\n'.join(blocks)
@@ -0,0 +1,265 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Files written by each process into a shared metrics directory
+_PROCESS_FILE = re.compile(r'^\d+\.json$')
+# Latency buckets in seconds, from sub-millisecond cache hits to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    # How values from several worker processes are combined: 'sum' or 'max'
+    aggregate = 'sum'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None, aggregate=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Optional function returning the current value (or {label tuple: value})
+        self.callback = callback
+        if aggregate is not None:
+            self.aggregate = aggregate
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _items(self):
+        if self.callback is None:
+            with self.lock:
+                return sorted(self.values.items())
+        value = self.callback()
+        if not isinstance(value, dict):
+            return [((), value)]
+        return sorted((tuple(str(part) for part in key), v) for key, v in value.items())
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def merge(self, values, other):
+        """Fold another process's ``(key, value)`` pairs into ``values``."""
+        for key, value in other:
+            key = tuple(key)
+            if key not in values:
+                values[key] = value
+            elif self.aggregate == 'max':
+                values[key] = max(values[key], value)
+            else:
+                values[key] += value
+
+    def render(self, items=None):
+        items = self._items() if items is None else items
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items
+        ]
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _items(self):
+        with self.lock:
+            return sorted((key, [[*state[0]], state[1], state[2]]) for key, state in self.values.items())
+
+    def merge(self, values, other):
+        for key, (counts, total, count) in other:
+            key = tuple(key)
+            state = values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            state[0] = [a + b for a, b in zip(state[0], counts)]
+            state[1] += total
+            state[2] += count
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self, items=None):
+        items = self._items() if items is None else items
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format.
+
+    With ``share(directory)``, several worker processes behind one socket
+    report as one: each writes its values to ``directory`` every few seconds
+    (and when rendering), and ``render`` adds up the files of every process.
+    Counters and histograms of workers that have exited are kept, so totals
+    never go backwards; their gauges are dropped.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.directory = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None, aggregate=None):
+        return self.register(Gauge(name, documentation, labelnames, callback, aggregate))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def share(self, directory, interval=5):
+        """Publish this process's values to ``directory`` so ``render`` can combine every worker."""
+        if self.thread is not None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.thread = threading.Thread(target=self._sync, args=(interval,), name='metrics-sync', daemon=True)
+        self.thread.start()
+
+    def _sync(self, interval):
+        while not self.stop_event.wait(interval):
+            self.write()
+
+    def stop(self):
+        """Stop publishing, after writing the final values."""
+        self.stop_event.set()
+        if self.directory is not None:
+            self.write()
+
+    def write(self):
+        """Write this process's values to the shared directory, replacing its previous file."""
+        data = {metric.name: [[list(key), value] for key, value in metric._items()] for metric in self.metrics}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, os.path.join(self.directory, f"{os.getpid()}.json"))
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _processes(self):
+        """``(alive, values by metric name)`` for every process that has written to the directory."""
+        for filename in os.listdir(self.directory):
+            # Only files written by ``write``; anything else in the directory is ignored
+            if not _PROCESS_FILE.match(filename):
+                continue
+            pid = int(filename[:-len('.json')])
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    yield _alive(pid), json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def render(self):
+        lines = []
+        if self.directory is None:
+            for metric in self.metrics:
+                lines.extend(metric.render())
+            return '\n'.join(lines) + '\n'
+        self.write()
+        combined = {metric.name: {} for metric in self.metrics}
+        for alive, data in self._processes():
+            for metric in self.metrics:
+                if metric.kind == 'gauge' and not alive:
+                    continue
+                metric.merge(combined[metric.name], data.get(metric.name, ()))
+        for metric in self.metrics:
+            lines.extend(metric.render(sorted(combined[metric.name].items())))
+        return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    """Whether a worker process still exists (assumed where it can't be checked)."""
+    if pid == os.getpid() or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Content type expected by Prometheus scrapers
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
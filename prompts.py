@@ -0,0 +1,263 @@
+import re
+import textwrap
+from string import Formatter
+
+try:
+    import tiktoken
+except ImportError:  # optional: the heuristic below is used instead
+    tiktoken = None
+
+# Rough characters per token for English prose with the DeepSeek/Llama tokenizers
+CHARS_PER_TOKEN = 4
+# Tokens the chat format adds around every message (role markers and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# BPE encoding used when tiktoken is installed; close enough to the providers' own tokenizers
+TIKTOKEN_ENCODING = "cl100k_base"
+
+# Words, single punctuation marks and single non-Latin characters, roughly as a BPE tokenizer splits them
+_PIECES = re.compile(r"[A-Za-z0-9_']+|[^\sA-Za-z0-9_']")
+
+_registry = {}
+_encoding = None
+
+
+def _get_encoding():
+    """The tiktoken encoding, or False when it isn't installed or its file isn't available offline."""
+    global _encoding
+    if _encoding is None:
+        _encoding = False
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+            except Exception:
+                pass
+    return _encoding
+
+
+def _piece_tokens(piece):
+    # Short words are one token; long words split about every CHARS_PER_TOKEN * 2 characters
+    return 1 + len(piece) // (CHARS_PER_TOKEN * 2)
+
+
+def estimate_tokens(text):
+    """Token count for a piece of text, computed locally (exact only with tiktoken installed)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, sum(_piece_tokens(piece) for piece in _PIECES.findall(text)))
+
+
+def truncate_tokens(text, max_tokens, marker="…"):
+    """Cut text to about ``max_tokens`` tokens at a word boundary, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]).rstrip() + marker
+    used = 0
+    end = 0
+    for match in _PIECES.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            break
+        end = match.end()
+    return text[:end].rstrip() + marker
+
+
+def estimate_message_tokens(messages):
+    """Estimate the input tokens of a list of chat messages."""
+    return sum(estimate_tokens(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def _clean(text):
+    """Drop the source-code indentation and surrounding blank lines from a prompt."""
+    return textwrap.dedent(text).strip()
+
+
+class PromptTemplate:
+    """A versioned chat prompt, compiled once when it is registered.
+
+    The system message and ``instructions`` never change between calls, so
+    every rendered prompt starts with the same bytes and providers can serve
+    that prefix from their prompt cache. Only ``body`` is filled in per call.
+    """
+
+    def __init__(self, name, version, system, instructions, body):
+        self.name = name
+        self.version = version
+        self.system = _clean(system)
+        self.instructions = _clean(instructions)
+        # Split the body into literal text and field names once, instead of on every render
+        self.segments = list(Formatter().parse(_clean(body)))
+        self.fields = [field for _, field, _, _ in self.segments if field]
+        self.prefix = f"{self.instructions}\n\n"
+        self.prefix_tokens = (estimate_tokens(self.system) + MESSAGE_OVERHEAD_TOKENS
+                              + estimate_tokens(self.prefix))
+
+    @property
+    def key(self):
+        """Identifier used in cache keys, so editing a prompt invalidates its entries."""
+        return f"{self.name}:{self.version}"
+
+    def render_body(self, values):
+        parts = [self.prefix]
+        for literal, field, _, _ in self.segments:
+            parts.append(literal)
+            if field:
+                # Values are inserted verbatim, so braces in user input are harmless
+                parts.append(str(values.get(field, '')))
+        return ''.join(parts)
+
+    def messages(self, **values):
+        """Render the chat messages for one call."""
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.render_body(values)}
+        ]
+
+    def token_count(self, **values):
+        """Estimated input tokens of a rendered prompt."""
+        return estimate_message_tokens(self.messages(**values))
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'fields': self.fields,
+            'prefix_tokens': self.prefix_tokens,
+            'empty_tokens': self.token_count()
+        }
+
+
+def register(template):
+    """Add a template to the registry, replacing any earlier one with the same name."""
+    _registry[template.name] = template
+    return template
+
+
+def get_prompt(name):
+    return _registry[name]
+
+
+def all_prompts():
+    return list(_registry.values())
+
+
+GENERATE = register(PromptTemplate(
+    'generate',
+    '3',
+    system="You are a professional email copywriter expert in creating effective cold outreach emails.",
+    instructions="""
+        Create a cold outreach email based on the information below.
+
+        Format the response as follows:
+
+        Subject: [Subject Line]
+        Preheader: [One short line of preview text shown after the subject in the inbox]
+
+        [Email Body with clear Introduction, Value Proposition, Call-to-Action, and Sign-off]
+    """,
+    body="""
+        Target Audience: {audience}
+        Key Offering: {offering}
+        Pain Points: {pain_points}
+        Tone/Style: {tone}
+        Special Notes: {special_notes}
+    """
+))
+
+REFINE = register(PromptTemplate(
+    'refine',
+    '4',
+    system="You are a professional email copywriter expert in refining cold outreach emails.",
+    instructions="""
+        Refine a cold outreach email over several turns. The email was written from the brief below,
+        and the conversation that follows holds the current draft and the requested changes.
+        Keep earlier changes unless a later request overrides them.
+
+        Reply with the full revised email only, formatted as follows:
+
+        Subject: [Subject Line]
+        Preheader: [One short line of preview text shown after the subject in the inbox]
+
+        [Email Body]
+    """,
+    body="""
+        Target Audience: {audience}
+        Key Offering: {offering}
+        Pain Points: {pain_points}
+        Tone/Style: {tone}
+        Special Notes: {special_notes}
+        {earlier_requests}
+    """
+))
+
+VARIANTS = register(PromptTemplate(
+    'variants',
+    '1',
+    system="You are a professional email copywriter expert in creating effective cold outreach emails.",
+    instructions="""
+        Create the requested number of cold outreach email variants for A/B testing, based on the information below.
+        Give each variant its own subject line, opening and angle.
+
+        Format every variant as follows, with nothing before the first variant:
+
+        === Variant [N] ===
+        Subject: [Subject Line]
+
+        [Email Body with clear Introduction, Value Proposition, Call-to-Action, and Sign-off]
+    """,
+    body="""
+        Number of variants: {count}
+        Target Audience: {audience}
+        Key Offering: {offering}
+        Pain Points: {pain_points}
+        Tone/Style: {tone}
+        Special Notes: {special_notes}
+    """
+))
+
+SEGMENT = register(PromptTemplate(
+    'segment',
+    '2',
+    system="You are a professional email copywriter expert in creating effective cold outreach emails.",
+    instructions="""
+        Create a cold outreach email that will be sent to every prospect in the segment described below.
+        Write {{first_name}} where the prospect's first name belongs and {{company}} where their company name belongs.
+        Put {{opener}} on its own line right after the greeting; it is replaced by an opening sentence for each prospect.
+        Don't add any other placeholders.
+
+        Format the response as follows:
+
+        Subject: [Subject Line]
+        Preheader: [One short line of preview text shown after the subject in the inbox]
+
+        [Email Body with clear Introduction, Value Proposition, Call-to-Action, and Sign-off]
+    """,
+    body="""
+        Target Audience: {audience}
+        Key Offering: {offering}
+        Pain Points: {pain_points}
+        Tone/Style: {tone}
+        Special Notes: {special_notes}
+    """
+))
+
+OPENER = register(PromptTemplate(
+    'opener',
+    '1',
+    system="You are a professional email copywriter expert in creating effective cold outreach emails.",
+    instructions="""
+        Write one opening sentence for a cold outreach email to the prospect below, specific to them and at most 25 words.
+        Reply with the sentence only.
+    """,
+    body="""
+        Prospect: {name}
+        Title: {title}
+        Company: {company}
+        About them: {detail}
+        We offer: {offering}
+    """
+))
@@ -0,0 +1,349 @@
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from prompts import estimate_message_tokens
+from ratelimit import RETRY_STATUSES
+
+# Seconds allowed to open a connection and to wait between response bytes
+CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", "60"))
+# Keep-alive connections kept open per provider host
+POOL_SIZE = int(os.getenv("PROVIDER_POOL_SIZE", "32"))
+# How often a cancellable request waiting for a concurrency slot checks whether it is still wanted
+LIMIT_POLL_SECONDS = 0.05
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# Callbacks told about every finished provider request
+_observers = []
+
+
+class ProviderError(Exception):
+    """Raised when a provider request fails or returns an error status."""
+
+    def __init__(self, provider, message, status_code=None, headers=None, retryable=None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+        self.headers = headers or {}
+        # Throttling, transient server errors and failed connections are worth retrying
+        self.retryable = status_code in RETRY_STATUSES if retryable is None else retryable
+
+
+class ProviderCancelled(ProviderError):
+    """Raised when an in-flight request is abandoned because another provider won."""
+
+
+class ProviderThrottled(ProviderError):
+    """Raised when the client-side rate limiter can't schedule a request in time."""
+
+
+class CircuitOpen(ProviderError):
+    """Raised without contacting the provider while its circuit breaker is open."""
+
+
+def is_provider_fault(error):
+    """True when a failure says the provider is down or misconfigured.
+
+    Throttling and bad requests say nothing about whether the provider is up.
+    """
+    status_code = getattr(error, 'status_code', None)
+    return status_code is None or status_code >= 500 or status_code in (401, 403)
+
+
+def add_observer(callback):
+    """Register ``callback(provider, success, latency_ms, error=None, usage=None)``.
+
+    It is called after every completed or failed provider request. Cancelled
+    requests are not reported, since they say nothing about provider health.
+    ``usage`` holds the provider's token counts (when it reported them) plus
+    ``estimated_prompt_tokens``, ``max_tokens`` and ``truncated``.
+    """
+    _observers.append(callback)
+
+
+def _notify(provider, success, started, error=None, usage=None):
+    latency_ms = (time.perf_counter() - started) * 1000
+    for callback in _observers:
+        try:
+            callback(provider, success, latency_ms, error=error, usage=usage)
+        except Exception:
+            pass
+
+
+def get_http_session():
+    """Return the process-wide pooled HTTP session shared by every provider."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                http = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+                http.mount("https://", adapter)
+                http.mount("http://", adapter)
+                _http_session = http
+    return _http_session
+
+
+class ProviderClient:
+    """Chat client for one OpenAI-compatible LLM provider."""
+
+    def __init__(self, name, label, api_key, api_base, model, limit=None, timeout=None,
+                 rate_limiter=None, retry_policy=None, breaker=None, observed=True):
+        self.name = name
+        self.label = label
+        self.api_key = api_key
+        self.api_base = (api_base or '').rstrip('/')
+        self.model = model
+        self.limit = limit
+        self.timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+        # Shared per provider, so they survive the client being rebuilt with a new key
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        # Clients that only check a candidate key keep their outcomes out of health and metrics
+        self.observed = observed
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _require_key(self):
+        if not self.configured:
+            raise ProviderError(self.name, f"{self.label} API key not configured")
+
+    def _report(self, success, started, error=None, usage=None):
+        """Tell the circuit breaker and the observers how a request went."""
+        if self.breaker is not None:
+            if success:
+                self.breaker.record_success()
+            elif is_provider_fault(error):
+                self.breaker.record_failure()
+        if self.observed:
+            _notify(self.name, success, started, error=error, usage=usage)
+
+    def _acquire_limit(self, cancel=None):
+        """Wait for a concurrency slot, giving up as soon as ``cancel`` is set."""
+        if self.limit is None:
+            return
+        if cancel is None:
+            self.limit.acquire()
+            return
+        while not self.limit.acquire(timeout=LIMIT_POLL_SECONDS):
+            if cancel.is_set():
+                raise ProviderCancelled(self.name, f"{self.label} request cancelled")
+
+    def _post(self, payload, stream=False):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        try:
+            response = get_http_session().post(
+                f"{self.api_base}/chat/completions",
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=self.timeout,
+                stream=stream
+            )
+        except requests.ConnectionError as e:
+            # The request never reached the provider, so it is safe to send again
+            raise ProviderError(self.name, f"{self.label} request failed: {str(e)}", retryable=True)
+        except requests.RequestException as e:
+            raise ProviderError(self.name, f"{self.label} request failed: {str(e)}")
+
+        if response.status_code != 200:
+            text = response.text
+            response.close()
+            if response.status_code in (401, 403):
+                message = f"{self.label} authentication failed: {text}"
+            else:
+                message = f"{self.label} API returned {response.status_code}: {text}"
+            raise ProviderError(self.name, message, response.status_code, response.headers)
+        return response
+
+    def _send(self, payload, stream=False, cancel=None):
+        """POST a request through the rate limiter, retrying transient failures.
+
+        Returns ``(response, started)``. Failed attempts are reported to the
+        observers as they happen; the caller reports the final outcome.
+        """
+        if self.retry_policy is not None:
+            self.retry_policy.budget.deposit()
+        attempt = 0
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpen(self.name, f"{self.label} is failing; circuit breaker open")
+            if self.rate_limiter is not None and not self.rate_limiter.acquire(cancel):
+                if cancel is not None and cancel.is_set():
+                    raise ProviderCancelled(self.name, f"{self.label} request cancelled")
+                raise ProviderThrottled(self.name, f"{self.label} rate limit reached; request not sent",
+                                        status_code=429, retryable=False)
+            # An attempt that lost while it waited must not reach the provider
+            if cancel is not None and cancel.is_set():
+                raise ProviderCancelled(self.name, f"{self.label} request cancelled")
+            started = time.perf_counter()
+            try:
+                response = self._post(payload, stream)
+            except ProviderError as e:
+                if self.rate_limiter is not None and e.status_code == 429:
+                    self.rate_limiter.on_throttle(e.headers)
+                delay = self.retry_policy.delay(e, attempt) if self.retry_policy is not None else None
+                if delay is None:
+                    raise
+                self._report(False, started, error=e)
+                attempt += 1
+                if cancel is not None:
+                    if cancel.wait(delay):
+                        raise ProviderCancelled(self.name, f"{self.label} request cancelled")
+                else:
+                    time.sleep(delay)
+                continue
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_success(response.headers)
+            return response, started
+
+    def _payload(self, messages, temperature, max_tokens, params):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens
+        }
+        if temperature is not None:
+            payload["temperature"] = temperature
+        payload.update(params)
+        return payload
+
+    def _usage(self, payload, reported=None, finish_reason=None):
+        """Token usage for observers: the provider's counts next to our estimate and budget."""
+        usage = dict(reported) if isinstance(reported, dict) else {}
+        usage['estimated_prompt_tokens'] = estimate_message_tokens(payload["messages"])
+        usage['max_tokens'] = payload.get("max_tokens")
+        usage['truncated'] = finish_reason == "length"
+        return usage
+
+    def complete(self, messages, temperature=0.7, max_tokens=1000, **params):
+        """Send a chat completion request and return the decoded JSON response."""
+        self._require_key()
+        payload = self._payload(messages, temperature, max_tokens, params)
+        self._acquire_limit()
+        started = time.perf_counter()
+        try:
+            response, started = self._send(payload)
+            try:
+                data = response.json()
+            except ValueError:
+                raise ProviderError(self.name, f"{self.label} returned invalid JSON")
+        except (ProviderCancelled, ProviderThrottled, CircuitOpen):
+            # Nothing reached the provider, so there is no outcome to report
+            raise
+        except ProviderError as e:
+            self._report(False, started, error=e)
+            raise
+        finally:
+            if self.limit is not None:
+                self.limit.release()
+        try:
+            finish_reason = data["choices"][0].get("finish_reason")
+        except (KeyError, IndexError, TypeError, AttributeError):
+            finish_reason = None
+        self._report(True, started, usage=self._usage(
+            payload, data.get("usage") if isinstance(data, dict) else None, finish_reason))
+        return data
+
+    def chat(self, messages, temperature=0.7, max_tokens=1000, cancel=None, **params):
+        """Send a chat completion request and return the reply text.
+
+        When a cancel event is given the reply is streamed so the request can
+        be abandoned between tokens, which closes the provider connection.
+        """
+        if cancel is not None:
+            parts = []
+            tokens = self.stream(messages, temperature, max_tokens, cancel=cancel, **params)
+            try:
+                for token in tokens:
+                    if cancel.is_set():
+                        raise ProviderCancelled(self.name, f"{self.label} request cancelled")
+                    parts.append(token)
+            finally:
+                tokens.close()
+            return ''.join(parts)
+
+        data = self.complete(messages, temperature, max_tokens, **params)
+        try:
+            return data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            raise ProviderError(self.name, f"{self.label} returned an unexpected response")
+
+    def stream(self, messages, temperature=0.7, max_tokens=1000, cancel=None, **params):
+        """Yield reply tokens as the provider streams them.
+
+        Failures before the first token are retried; ``cancel`` interrupts the waits.
+        """
+        self._require_key()
+        payload = self._payload(messages, temperature, max_tokens, params)
+        payload["stream"] = True
+        self._acquire_limit(cancel)
+        started = time.perf_counter()
+        finish_reason = None
+        try:
+            response, started = self._send(payload, stream=True, cancel=cancel)
+            with response:
+                # Event streams rarely declare a charset, but the payload is UTF-8
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        choice = json.loads(data)["choices"][0]
+                        finish_reason = choice.get("finish_reason") or finish_reason
+                        token = choice["delta"].get("content")
+                    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                        # e.g. an error object sent mid-stream instead of a chunk
+                        raise ProviderError(self.name, f"{self.label} returned an invalid stream chunk")
+                    if token:
+                        yield token
+        except requests.RequestException as e:
+            error = ProviderError(self.name, f"{self.label} stream failed: {str(e)}")
+            self._report(False, started, error=error)
+            raise error
+        except (ProviderCancelled, ProviderThrottled, CircuitOpen):
+            # Nothing reached the provider, so there is no outcome to report
+            raise
+        except ProviderError as e:
+            self._report(False, started, error=e)
+            raise
+        except GeneratorExit:
+            # The consumer stopped reading (e.g. this provider lost a race)
+            raise
+        else:
+            self._report(True, started, usage=self._usage(payload, finish_reason=finish_reason))
+        finally:
+            if self.limit is not None:
+                self.limit.release()
+
+    def ping(self, timeout=None):
+        """Check the provider is reachable and accepts the key, without spending tokens."""
+        self._require_key()
+        try:
+            response = get_http_session().get(
+                f"{self.api_base}/models",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=timeout or self.timeout
+            )
+        except requests.RequestException as e:
+            raise ProviderError(self.name, f"{self.label} request failed: {str(e)}")
+        with response:
+            if response.status_code in (401, 403):
+                raise ProviderError(self.name, f"{self.label} authentication failed: {response.text}", response.status_code)
+            if response.status_code != 200:
+                raise ProviderError(self.name, f"{self.label} API returned {response.status_code}: {response.text}", response.status_code)
@@ -0,0 +1,180 @@
+import random
+import re
+import threading
+import time
+
+# Statuses worth retrying: throttling and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+
+def parse_duration(value):
+    """Parse a reset header such as "7.66s", "2m59.56s", "120ms" or "30" into seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def _header(headers, name):
+    if not headers:
+        return None
+    return headers.get(name) if hasattr(headers, 'get') else None
+
+
+def retry_after(headers):
+    """Seconds the provider asked us to wait, from Retry-After or its reset headers."""
+    return parse_duration(_header(headers, 'retry-after')) or parse_duration(
+        _header(headers, 'x-ratelimit-reset-requests'))
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate adapts to the provider (AIMD).
+
+    Each success raises the rate a little, up to ``max_rate``. Each 429 halves
+    it and pauses the bucket for as long as the provider asked. Callers that
+    can't get a token right away wait their turn for up to ``max_wait``
+    seconds instead of failing.
+    """
+
+    def __init__(self, max_rate=10.0, burst=None, min_rate=0.2, increase=0.1, decrease=0.5, max_wait=10.0):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.capacity = burst or max(1.0, max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.max_wait = max_wait
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, cancel=None):
+        """Take a token, waiting up to ``max_wait``; return False if that's not enough."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Reserve a token now; a negative balance is the queue of waiting callers
+            wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+            if wait > self.max_wait:
+                return False
+            self.tokens -= 1
+        if wait > 0:
+            if cancel is not None:
+                if cancel.wait(wait):
+                    with self.lock:
+                        self.tokens += 1
+                    return False
+            else:
+                time.sleep(wait)
+        return True
+
+    def on_success(self, headers=None):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._learn(headers)
+
+    def on_throttle(self, headers=None):
+        with self.lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            pause = retry_after(headers)
+            if pause:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            self._learn(headers)
+
+    def _learn(self, headers):
+        # When the provider says the request quota is used up, wait for it to reset
+        remaining = _header(headers, 'x-ratelimit-remaining-requests')
+        if remaining is not None and str(remaining).strip() == '0':
+            reset = parse_duration(_header(headers, 'x-ratelimit-reset-requests'))
+            if reset:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + reset)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'rate': round(self.rate, 3),
+                'max_rate': self.max_rate,
+                'blocked_for': round(max(0.0, self.blocked_until - time.monotonic()), 3),
+                'throttled': self.throttled
+            }
+
+
+class RetryBudget:
+    """Caps retries to a share of recent traffic so retries can't snowball.
+
+    Every request deposits ``ratio`` tokens and every retry spends one. A
+    trickle of ``per_second`` tokens keeps retries possible at low traffic.
+    """
+
+    def __init__(self, ratio=0.2, per_second=0.5, max_tokens=20.0):
+        self.ratio = ratio
+        self.per_second = per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens / 2
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _add(self, amount):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + amount + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def deposit(self):
+        with self.lock:
+            self._add(self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            self._add(0)
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """Decides whether and when a failed provider request is retried."""
+
+    def __init__(self, max_retries=2, base_delay=0.5, max_delay=8.0, budget=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.retries = 0
+        self.exhausted = 0
+        self.lock = threading.Lock()
+
+    def delay(self, error, attempt):
+        """Seconds to wait before retry number ``attempt + 1``, or None to give up."""
+        if not getattr(error, 'retryable', False) or attempt >= self.max_retries:
+            return None
+        requested = retry_after(getattr(error, 'headers', None)) or 0.0
+        # A long provider-requested pause is better spent on the next provider
+        if requested > self.max_delay:
+            return None
+        if not self.budget.withdraw():
+            with self.lock:
+                self.exhausted += 1
+            return None
+        with self.lock:
+            self.retries += 1
+        # Full jitter keeps retries from many threads from arriving together
+        return max(requested, random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
@@ -0,0 +1,51 @@
+from prompts import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+# Sent in place of drafts that were revised later, so only the current draft is sent in full
+SUPERSEDED_DRAFT = "[Earlier draft, since revised]"
+# Longest an older request may be once it is folded into the summary
+SUMMARY_ITEM_CHARS = 160
+
+
+def new_history():
+    """Empty refinement history, stored in the session next to the current email."""
+    return {'instructions': [], 'summary': ''}
+
+
+def history_tokens(history):
+    """Estimated prompt tokens the history adds on top of the brief and current draft."""
+    turn_tokens = estimate_tokens(SUPERSEDED_DRAFT) + 2 * MESSAGE_OVERHEAD_TOKENS
+    return estimate_tokens(history['summary']) + sum(
+        estimate_tokens(instruction) + turn_tokens for instruction in history['instructions'])
+
+
+def summarize(summary, instruction, max_tokens):
+    """Add a request to the summary list, dropping the oldest items to stay within ``max_tokens``."""
+    item = ' '.join(instruction.split())
+    if len(item) > SUMMARY_ITEM_CHARS:
+        item = item[:SUMMARY_ITEM_CHARS - 1].rstrip() + '…'
+    # A repeated request only needs to be listed once, as the most recent
+    items = [line for line in summary.splitlines() if line and line != f"- {item}"]
+    items.append(f"- {item}")
+    while len(items) > 1 and estimate_tokens('\n'.join(items)) > max_tokens:
+        items.pop(0)
+    return '\n'.join(items)
+
+
+def record(history, instruction, max_turns=6, token_budget=400):
+    """Add an applied request, folding the oldest ones into the summary when over budget."""
+    instructions = history['instructions']
+    instructions.append(instruction)
+    while len(instructions) > 1 and (len(instructions) > max_turns or history_tokens(history) > token_budget):
+        history['summary'] = summarize(history['summary'], instructions.pop(0), token_budget // 2)
+    return history
+
+
+def conversation(history, email, instruction):
+    """Chat turns replaying earlier requests, ending with the current draft and the new request."""
+    turns = []
+    for previous in history['instructions']:
+        turns.append({"role": "assistant", "content": SUPERSEDED_DRAFT})
+        turns.append({"role": "user", "content": previous})
+    turns.append({"role": "assistant", "content": email})
+    turns.append({"role": "user", "content": instruction})
+    return turns
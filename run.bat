@@ -54,7 +54,19 @@ echo Note: The application will try to use DeepSeek API first, then Groq API as
 echo If both APIs fail, a basic template generator will be used.
 echo.
 
-REM Run the application
+REM Run the application ("run.bat --prod" starts the production server, passing on any further arguments)
 echo Starting the application...
+if not "%~1"=="--prod" goto dev
+set "SERVE_ARGS="
+:collect_args
+shift
+if "%~1"=="" goto prod
+set SERVE_ARGS=%SERVE_ARGS% %1
+goto collect_args
+:prod
+python serve.py%SERVE_ARGS%
+goto done
+:dev
 python cursor_prompt.py
+:done
 pause 
\ No newline at end of file
@@ -54,6 +54,11 @@ echo "Note: The application will try to use DeepSeek API first, then Groq API as
 echo "If both APIs fail, a basic template generator will be used."
 echo ""
 
-# Run the application
+# Run the application ("./run.sh --prod" starts the production server)
 echo "Starting the application..."
-python cursor_prompt.py 
\ No newline at end of file
+if [ "$1" == "--prod" ]; then
+    shift
+    python serve.py "$@"
+else
+    python cursor_prompt.py
+fi 
\ No newline at end of file
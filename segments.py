@@ -0,0 +1,109 @@
+import re
+import threading
+from collections import OrderedDict
+
+from cache import make_cache_key
+
+# Answers shared by every prospect in a segment
+SEGMENT_KEYS = ['audience', 'offering', 'pain_points', 'tone', 'special_notes']
+# What a placeholder becomes when the prospect row has no value for it
+MERGE_DEFAULTS = {'first_name': 'there', 'company': 'your company', 'opener': ''}
+
+# {{field}}; single braces are accepted too, since models sometimes drop one
+PLACEHOLDER = re.compile(r"\{\{?\s*([a-z_]+)\s*\}\}?")
+_BLANK_LINES = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)+")
+
+
+def segment_key(row):
+    """Identify the segment a prospect belongs to, ignoring case and spacing."""
+    return make_cache_key('segment', {key: row.get(key) for key in SEGMENT_KEYS})
+
+
+class MergeTemplate:
+    """An email with {{field}} placeholders, split once so rendering is a single join."""
+
+    def __init__(self, text):
+        # Even items are literal text, odd items are field names
+        self.parts = PLACEHOLDER.split(text)
+        self.fields = sorted(set(self.parts[1::2]))
+
+    def render(self, values):
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = str(values.get(parts[i]) or MERGE_DEFAULTS.get(parts[i], ''))
+        # A placeholder on its own line with nothing to fill in would leave a gap
+        return _BLANK_LINES.sub('\n\n', ''.join(parts))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SegmentTemplates:
+    """Base email per segment, generated once and shared by every prospect in it.
+
+    ``generate(inputs, fresh)`` returns a result dict holding the ``email``.
+    When several prospects of a new segment arrive together, one generates
+    and the rest wait for it. ``scope`` separates jobs that asked for fresh
+    emails from the shared entries.
+    """
+
+    def __init__(self, generate, max_entries=1000):
+        self.generate = generate
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.generated = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def get(self, row, fresh=False, scope=None):
+        """Return the segment's result dict (with its compiled ``template``) and whether this call generated it.
+
+        While providers are throttling, prospects that waited for the segment
+        get the same rate-limited result, so they are retried later with
+        backoff instead of all calling the provider at once. If the generating
+        worker fails outright, one waiter takes over and the rest keep waiting.
+        """
+        key = (scope, segment_key(row))
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.reused += 1
+                    return entry, False
+                waiting = self.pending.get(key)
+                if waiting is None:
+                    call = self.pending[key] = _Call()
+                    break
+            # Another worker is generating this segment; use its result when ready
+            waiting.done.wait()
+            if waiting.result is not None:
+                return waiting.result, False
+        try:
+            entry = self._generate(row, fresh)
+            # A throttled fallback is retried with the next prospect instead of kept
+            if not entry.get('rate_limited'):
+                with self.lock:
+                    self.entries[key] = entry
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            call.result = entry
+            return entry, True
+        finally:
+            with self.lock:
+                self.pending.pop(key)
+            call.done.set()
+
+    def _generate(self, row, fresh):
+        result = self.generate({key: row.get(key) for key in SEGMENT_KEYS if row.get(key)}, fresh)
+        with self.lock:
+            self.generated += 1
+        return dict(result, segment=segment_key(row)[:12], template=MergeTemplate(result['email']))
+
+    def stats(self):
+        with self.lock:
+            return {'segments': len(self.entries), 'generated': self.generated, 'reused': self.reused}
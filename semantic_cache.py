@@ -0,0 +1,191 @@
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+from cache import make_cache_key, normalize_text
+
+# How much each answer counts towards the overall similarity
+FIELD_WEIGHTS = {'audience': 0.3, 'offering': 0.3, 'pain_points': 0.2, 'tone': 0.1, 'special_notes': 0.1}
+# Filler words that say nothing about who the email is for
+STOPWORDS = frozenset("a an and at co for in is of on or our the their to with".split())
+# Features are hashed into this many buckets, so vectors stay small ints
+HASH_BUCKETS = 1 << 20
+
+_WORDS = re.compile(r"[a-z0-9]+")
+_NUMBERS = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def _feature(name):
+    return zlib.crc32(name.encode('utf-8')) % HASH_BUCKETS
+
+
+def vectorize(field, text):
+    """Hashed term counts for one answer: whole words plus character trigrams.
+
+    Trigrams let abbreviations and inflections partly match ("Eng" and
+    "Engineering", "people" and "person") without a language model.
+    """
+    counts = {}
+    for word in _WORDS.findall(normalize_text(text)):
+        if word in STOPWORDS:
+            continue
+        key = _feature(f"{field}:w:{word}")
+        counts[key] = counts.get(key, 0.0) + 1.0
+        padded = f"^{word}$"
+        for i in range(len(padded) - 2):
+            key = _feature(f"{field}:c:{padded[i:i + 3]}")
+            counts[key] = counts.get(key, 0.0) + 0.5
+    return counts
+
+
+def numbers(text):
+    """The numbers in an answer (company sizes, discounts, dates), which must match exactly."""
+    return frozenset(_NUMBERS.findall(str(text)))
+
+
+def analyze(inputs):
+    """Vectors and numbers for every answer."""
+    return {
+        field: (vectorize(field, inputs.get(field) or ''), numbers(inputs.get(field) or ''))
+        for field in FIELD_WEIGHTS
+    }
+
+
+class SemanticCache:
+    """In-memory index of earlier generations, matched by TF-IDF cosine similarity.
+
+    Every answer is compared separately and the scores are combined as a
+    weighted geometric mean, so one unrelated answer (a different audience or
+    tone) rules a match out however close the rest is. Answers that mention
+    different numbers never match. A prior email is reused when the score
+    reaches ``threshold``; entries are evicted least recently used past
+    ``max_entries``.
+    """
+
+    def __init__(self, max_entries=500, ttl=3600, threshold=0.9, recent=20):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.postings = {}
+        self.document_frequency = {}
+        self.hits = 0
+        self.misses = 0
+        self.recent_hits = deque(maxlen=recent)
+        self.lock = threading.Lock()
+
+    def _idf(self, feature):
+        return math.log((1 + len(self.entries)) / (1 + self.document_frequency.get(feature, 0))) + 1
+
+    def _field_similarity(self, a, b):
+        if not a and not b:
+            return 1.0
+        if not a or not b:
+            return 0.0
+        dot = 0.0
+        for feature, count in a.items():
+            if feature in b:
+                dot += count * b[feature] * self._idf(feature) ** 2
+        if not dot:
+            return 0.0
+        norm_a = math.sqrt(sum((count * self._idf(f)) ** 2 for f, count in a.items()))
+        norm_b = math.sqrt(sum((count * self._idf(f)) ** 2 for f, count in b.items()))
+        return dot / (norm_a * norm_b)
+
+    def similarity(self, analyzed, other):
+        """Similarity of two analyzed inputs, from 0 to 1."""
+        score = 1.0
+        for field, weight in FIELD_WEIGHTS.items():
+            vector, field_numbers = analyzed[field]
+            other_vector, other_numbers = other[field]
+            if field_numbers != other_numbers:
+                return 0.0
+            score *= self._field_similarity(vector, other_vector) ** weight
+        return score
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        for feature in entry['features']:
+            self.postings[feature].discard(entry_id)
+            if not self.postings[feature]:
+                del self.postings[feature]
+            self.document_frequency[feature] -= 1
+            if not self.document_frequency[feature]:
+                del self.document_frequency[feature]
+
+    def lookup(self, inputs, scope):
+        """Return ``(value, score)`` for the closest earlier generation.
+
+        ``value`` is None when nothing reaches the threshold; ``score`` is the
+        best similarity seen either way, which is what the threshold is tuned on.
+        """
+        analyzed = analyze(inputs)
+        now = time.time()
+        with self.lock:
+            # Only entries sharing at least one term can score above zero
+            candidates = set()
+            for vector, _ in analyzed.values():
+                for feature in vector:
+                    candidates.update(self.postings.get(feature, ()))
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                entry = self.entries[entry_id]
+                if entry['expires'] < now:
+                    self._remove(entry_id)
+                    continue
+                if entry['scope'] != scope:
+                    continue
+                score = self.similarity(analyzed, entry['analyzed'])
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None, best_score
+            self.hits += 1
+            entry = self.entries[best_id]
+            self.entries.move_to_end(best_id)
+            # Kept so hits can be reviewed by hand when tuning the threshold
+            self.recent_hits.append({
+                'score': round(best_score, 4),
+                'inputs': {field: inputs.get(field) for field in FIELD_WEIGHTS},
+                'matched': entry['inputs']
+            })
+            return entry['value'], best_score
+
+    def add(self, inputs, scope, value):
+        """Index a freshly generated email under its inputs."""
+        entry_id = make_cache_key('semantic', {'scope': scope, 'inputs': inputs})
+        analyzed = analyze(inputs)
+        with self.lock:
+            if entry_id in self.entries:
+                self._remove(entry_id)
+            # Two answers can hash to the same bucket; each is indexed once per entry
+            features = frozenset(feature for vector, _ in analyzed.values() for feature in vector)
+            self.entries[entry_id] = {
+                'scope': scope,
+                'analyzed': analyzed,
+                'features': features,
+                'inputs': {field: inputs.get(field) for field in FIELD_WEIGHTS},
+                'value': value,
+                'expires': time.time() + self.ttl
+            }
+            for feature in features:
+                self.postings.setdefault(feature, set()).add(entry_id)
+                self.document_frequency[feature] = self.document_frequency.get(feature, 0) + 1
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'threshold': self.threshold,
+                'recent_hits': list(self.recent_hits)
+            }
@@ -0,0 +1,116 @@
+"""Run the Cold Email Generator with a production WSGI server.
+
+Uses Gunicorn where available (Linux/macOS) and Waitress otherwise (Windows).
+Each worker process loads its own copy of the app; API keys saved through the
+UI are written to .env and picked up by every worker.
+
+    python serve.py --workers 2 --threads 16 --bind 0.0.0.0:8000
+"""
+import argparse
+import os
+import signal
+import sys
+import tempfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the Cold Email Generator in production mode.")
+    parser.add_argument('--bind', default=os.getenv("BIND", "127.0.0.1:5000"),
+                        help='host:port to listen on (default 127.0.0.1:5000)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv("WEB_WORKERS", "1")),
+                        help='worker processes (Gunicorn only, default 1)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv("WEB_THREADS", "16")),
+                        help='request threads per worker (default 16)')
+    parser.add_argument('--worker-class', default=os.getenv("WEB_WORKER_CLASS", "gthread"),
+                        help='Gunicorn worker class, e.g. gthread or gevent (default gthread)')
+    parser.add_argument('--timeout', type=int, default=int(os.getenv("WEB_TIMEOUT", "120")),
+                        help='seconds before a silent worker is restarted (default 120)')
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30")),
+                        help='seconds to let in-flight generations finish on shutdown (default 30)')
+    return parser.parse_args()
+
+
+def prepare_environment(args):
+    """Adjust settings that must agree across worker processes."""
+    # In-process sessions would be split between workers, so share them through SQLite
+    if args.workers > 1 and os.getenv("SESSION_BACKEND", "memory").lower() == "memory":
+        print("Using SQLite sessions so all workers share session state.")
+        os.environ["SESSION_BACKEND"] = "sqlite"
+    # Each worker serves /metrics for all of them by summing the files published here
+    if args.workers > 1:
+        metrics_dir = os.getenv("METRICS_DIR") or tempfile.mkdtemp(prefix='cold-email-metrics-')
+        os.makedirs(metrics_dir, exist_ok=True)
+        # Start from zero, like a single process would after a restart
+        for filename in os.listdir(metrics_dir):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(metrics_dir, filename))
+        os.environ["METRICS_DIR"] = metrics_dir
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    def worker_exit(server, worker):
+        # Let running generations and campaign rows finish before the worker exits
+        from cursor_prompt import shutdown_services
+        shutdown_services(timeout=args.graceful_timeout)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', args.bind)
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('worker_class', args.worker_class)
+            self.cfg.set('timeout', args.timeout)
+            self.cfg.set('graceful_timeout', args.graceful_timeout)
+            self.cfg.set('keepalive', 5)
+            self.cfg.set('worker_exit', worker_exit)
+
+        def load(self):
+            from cursor_prompt import create_app
+            return create_app()
+
+    Application().run()
+
+
+def run_waitress(args):
+    from waitress import serve
+
+    from cursor_prompt import create_app, shutdown_services
+
+    if args.workers > 1:
+        print("Waitress runs a single process; ignoring --workers and using threads only.")
+
+    # Turn SIGTERM into a normal shutdown so in-flight work can drain
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve(create_app(), listen=args.bind, threads=args.threads,
+              channel_timeout=args.timeout)
+    finally:
+        shutdown_services(timeout=args.graceful_timeout)
+
+
+def main():
+    args = parse_args()
+    prepare_environment(args)
+
+    try:
+        import gunicorn  # noqa: F401
+        use_gunicorn = sys.platform != 'win32'
+    except ImportError:
+        use_gunicorn = False
+
+    if use_gunicorn:
+        run_gunicorn(args)
+        return
+
+    try:
+        import waitress  # noqa: F401
+    except ImportError:
+        print("Neither gunicorn nor waitress is installed. Run: pip install -r requirements.txt")
+        sys.exit(1)
+    run_waitress(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer, want_bytes
+from werkzeug.datastructures import CallbackDict
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    """Session whose data lives in a server-side store, keyed by ``sid``."""
+
+    def __init__(self, initial=None, sid=None, raw=None, expires=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        # The serialized data as loaded, used to skip writes when nothing changed
+        self.raw = raw
+        self.expires = expires
+        self.modified = False
+
+
+class MemorySessionStore:
+    """In-process LRU session store with TTL eviction and an entry limit."""
+
+    def __init__(self, max_entries=10000, sweep_interval=60):
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_sweep = time.time()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self.entries[sid]
+                return None
+            self.entries.move_to_end(sid)
+            return entry
+
+    def set(self, sid, raw, expires):
+        with self.lock:
+            self.entries[sid] = (raw, expires)
+            self.entries.move_to_end(sid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if time.time() - self.last_sweep > self.sweep_interval:
+                self._sweep()
+
+    def delete(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+    def sweep(self):
+        with self.lock:
+            return self._sweep()
+
+    def _sweep(self):
+        now = time.time()
+        expired = [sid for sid, (_, expires) in self.entries.items() if expires < now]
+        for sid in expired:
+            del self.entries[sid]
+        self.last_sweep = now
+        return len(expired)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SQLiteSessionStore:
+    """Session store in a WAL-mode SQLite file, shareable by several processes."""
+
+    def __init__(self, path, sweep_every=500):
+        self.path = path
+        self.sweep_every = sweep_every
+        self.local = threading.local()
+        self.writes = 0
+        db = self._connect()
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def _connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def get(self, sid):
+        row = self._connect().execute(
+            "SELECT data, expires FROM sessions WHERE sid = ?", (sid,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row
+
+    def set(self, sid, raw, expires):
+        db = self._connect()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)",
+                (sid, raw, expires)
+            )
+        self.writes += 1
+        if self.writes % self.sweep_every == 0:
+            self.sweep()
+
+    def delete(self, sid):
+        db = self._connect()
+        with db:
+            db.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self):
+        db = self._connect()
+        with db:
+            return db.execute("DELETE FROM sessions WHERE expires < ?", (time.time(),)).rowcount
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class StoreSessionInterface(SessionInterface):
+    """Flask session interface keeping session data in a server-side store.
+
+    The cookie only carries a signed random session id. Data is stored as
+    JSON and only written back when it changed (or is about to expire).
+    """
+
+    # Sessions saved after a streamed response can still be persisted
+    supports_deferred_save = True
+
+    def __init__(self, store, ttl=86400):
+        self.store = store
+        self.ttl = ttl
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='session-id', key_derivation='hmac')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid:
+                entry = self.store.get(sid)
+                if entry is not None:
+                    raw, expires = entry
+                    return StoredSession(json.loads(raw), sid=sid, raw=raw, expires=expires)
+        return StoredSession(sid=secrets.token_urlsafe(24))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified or session.raw is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        raw = json.dumps(dict(session), separators=(',', ':'))
+        now = time.time()
+        # Skip the write if nothing changed and the entry is far from expiring
+        if raw == session.raw and session.expires and session.expires - now > self.ttl / 2:
+            return
+
+        expires = now + self.ttl
+        self.store.set(session.sid, raw, expires)
+        is_new = session.raw is None
+        session.raw = raw
+        session.expires = expires
+
+        if is_new or session.permanent:
+            response.set_cookie(
+                name,
+                self._signer(app).sign(want_bytes(session.sid)).decode('utf-8'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+
+class CookieSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed cookie sessions; state can't be saved once a stream started."""
+
+    supports_deferred_save = False
+
+
+BACKENDS = ('memory', 'sqlite', 'cookie', 'filesystem')
+
+
+def configure_sessions(app, backend, ttl=86400, path='sessions.sqlite3', max_entries=10000):
+    """Install the session interface for the named backend on a Flask app."""
+    backend = (backend or 'memory').lower()
+    if backend == 'memory':
+        app.session_interface = StoreSessionInterface(MemorySessionStore(max_entries), ttl)
+    elif backend == 'sqlite':
+        app.session_interface = StoreSessionInterface(SQLiteSessionStore(path), ttl)
+    elif backend == 'cookie':
+        app.session_interface = CookieSessionInterface()
+    elif backend == 'filesystem':
+        # The original Flask-Session filesystem store, kept for compatibility
+        from flask_session import Session
+
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
+        app.session_interface.supports_deferred_save = True
+    else:
+        raise ValueError(f"Unknown session backend: {backend}")
+    return app.session_interface
@@ -0,0 +1,53 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class SingleFlight:
+    """Lets identical requests that arrive together share one provider call.
+
+    The first caller for a key becomes the leader and does the work; callers
+    that ``join`` while it is in flight wait for the leader to ``finish`` and
+    get its value. A leader that fails finishes with None, and the waiters
+    then do the work themselves.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def join(self, key):
+        """Return ``(leader, call)``: whether the caller must do the work, and the shared call."""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+                return True, call
+            return False, call
+
+    def wait(self, call, timeout=None):
+        """The leader's value, or None if it failed or took longer than ``timeout`` seconds."""
+        if not call.done.wait(timeout) or call.value is None:
+            return None
+        with self.lock:
+            self.coalesced += 1
+        return call.value
+
+    def finish(self, key, call, value):
+        """Hand the leader's value (None on failure) to everyone waiting on ``call``."""
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+        call.value = value
+        call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {'in_flight': len(self.calls), 'leaders': self.leaders, 'coalesced': self.coalesced}
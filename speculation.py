@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+class Speculator:
+    """Email drafts started in the background while the chat is still asking questions.
+
+    ``draft(inputs, cancel)`` generates from the answers given so far and
+    returns a result dict, or None if it failed or ``cancel`` was set. Each
+    chat session holds at most one draft under its token: starting another
+    cancels the stale one. Drafts nobody collects are cancelled after ``ttl``
+    seconds or when more than ``max_entries`` are waiting.
+    """
+
+    def __init__(self, draft, max_workers=4, max_entries=1000, ttl=600):
+        self.draft = draft
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counts = {'started': 0, 'cancelled': 0, 'taken': 0}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='speculate')
+        self.lock = threading.Lock()
+
+    def start(self, token, inputs):
+        """Begin drafting from ``inputs`` for a session, replacing any earlier draft."""
+        inputs = dict(inputs)
+        cancel = threading.Event()
+        with self.lock:
+            self._drop(token)
+            now = time.time()
+            while self.entries and (len(self.entries) >= self.max_entries
+                                    or next(iter(self.entries.values()))['expires'] < now):
+                self._drop(next(iter(self.entries)))
+            self.entries[token] = {
+                'inputs': inputs,
+                'cancel': cancel,
+                'future': self.executor.submit(self.draft, inputs, cancel),
+                'started': now,
+                'expires': now + self.ttl
+            }
+            self.counts['started'] += 1
+
+    def inputs(self, token):
+        """The answers a session's pending draft was started from, or None."""
+        with self.lock:
+            entry = self.entries.get(token)
+            return entry['inputs'] if entry is not None else None
+
+    def take(self, token, max_age):
+        """Claim a session's draft as ``(inputs, result)``.
+
+        A draft still in progress is waited for until it is ``max_age``
+        seconds old, so one that is slow or stuck isn't waited on for longer
+        than a new generation would take. Returns None when there is no
+        draft, it failed, or it didn't finish in time.
+        """
+        with self.lock:
+            entry = self.entries.pop(token, None)
+        if entry is None:
+            return None
+        try:
+            result = entry['future'].result(timeout=max(0.0, entry['started'] + max_age - time.time()))
+        except TimeoutError:
+            entry['cancel'].set()
+            return None
+        except Exception:
+            return None
+        if result is None:
+            return None
+        with self.lock:
+            self.counts['taken'] += 1
+        return entry['inputs'], result
+
+    def cancel(self, token):
+        """Abandon a session's draft, e.g. when the chat restarts."""
+        with self.lock:
+            self._drop(token)
+
+    def _drop(self, token):
+        entry = self.entries.pop(token, None)
+        if entry is not None:
+            entry['cancel'].set()
+            if not entry['future'].done():
+                self.counts['cancelled'] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, pending=len(self.entries))
@@ -15,6 +15,8 @@ $(document).ready(function() {
     
     // Variables
     let isFirstMessage = true;
+    // Set while a chat request is in flight, so a second click or Enter doesn't send it twice
+    let requestPending = false;
     let apiStatus = {
         deepseek: { status: 'unknown' },
         groq: { status: 'unknown' }
@@ -163,8 +165,9 @@ $(document).ready(function() {
         });
     });
     
-    // Check API status
-    function checkApiStatus() {
+    // Check API status (the server answers from its background health checks)
+    function checkApiStatus(attempt) {
+        attempt = attempt || 0;
         $.ajax({
             url: '/check-api',
             method: 'GET',
@@ -172,6 +175,16 @@ $(document).ready(function() {
                 apiStatus = response.apis;
                 updateApiStatusDisplay();
                 
+                // The first health checks may still be running; ask again shortly
+                if (response.status === 'pending') {
+                    if (attempt < 10) {
+                        setTimeout(function() {
+                            checkApiStatus(attempt + 1);
+                        }, 1500);
+                    }
+                    return;
+                }
+                
                 if (response.status === 'error') {
                     appendBotMessage(`⚠️ API Connection Warning: All APIs failed to connect. The application will use a basic template generator.`);
                 } else {
@@ -208,6 +221,8 @@ $(document).ready(function() {
             statusHtml += '<span class="badge bg-success me-2">DeepSeek: Connected</span>';
         } else if (apiStatus.deepseek.status === 'error') {
             statusHtml += '<span class="badge bg-danger me-2" title="' + (apiStatus.deepseek.message || 'Connection failed') + '">DeepSeek: Failed</span>';
+        } else if (apiStatus.deepseek.status === 'pending') {
+            statusHtml += '<span class="badge bg-warning text-dark me-2">DeepSeek: Checking...</span>';
         } else {
             statusHtml += '<span class="badge bg-secondary me-2">DeepSeek: Not Configured</span>';
         }
@@ -217,6 +232,8 @@ $(document).ready(function() {
             statusHtml += '<span class="badge bg-success me-2">Groq: Connected</span>';
         } else if (apiStatus.groq.status === 'error') {
             statusHtml += '<span class="badge bg-danger me-2" title="' + (apiStatus.groq.message || 'Connection failed') + '">Groq: Failed</span>';
+        } else if (apiStatus.groq.status === 'pending') {
+            statusHtml += '<span class="badge bg-warning text-dark me-2">Groq: Checking...</span>';
         } else {
             statusHtml += '<span class="badge bg-secondary me-2">Groq: Not Configured</span>';
         }
@@ -237,7 +254,7 @@ $(document).ready(function() {
     // Handle user input
     function handleUserInput() {
         const message = userInput.val().trim();
-        if (message) {
+        if (message && !requestPending) {
             appendUserMessage(message);
             userInput.val('');
             showTypingIndicator();
@@ -245,42 +262,145 @@ $(document).ready(function() {
         }
     }
     
-    // Send request to server
+    // Send request to server, streaming generated emails as they are written
     function sendRequest(message) {
-        $.ajax({
-            url: '/chat',
+        requestPending = true;
+        sendButton.prop('disabled', true);
+        fetch('/chat/stream', {
             method: 'POST',
-            contentType: 'application/json',
-            data: JSON.stringify({ message: message }),
-            success: function(response) {
-                hideTypingIndicator();
-                appendBotMessage(response.message);
-                
-                // If an email was generated, display it
-                if (response.email) {
-                    // Clean up the email if it contains error messages
-                    let emailText = response.email;
-                    if (emailText.startsWith("⚠️ Error:") || emailText.startsWith("⚠️ Authentication Error:")) {
-                        const templateStart = emailText.indexOf("Here's a basic email template instead:");
-                        if (templateStart !== -1) {
-                            emailText = emailText.substring(templateStart + "Here's a basic email template instead:".length).trim();
-                        }
-                    }
-                    
-                    emailContent.text(emailText);
-                    emailDisplay.removeClass('d-none');
-                    // Scroll to the email display
-                    $('html, body').animate({
-                        scrollTop: emailDisplay.offset().top - 100
-                    }, 500);
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ message: message })
+        })
+        .then(function(response) {
+            if (!response.ok) {
+                return response.text().then(function(text) {
+                    throw new Error(text);
+                });
+            }
+            
+            const contentType = response.headers.get('Content-Type') || '';
+            if (contentType.indexOf('text/event-stream') === -1 || !response.body) {
+                return response.json().then(handleChatResponse);
+            }
+            return readEmailStream(response);
+        })
+        .catch(function(error) {
+            hideTypingIndicator();
+            appendBotMessage("Sorry, there was an error processing your request. Please try again.");
+            console.error('Error:', error);
+        })
+        .finally(function() {
+            requestPending = false;
+            sendButton.prop('disabled', false);
+        });
+    }
+    
+    // Handle a complete (non-streamed) chat response
+    function handleChatResponse(response) {
+        hideTypingIndicator();
+        appendBotMessage(response.message);
+        
+        // If an email was generated, display it
+        if (response.email) {
+            showEmail(response.email, response.parts);
+        }
+    }
+    
+    // Read server-sent events and render tokens as they arrive
+    function readEmailStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let prefix = '';
+        let emailText = '';
+        let messageElement = null;
+        // Restored if the stream is cut off before the email is finished
+        const previousEmail = emailContent.text();
+        const hadEmail = !emailDisplay.hasClass('d-none');
+        
+        function handleEvent(rawEvent) {
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(function(line) {
+                if (line.startsWith('event:')) {
+                    eventName = line.substring(6).trim();
+                } else if (line.startsWith('data:')) {
+                    data += line.substring(5).trim();
                 }
-            },
-            error: function(xhr) {
+            });
+            if (!data) {
+                return;
+            }
+            const payload = JSON.parse(data);
+            
+            if (eventName === 'start') {
+                hideTypingIndicator();
+                prefix = payload.message;
+                messageElement = appendBotMessage(prefix);
+            } else if (eventName === 'token') {
+                emailText += payload.token;
+                messageElement.find('.message').text(prefix + emailText);
+                emailContent.text(emailText);
+                emailDisplay.removeClass('d-none');
+                scrollToBottom();
+            } else if (eventName === 'done') {
+                messageElement.find('.message').text(payload.message);
+                showEmail(payload.email, payload.parts);
+            } else if (eventName === 'error') {
                 hideTypingIndicator();
-                appendBotMessage("Sorry, there was an error processing your request. Please try again.");
-                console.error('Error:', xhr.responseText);
+                if (messageElement) {
+                    messageElement.find('.message').text(payload.message);
+                } else {
+                    appendBotMessage(payload.message);
+                }
+                emailContent.text(previousEmail);
+                emailDisplay.toggleClass('d-none', !hadEmail);
             }
-        });
+        }
+        
+        function pump() {
+            return reader.read().then(function(result) {
+                if (result.done) {
+                    if (buffer.trim()) {
+                        handleEvent(buffer);
+                    }
+                    return;
+                }
+                buffer += decoder.decode(result.value, { stream: true });
+                let boundary = buffer.indexOf('\n\n');
+                while (boundary !== -1) {
+                    handleEvent(buffer.substring(0, boundary));
+                    buffer = buffer.substring(boundary + 2);
+                    boundary = buffer.indexOf('\n\n');
+                }
+                return pump();
+            });
+        }
+        
+        return pump();
+    }
+    
+    // Display the finished email in the email panel, written from its parsed parts
+    function showEmail(email, parts) {
+        emailContent.text(parts ? formatEmail(parts) : email);
+        emailDisplay.removeClass('d-none');
+        // Scroll to the email display
+        $('html, body').animate({
+            scrollTop: emailDisplay.offset().top - 100
+        }, 500);
+    }
+    
+    // Join the parts the server parsed, leaving out any error notice
+    function formatEmail(parts) {
+        const header = [];
+        if (parts.subject) {
+            header.push('Subject: ' + parts.subject);
+        }
+        if (parts.preheader) {
+            header.push('Preheader: ' + parts.preheader);
+        }
+        const blocks = [header.join('\n'), parts.greeting].concat(parts.body || [], [parts.cta, parts.signoff]);
+        return blocks.filter(function(block) { return block; }).join('\n\n');
     }
     
     // Append user message to chat
@@ -297,6 +417,7 @@ $(document).ready(function() {
         messageElement.find('.message').text(message);
         messagesContainer.append(messageElement);
         scrollToBottom();
+        return messageElement;
     }
     
     // Show typing indicator
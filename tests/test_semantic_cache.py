@@ -0,0 +1,42 @@
+import os
+import random
+import string
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from semantic_cache import SemanticCache, vectorize
+
+
+def colliding_answers():
+    """An audience and an offering whose hashed features share a bucket."""
+    rng = random.Random(0)
+    words = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 12))) for _ in range(20000)]
+    buckets = {}
+    for word in words:
+        for feature in vectorize('audience', word):
+            buckets.setdefault(feature, word)
+    for word in words:
+        for feature in vectorize('offering', word):
+            if feature in buckets:
+                return buckets[feature], word
+    raise AssertionError("no collision found")
+
+
+def test_evicts_entries_with_colliding_features():
+    audience, offering = colliding_answers()
+    cache = SemanticCache(max_entries=1)
+    cache.add({'audience': audience, 'offering': offering, 'tone': 'formal'}, 'scope', 'first')
+    cache.add({'audience': 'dentists', 'offering': 'bookkeeping', 'tone': 'warm'}, 'scope', 'second')
+    assert list(entry['value'] for entry in cache.entries.values()) == ['second']
+    assert all(cache.postings.values())
+    assert all(count > 0 for count in cache.document_frequency.values())
+
+
+def test_expired_colliding_entries_are_dropped_on_lookup():
+    audience, offering = colliding_answers()
+    cache = SemanticCache(ttl=-1)
+    inputs = {'audience': audience, 'offering': offering, 'tone': 'formal'}
+    cache.add(inputs, 'scope', 'email')
+    assert cache.lookup(inputs, 'scope')[0] is None
+    assert not cache.entries and not cache.postings and not cache.document_frequency
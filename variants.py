@@ -0,0 +1,38 @@
+import re
+
+# "=== Variant 2 ===", "### Variant 2", "**Variant 2:**" and similar header lines
+VARIANT_HEADER = re.compile(r'^[ \t#*=_-]*variant[ \t]*\d+[ \t:.)*=_-]*$', re.IGNORECASE | re.MULTILINE)
+# "Subject: ...", optionally bolded or written as "Subject line:"
+SUBJECT_LINE = re.compile(r'^[ \t*]*subject(?:[ \t]+line)?[ \t*]*:[ \t*]*(.+?)[ \t*]*$', re.IGNORECASE | re.MULTILINE)
+# Horizontal rules some models put between emails
+TRAILING_RULE = re.compile(r'(?:\n[ \t]*[-=*_]{3,}[ \t]*)+$')
+
+
+def split_subject(email):
+    """Split an email into its subject line and body."""
+    email = TRAILING_RULE.sub('', email.strip()).strip()
+    match = SUBJECT_LINE.search(email)
+    if not match:
+        return {'subject': '', 'body': email, 'email': email}
+    subject = match.group(1)
+    body = email[match.end():].strip()
+    return {'subject': subject, 'body': body, 'email': f"Subject: {subject}\n\n{body}"}
+
+
+def parse_variants(text, count=None):
+    """Parse a reply holding several emails into a list of subject/body dicts."""
+    parts = VARIANT_HEADER.split(text)
+    if len(parts) < 2:
+        # No variant headers; fall back to starting a new email at every subject line
+        starts = [match.start() for match in SUBJECT_LINE.finditer(text)]
+        if len(starts) > 1:
+            parts = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+    else:
+        # Anything before the first header is the model's preamble
+        parts = parts[1:]
+
+    variants = [split_subject(part) for part in parts if part.strip()]
+    variants = [variant for variant in variants if variant['body']]
+    if not variants and text.strip():
+        variants = [split_subject(text)]
+    return variants[:count] if count else variants